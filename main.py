@@ -1,14 +1,15 @@
 import argparse
+import os
 import subprocess
 import sys
 from pathlib import Path
 import shutil
-from src.data_generator import DataGenerator
-from src.data_injester import DataInjester
-from dotenv import load_dotenv
+from src.config import load_config
 
 
-load_dotenv("cli.env")
+# Handlers import what they need themselves, so `up`, `down` and --help do not pay
+# for openai, httpx, tqdm and friends
+load_config()
 
 BASE_DIR = Path.cwd()
 TEMPLATE_DIR = Path(__file__).parent / "templates"
@@ -66,20 +67,352 @@ def handle_formbricks_down(args):
 
 
 
+# Run a generate or seed step, then write its metrics and profile if they were asked for, returns what the step returned
+def run_instrumented(args, obj, fn, **kwargs):
+    from src.metrics import Profiler
+
+    profiler = getattr(obj, "profiler", None) or (Profiler() if args.profile else None)
+    try:
+        if profiler:
+            return profiler.run(fn, **kwargs)
+        return fn(**kwargs)
+    finally:
+        if args.metrics_out:
+            obj.metrics.write(args.metrics_out)
+        if profiler:
+            profiler.dump(args.profile)
+
+# Add --rescan to a subcommand reading the corpus from the manifest
+def add_rescan_argument(parser):
+    parser.add_argument(
+        "--rescan",
+        action="store_true",
+        help="Reconcile the manifest with surveys/ and answers/ first, for files added, changed or deleted by hand"
+    )
+
+# Add --metrics-out and --profile to a subcommand
+def add_instrumentation_arguments(parser):
+    parser.add_argument(
+        "--metrics-out",
+        metavar="PATH",
+        help="Write phase timings, request latency histograms, bytes sent and token usage to PATH.json and PATH.prom"
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="FILE",
+        help="Write a cProfile/pstats dump of the run to FILE"
+    )
+
+
+"""
+    Handler for the whole workflow in one go: start Formbricks while generating, then create
+    surveys and upload their answers as soon as each of them is ready
+"""
+def handle_formbricks_all(args):
+    from src.completion_cache import CompletionCache
+    from src.data_generator import DataGenerator
+    from src.data_injester import DataInjester
+    from src.metrics import Metrics
+    from src.pipeline import Pipeline
+    from src.token_scheduler import TokenScheduler
+
+    start = None
+    if not args.no_docker:
+        check_dependencies()
+        setup_files()
+        start = docker_up
+
+    metrics = Metrics()
+    generator = DataGenerator(
+        concurrency=args.llm_concurrency,
+        batch_size=args.batch_size,
+        cache=None if args.no_cache else CompletionCache(),
+        metrics=metrics,
+        pack=args.pack,
+        stream=args.stream,
+        scheduler=TokenScheduler(tpm=args.tpm, rpm=args.rpm)
+    )
+    injester = DataInjester(
+        concurrency=args.concurrency,
+        retries=args.retries,
+        resume=args.resume,
+        metrics=metrics,
+        adaptive=not args.no_adaptive
+    )
+
+    obj = Pipeline(
+        generator,
+        injester,
+        start=start,
+        health_path=args.health_path,
+        ready_timeout=args.ready_timeout,
+        check_logic=not args.no_logic_check
+    )
+    run_instrumented(args, obj, obj.run, n=args.responses)
+    if not obj.seeded:
+        sys.exit(1)
+
 """
     Handler for generating surveys and answers via LLM
 """
 def handle_formbricks_generate(args):
+    from src.completion_cache import CompletionCache
+    from src.data_generator import DataGenerator
+    from src.metrics import Metrics, Profiler
+    from src.token_scheduler import TokenScheduler
+
+    if args.stream and args.answers_format != "jsonl":
+        print("--stream appends every user to its answers file as it arrives, it needs --answers-format jsonl")
+        sys.exit(1)
+
+    cache = None
+    if not args.no_cache:
+        cache = CompletionCache(
+            max_bytes=args.cache_max_mb * 1024 * 1024,
+            max_age=args.cache_max_age * 24 * 3600,
+            refresh=args.refresh
+        )
+
+    obj = DataGenerator(
+        concurrency=args.concurrency,
+        batch_size=args.batch_size,
+        shard_retries=args.shard_retries,
+        answer_format=args.answers_format,
+        cache=cache,
+        validate=args.validate,
+        metrics=Metrics(),
+        profiler=Profiler() if args.profile else None,
+        pack=args.pack,
+        pack_budget=args.pack_budget,
+        stream=args.stream,
+        scheduler=TokenScheduler(tpm=args.tpm, rpm=args.rpm)
+    )
+    run_instrumented(args, obj, obj.generate, n=args.responses)
+
+"""
+    Handler for the two steps of batch generation: prepare a Batch API input file,
+    ingest the results file
+"""
+def handle_formbricks_batch(args):
+    from src.data_generator import DataGenerator
+
+    obj = DataGenerator(batch_size=args.batch_size, validate=args.validate)
+
+    if args.action == "prepare":
+        obj.prepare_batch(args.file, n=args.responses)
+        return
+
+    if obj.ingest_batch(args.file):
+        sys.exit(1)
+
+"""
+    Handler for simulating answers offline, following the survey logic
+"""
+def handle_formbricks_simulate(args):
+    from src.response_simulator import ResponseSimulator
+
+    obj = ResponseSimulator(seed=args.seed, batch_size=args.batch_size, rescan=args.rescan)
+    if not obj.simulate(n=args.responses, ids=args.survey):
+        sys.exit(1)
+
+"""
+    Handler for validating surveys and answers against the validation schemas
+"""
+def handle_formbricks_validate(args):
+    from src.schema_validator import SchemaValidator
+
+    obj = SchemaValidator(workers=args.workers)
+    if not obj.report(obj.validate()):
+        sys.exit(1)
+
+"""
+    Handler for benchmarking generate and seed against local fakes
+"""
+def handle_formbricks_bench(args):
+    from src.bench import Benchmark
+
+    as_ints = lambda text: tuple(int(value) for value in text.split(","))
+    obj = Benchmark(
+        surveys=as_ints(args.surveys),
+        responses=as_ints(args.responses),
+        concurrency=as_ints(args.concurrency),
+        llm_latency=args.llm_latency,
+        api_latency=args.api_latency,
+        error_rate=args.error_rate,
+        database_url=args.database_url
+    )
+    results = obj.run(out=args.out, phases=args.phase or ("generate", "seed", "startup"))
+
+    if args.compare:
+        obj.compare(results, args.compare)
+
+    # a command that got slow to start fails the run, like a failing test would
+    if not all(result.get("ok", True) for result in results["results"]):
+        sys.exit(1)
+
+"""
+    Handler for replaying the seeded responses against Formbricks at a target arrival rate
+"""
+def handle_formbricks_loadtest(args):
+    from src.data_injester import DataInjester
+    from src.load_test import LoadProfile, LoadTest
+
+    profile = LoadProfile(
+        pattern=args.pattern,
+        rate=args.rate,
+        end_rate=args.end_rate,
+        duration=args.duration,
+        steps=args.steps,
+        poisson=args.poisson
+    )
+
+    target = None
+    survey_ids = None
+    stub = None
+    if args.stub:
+        from src.fake_servers import FakeFormbricks
+
+        # the stub accepts any survey id, nothing has to be seeded first
+        stub = FakeFormbricks(latency=args.stub_latency, capacity=args.stub_capacity).start()
+        target = {"host": stub.url, "environment_id": "stub", "api_key": "stub"}
+
+    try:
+        injester = DataInjester(target=target, rescan=args.rescan)
+        if stub:
+            survey_ids = {row["id"]: row["id"] for row in injester._survey_rows()}
+
+        obj = LoadTest(
+            injester,
+            profile,
+            window=args.window,
+            max_in_flight=args.max_in_flight,
+            timeout=args.timeout,
+            seed=args.seed
+        )
+        results = obj.run(out=args.out, survey_ids=survey_ids)
+    finally:
+        if stub:
+            stub.stop()
+
+    if results is None:
+        sys.exit(1)
+
+"""
+    Handler for checking the survey logic and the answers against it
+"""
+def handle_formbricks_check(args):
+    from src.data_injester import DataInjester
+
+    obj = DataInjester(rescan=args.rescan)
+    reports = obj.check_logic()
+    for report in reports:
+        print(report)
+
+    if not all(report.ok for report in reports):
+        sys.exit(1)
+
+"""
+    Handler for summarizing the generated answers from their columnar store
+"""
+def handle_formbricks_stats(args):
+    from src.column_store import ColumnStore
+    from src.manifest import Manifest
+
+    manifest = Manifest()
+    manifest.sync(args.rescan)
+    rows = [row for row in manifest.surveys(args.survey) if row["answers_path"] is not None]
+    if not rows:
+        print("No generated survey with answers, run formbricks generate or simulate first")
+        sys.exit(1)
+
+    obj = ColumnStore(workers=args.workers, force=args.rebuild)
+    obj.stats(rows, out=args.out)
+
+"""
+    Handler for flagging or dropping near-duplicate open text answers
+"""
+def handle_formbricks_dedup(args):
+    from src.dedup import Deduplicator
+    from src.manifest import Manifest
+
+    manifest = Manifest()
+    manifest.sync(args.rescan)
+    rows = [row for row in manifest.surveys(args.survey) if row["answers_path"] is not None]
+    if not rows:
+        print("No generated survey with answers, run formbricks generate or simulate first")
+        sys.exit(1)
+    if args.threshold is not None and not 0 < args.threshold <= 1:
+        print("--threshold must be between 0 and 1")
+        sys.exit(1)
 
-    obj = DataGenerator()
-    obj.generate()
+    obj = Deduplicator(threshold=args.threshold, drop=args.drop, workers=args.workers, manifest=manifest)
+    obj.run(rows, out=args.out)
 
 """
     Handler for uploading generating surveys and answers to formbricks
 """
 def handle_formbricks_seed(args):
-    obj = DataInjester()
-    obj.seed()
+    from src.data_injester import DataInjester
+    from src.metrics import Metrics, Profiler
+    from src.payload_compiler import PayloadCompiler
+
+    compiler = PayloadCompiler(workers=args.compile_workers, force=args.recompile)
+
+    if args.dedup_threshold is not None and not 0 < args.dedup_threshold <= 1:
+        print("--dedup-threshold must be between 0 and 1")
+        sys.exit(1)
+
+    sink = None
+    if args.sink == "postgres":
+        from src.postgres_sink import PostgresSink
+
+        if not args.database_url:
+            print("The postgres sink needs --database-url or DATABASE_URL in cli.env")
+            sys.exit(1)
+        sink = PostgresSink(args.database_url, batch_size=args.copy_batch, metrics=Metrics())
+
+    if args.topology:
+        if sink:
+            print("--topology only supports the api sink")
+            sys.exit(1)
+
+        from src.topology import TopologySeeder
+
+        obj = TopologySeeder(
+            args.topology,
+            concurrency=args.concurrency,
+            retries=args.retries,
+            resume=args.resume,
+            check_logic=not args.no_logic_check,
+            validate=args.validate,
+            dedup=args.dedup,
+            dedup_threshold=args.dedup_threshold,
+            adaptive=not args.no_adaptive,
+            compiler=compiler,
+            rescan=args.rescan,
+            profiler=Profiler() if args.profile else None
+        )
+        # a target whose worker failed has no result
+        if len(run_instrumented(args, obj, obj.seed)) < len(obj.targets):
+            sys.exit(1)
+        return
+
+    obj = DataInjester(
+        concurrency=args.concurrency,
+        retries=args.retries,
+        resume=args.resume,
+        check_logic=not args.no_logic_check,
+        validate=args.validate,
+        dedup=args.dedup,
+        dedup_threshold=args.dedup_threshold,
+        metrics=sink.metrics if sink else Metrics(),
+        sink=sink,
+        adaptive=not args.no_adaptive,
+        compiler=compiler,
+        rescan=args.rescan
+    )
+    if not run_instrumented(args, obj, obj.seed):
+        sys.exit(1)
 
 def main():
     parser = argparse.ArgumentParser(prog="main.py")
@@ -112,19 +445,403 @@ def main():
     down_parser.set_defaults(func=handle_formbricks_down)
     # --- formbricks down command - END ---
 
+    # --  formbricks all command ---
+    all_parser = formbricks_subcommands.add_parser(
+        "all",
+        help="Start Formbricks, generate and seed in one go, overlapping the three"
+    )
+    all_parser.add_argument("-n", "--responses", type=int, default=5, help="Number of answers generated per survey (default: 5)")
+    all_parser.add_argument("--llm-concurrency", type=int, default=4, help="Max number of LLM requests in flight (default: 4)")
+    all_parser.add_argument("--batch-size", type=int, default=50, help="Max users per answers completion (default: 50)")
+    all_parser.add_argument("--pack", action="store_true", help="Ask for several surveys per completion")
+    all_parser.add_argument("--stream", action="store_true", help="Stream answers completions, users are uploaded as they arrive")
+    all_parser.add_argument("--tpm", type=int, help="Tokens per minute quota of the OpenAI account")
+    all_parser.add_argument("--rpm", type=int, help="Requests per minute quota of the OpenAI account")
+    all_parser.add_argument("--no-cache", action="store_true", help="Do not read or write the on-disk completion cache")
+    all_parser.add_argument("--concurrency", type=int, default=64, help="Max number of Formbricks requests in flight (default: 64)")
+    all_parser.add_argument("--no-adaptive", action="store_true", help="Keep --concurrency Formbricks requests in flight instead of adapting it")
+    all_parser.add_argument("--retries", type=int, default=3, help="Retries per request on 429, 5xx and connection errors (default: 3)")
+    all_parser.add_argument("--resume", action="store_true", help="Continue an interrupted run, skipping surveys and responses already uploaded")
+    all_parser.add_argument("--no-logic-check", action="store_true", help="Upload answers even if they fail the logic check")
+    all_parser.add_argument("--no-docker", action="store_true", help="Do not run docker compose up, Formbricks is already running at FORMBRICKS_HOST")
+    all_parser.add_argument("--health-path", default="/health", help="Path polled until Formbricks is ready (default: /health)")
+    all_parser.add_argument("--ready-timeout", type=float, default=300.0, help="Seconds to wait for Formbricks to be ready (default: 300)")
+    add_instrumentation_arguments(all_parser)
+    all_parser.set_defaults(func=handle_formbricks_all)
+    # --  formbricks all command - END ---
+
     # --  formbricks generate command --- 
     generate_parser = formbricks_subcommands.add_parser(
         "generate",
         help="Generate questions and answers using the survey description prompts json"
     )
+    generate_parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=4,
+        help="Max number of LLM requests running in parallel (default: 4)"
+    )
+    generate_parser.add_argument(
+        "-n", "--responses",
+        type=int,
+        default=5,
+        help="Number of users to generate answers for, per survey (default: 5)"
+    )
+    generate_parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=50,
+        help="Max users requested in a single completion, larger counts are sharded (default: 50)"
+    )
+    generate_parser.add_argument(
+        "--shard-retries",
+        type=int,
+        default=2,
+        help="How many times a failed answers shard is retried on its own (default: 2)"
+    )
+    generate_parser.add_argument(
+        "--answers-format",
+        choices=["jsonl", "json"],
+        default="jsonl",
+        help="Store answers as jsonl, one respondent per line, or as a single json document (default: jsonl)"
+    )
+    generate_parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Do not read or write the on-disk completion cache"
+    )
+    generate_parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="Ignore cached completions and overwrite them with fresh ones"
+    )
+    generate_parser.add_argument(
+        "--cache-max-mb",
+        type=int,
+        default=512,
+        help="Evict least recently used completions above this size (default: 512)"
+    )
+    generate_parser.add_argument(
+        "--cache-max-age",
+        type=int,
+        default=30,
+        help="Evict completions older than this many days (default: 30)"
+    )
+    generate_parser.add_argument(
+        "--validate",
+        action="store_true",
+        help="Reject completions that do not match the validation schemas, failed answers shards are retried"
+    )
+    generate_parser.add_argument(
+        "--pack",
+        action="store_true",
+        help="Generate several surveys per completion, surveys missing from a reply are asked again on their own"
+    )
+    generate_parser.add_argument(
+        "--pack-budget",
+        type=int,
+        default=8000,
+        help="Token budget of a packed survey request, prompt and expected completion (default: 8000)"
+    )
+    generate_parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Stream answers completions and append every user to its answers file as soon as it is complete"
+    )
+    generate_parser.add_argument(
+        "--tpm",
+        type=int,
+        help="Tokens per minute quota of the OpenAI account, requests are held back to stay under it"
+    )
+    generate_parser.add_argument(
+        "--rpm",
+        type=int,
+        help="Requests per minute quota of the OpenAI account, requests are held back to stay under it"
+    )
+    add_instrumentation_arguments(generate_parser)
     generate_parser.set_defaults(func=handle_formbricks_generate)
     # --  formbricks generate command - END ---
 
+    # --  formbricks batch command --- 
+    batch_parser = formbricks_subcommands.add_parser(
+        "batch",
+        help="Generate through the OpenAI Batch API: write the pending prompts, then ingest the results"
+    )
+    batch_parser.add_argument(
+        "action",
+        choices=["prepare", "ingest"],
+        help="prepare writes the request file, ingest reads a results file into surveys/ and answers/"
+    )
+    batch_parser.add_argument(
+        "file",
+        help="Request file to write (prepare) or results file to read (ingest)"
+    )
+    batch_parser.add_argument(
+        "-n", "--responses",
+        type=int,
+        default=5,
+        help="Number of users to generate answers for, per survey (default: 5)"
+    )
+    batch_parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=50,
+        help="Max users requested in a single completion, larger counts are sharded (default: 50)"
+    )
+    batch_parser.add_argument(
+        "--validate",
+        action="store_true",
+        help="Reject results that do not match the validation schemas"
+    )
+    batch_parser.set_defaults(func=handle_formbricks_batch)
+    # --  formbricks batch command - END ---
+
+    # --  formbricks simulate command --- 
+    simulate_parser = formbricks_subcommands.add_parser(
+        "simulate",
+        help="Simulate answers for the generated surveys without an LLM"
+    )
+    simulate_parser.add_argument(
+        "-n", "--responses",
+        type=int,
+        default=1000,
+        help="Number of users to simulate, per survey (default: 1000)"
+    )
+    simulate_parser.add_argument(
+        "--seed",
+        type=int,
+        default=None,
+        help="Random seed, the same seed and surveys give the same answers"
+    )
+    simulate_parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=10000,
+        help="Users sampled per batch (default: 10000)"
+    )
+    simulate_parser.add_argument(
+        "--survey",
+        action="append",
+        help="Only simulate this survey id, can be repeated (default: every survey in surveys/)"
+    )
+    add_rescan_argument(simulate_parser)
+    simulate_parser.set_defaults(func=handle_formbricks_simulate)
+    # --  formbricks simulate command - END ---
+
+    # --  formbricks validate command --- 
+    validate_parser = formbricks_subcommands.add_parser(
+        "validate",
+        help="Validate the files in surveys/ and answers/ against the validation schemas"
+    )
+    validate_parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of worker processes (default: number of CPUs)"
+    )
+    validate_parser.set_defaults(func=handle_formbricks_validate)
+    # --  formbricks validate command - END ---
+
+    # --  formbricks bench command --- 
+    bench_parser = formbricks_subcommands.add_parser(
+        "bench",
+        help="Benchmark generate and seed against local fake OpenAI and Formbricks servers"
+    )
+    bench_parser.add_argument("--phase", action="append", choices=["generate", "seed", "startup"], help="Only run this phase, can be repeated")
+    bench_parser.add_argument("--surveys", default="5,20", help="Comma separated survey counts for generate (default: 5,20)")
+    bench_parser.add_argument("--responses", default="1000,5000", help="Comma separated response counts for seed (default: 1000,5000)")
+    bench_parser.add_argument("--concurrency", default="1,8,32", help="Comma separated concurrency levels (default: 1,8,32)")
+    bench_parser.add_argument("--llm-latency", type=float, default=0.2, help="Seconds added to every fake completion (default: 0.2)")
+    bench_parser.add_argument("--api-latency", type=float, default=0.02, help="Seconds added to every fake Formbricks request (default: 0.02)")
+    bench_parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests the fakes fail with a 503 (default: 0)")
+    bench_parser.add_argument("--database-url", help="Postgres to also run the seed scenarios against with the postgres sink")
+    bench_parser.add_argument("--out", default="bench_results.json", help="Results file (default: bench_results.json)")
+    bench_parser.add_argument("--compare", help="Previous results file to compare the throughput with")
+    bench_parser.set_defaults(func=handle_formbricks_bench)
+    # --  formbricks bench command - END ---
+
+    # --  formbricks loadtest command ---
+    loadtest_parser = formbricks_subcommands.add_parser(
+        "loadtest",
+        help="Replay the seeded responses against Formbricks at a target arrival rate"
+    )
+    loadtest_parser.add_argument("--pattern", choices=["constant", "ramp", "step"], default="constant", help="Shape of the arrival rate over time (default: constant)")
+    loadtest_parser.add_argument("--rate", type=float, default=10.0, help="Requests/sec, where ramp and step start (default: 10)")
+    loadtest_parser.add_argument("--end-rate", type=float, help="Requests/sec ramp and step end at (default: --rate)")
+    loadtest_parser.add_argument("--steps", type=int, default=4, help="Number of plateaus of the step pattern (default: 4)")
+    loadtest_parser.add_argument("--duration", type=float, default=60.0, help="Seconds of load (default: 60)")
+    loadtest_parser.add_argument("--poisson", action="store_true", help="Exponential gaps between arrivals instead of even ones")
+    loadtest_parser.add_argument("--seed", type=int, help="Random seed of the poisson arrivals")
+    loadtest_parser.add_argument("--window", type=float, default=5.0, help="Seconds per reported window (default: 5)")
+    loadtest_parser.add_argument("--max-in-flight", type=int, default=512, help="Requests open at once, arrivals above it are dropped and reported (default: 512)")
+    loadtest_parser.add_argument("--timeout", type=float, default=30.0, help="Seconds before a request counts as failed (default: 30)")
+    loadtest_parser.add_argument("--out", default="loadtest_results.json", help="Results file (default: loadtest_results.json)")
+    loadtest_parser.add_argument("--stub", action="store_true", help="Run against a local stand-in for Formbricks instead of FORMBRICKS_HOST")
+    loadtest_parser.add_argument("--stub-latency", type=float, default=0.02, help="Seconds the stub adds to every request (default: 0.02)")
+    loadtest_parser.add_argument("--stub-capacity", type=int, help="Requests the stub serves at once, it answers 429 above it")
+    add_rescan_argument(loadtest_parser)
+    loadtest_parser.set_defaults(func=handle_formbricks_loadtest)
+    # --  formbricks loadtest command - END ---
+
+    # --  formbricks check command --- 
+    check_parser = formbricks_subcommands.add_parser(
+        "check",
+        help="Check the survey logic and that answers only cover the questions shown to each user"
+    )
+    add_rescan_argument(check_parser)
+    check_parser.set_defaults(func=handle_formbricks_check)
+    # --  formbricks check command - END ---
+
+    # --  formbricks stats command --- 
+    stats_parser = formbricks_subcommands.add_parser(
+        "stats",
+        help="Summarize the generated answers: ratings, logic branches, completion and text lengths"
+    )
+    stats_parser.add_argument(
+        "--survey",
+        action="append",
+        help="Only summarize this survey id, can be repeated (default: every survey with answers)"
+    )
+    stats_parser.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="Convert the answers to columns again, even when they did not change"
+    )
+    stats_parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of worker processes converting answers (default: number of CPUs)"
+    )
+    stats_parser.add_argument(
+        "--out",
+        default=None,
+        help="Also write the summaries to this JSON file"
+    )
+    add_rescan_argument(stats_parser)
+    stats_parser.set_defaults(func=handle_formbricks_stats)
+    # --  formbricks stats command - END ---
+
+    # --  formbricks dedup command --- 
+    dedup_parser = formbricks_subcommands.add_parser(
+        "dedup",
+        help="Flag or drop near-duplicate open text answers and report their diversity"
+    )
+    dedup_parser.add_argument(
+        "--threshold",
+        type=float,
+        default=None,
+        help="Estimated Jaccard similarity from which an answer is a near-duplicate (default: the last run's, 0.8 at first)"
+    )
+    dedup_parser.add_argument(
+        "--drop",
+        action="store_true",
+        help="Remove the near-duplicates from the answers files instead of only flagging them"
+    )
+    dedup_parser.add_argument(
+        "--survey",
+        action="append",
+        help="Only this survey id, can be repeated (default: every survey with answers)"
+    )
+    dedup_parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of worker processes indexing answers (default: number of CPUs)"
+    )
+    dedup_parser.add_argument(
+        "--out",
+        default=None,
+        help="Also write the diversity metrics to this JSON file"
+    )
+    add_rescan_argument(dedup_parser)
+    dedup_parser.set_defaults(func=handle_formbricks_dedup)
+    # --  formbricks dedup command - END ---
+
     # --  formbricks generate command --- 
     seed_parser = formbricks_subcommands.add_parser(
         "seed",
         help="Upload Survey and answers generated via LLM"
     )
+    seed_parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=64,
+        help="Max number of requests in flight, the adaptive limit never goes above it (default: 64)"
+    )
+    seed_parser.add_argument(
+        "--no-adaptive",
+        action="store_true",
+        help="Keep --concurrency requests in flight instead of adapting it to the server"
+    )
+    seed_parser.add_argument(
+        "--retries",
+        type=int,
+        default=3,
+        help="Retries per request on 429, 5xx and connection errors (default: 3)"
+    )
+    seed_parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue an interrupted seed, skipping surveys and responses already uploaded"
+    )
+    seed_parser.add_argument(
+        "--no-logic-check",
+        action="store_true",
+        help="Upload even if the survey logic or the answers fail the logic check"
+    )
+    seed_parser.add_argument(
+        "--validate",
+        action="store_true",
+        help="Validate surveys and answers against the validation schemas before uploading"
+    )
+    seed_parser.add_argument(
+        "--dedup",
+        choices=["flag", "drop"],
+        default=None,
+        help="Run the near-duplicate check on the open text answers before uploading, drop removes the flagged answers"
+    )
+    seed_parser.add_argument(
+        "--dedup-threshold",
+        type=float,
+        default=None,
+        help="--threshold of the near-duplicate check (default: the last dedup run's, 0.8 at first)"
+    )
+    seed_parser.add_argument(
+        "--sink",
+        choices=["api", "postgres"],
+        default="api",
+        help="Post responses to the management API, or COPY them straight into the Formbricks database (default: api)"
+    )
+    seed_parser.add_argument(
+        "--database-url",
+        default=os.getenv("DATABASE_URL"),
+        help="Postgres URL of the Formbricks database, for --sink postgres (default: DATABASE_URL)"
+    )
+    seed_parser.add_argument(
+        "--copy-batch",
+        type=int,
+        default=5000,
+        help="Responses per COPY transaction, for --sink postgres (default: 5000)"
+    )
+    seed_parser.add_argument(
+        "--compile-workers",
+        type=int,
+        default=None,
+        help="Worker processes compiling changed surveys and answers into formbricks/compiled/ (default: number of CPUs)"
+    )
+    seed_parser.add_argument(
+        "--recompile",
+        action="store_true",
+        help="Compile every survey and answers file again, even when formbricks/compiled/ is up to date"
+    )
+    seed_parser.add_argument(
+        "--topology",
+        metavar="FILE",
+        help="Seed every target of this topology file, one worker process per target"
+    )
+    add_rescan_argument(seed_parser)
+    add_instrumentation_arguments(seed_parser)
     seed_parser.set_defaults(func=handle_formbricks_seed)
     # --  formbricks generate command - END ---
     
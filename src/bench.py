@@ -0,0 +1,311 @@
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+from src.fake_servers import FakeFormbricks, FakeOpenAI
+from src.metrics import percentiles
+
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+
+# Commands that must start fast, and the import time (ms) they may spend at most
+STARTUP_COMMANDS = (("formbricks", "--help"), ("formbricks", "down", "--help"))
+STARTUP_BUDGET_MS = 150
+# Modules only the commands that talk to OpenAI or Formbricks should import
+HEAVY_MODULES = ("openai", "httpx", "requests", "tqdm", "pydantic", "cuid2", "faker", "jsonschema")
+
+# Stand-in for the Formbricks "Response" table used by the postgres sink scenarios
+BENCH_SCHEMA = "formbricks_bench"
+BENCH_TABLE = f'{BENCH_SCHEMA}."Response"'
+
+
+# Lay out a throwaway working directory the way the CLI expects it
+def _prepare_workdir(workdir, surveys):
+
+    shutil.copytree(REPO_DIR / "schemas", workdir / "schemas")
+    (workdir / "prompts").mkdir()
+    with open(workdir / "prompts" / "survey_description_prompts.json", "w") as f:
+        json.dump({"surveys": [
+            {"id": f"b{i}", "prompt": f"Benchmark survey {i}: rate the product, then ask what to improve"}
+            for i in range(surveys)
+        ]}, f)
+
+
+"""
+    The scenarios run in a fresh process each, so ru_maxrss is the peak memory of that
+    scenario alone. They only talk to the fakes over HTTP.
+"""
+def _run_generate(workdir, openai_url, surveys, responses, concurrency):
+
+    os.chdir(workdir)
+    sys.stdout = open(os.devnull, "w")
+    os.environ["OPEN_AI_KEY"] = "bench"
+    os.environ["OPEN_AI_BASE_URL"] = f"{openai_url}/v1"
+
+    from src.data_generator import DataGenerator
+
+    generator = DataGenerator(concurrency=concurrency)
+    start = time.perf_counter()
+    failed = generator.generate(n=responses) or []
+    elapsed = time.perf_counter() - start
+
+    return {
+        "elapsed": elapsed,
+        "requests": len(generator.latencies),
+        "throughput": surveys / elapsed,
+        "throughput_unit": "surveys/sec",
+        "errors": len(failed),
+        "latency_ms": percentiles(generator.latencies),
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def _run_seed(workdir, formbricks_url, responses, concurrency, sink="api", database_url=None):
+
+    os.chdir(workdir)
+    sys.stdout = open(os.devnull, "w")
+    os.environ["FORMBRICKS_HOST"] = formbricks_url
+    os.environ["ENVIRONMENT_ID"] = "bench"
+    os.environ["API_KEY"] = "bench"
+
+    from src.data_injester import DataInjester
+
+    response_sink = None
+    if sink == "postgres":
+        from src.postgres_sink import PostgresSink
+        response_sink = PostgresSink(database_url, table=BENCH_TABLE)
+
+    # "api" keeps concurrency requests in flight, "adaptive" lets the limiter search up to it
+    injester = DataInjester(concurrency=concurrency, sink=response_sink, adaptive=sink == "adaptive")
+    start = time.perf_counter()
+    if not injester.seed():
+        raise RuntimeError("seed stopped before uploading anything")
+    elapsed = time.perf_counter() - start
+    summary = injester.upload_summary
+
+    return {
+        "elapsed": elapsed,
+        "requests": summary.total,
+        "throughput": summary.total / elapsed,
+        "throughput_unit": "responses/sec",
+        "errors": summary.failed,
+        "latency_ms": percentiles(summary.latencies),
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "final_concurrency": summary.concurrency,
+    }
+
+
+"""
+    Import time of a CLI command, from python -X importtime. Returns the total in ms
+    (top level imports only, they include their children) and the heavy modules it pulled in.
+    Raises RuntimeError when the command fails, its imports would look cheap.
+"""
+def _import_time(args):
+
+    res = subprocess.run(
+        [sys.executable, "-X", "importtime", str(REPO_DIR / "main.py"), *args],
+        capture_output=True, text=True, cwd=tempfile.gettempdir()
+    )
+    if res.returncode != 0:
+        output = [line for line in res.stderr.splitlines() if not line.startswith("import time:")]
+        raise RuntimeError(f"main.py {' '.join(args)} exited with {res.returncode}: {' '.join(output[-5:])}")
+
+    total_us = 0
+    modules = set()
+    for line in res.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        modules.add(name.strip())
+        if not name[1:].startswith(" "):
+            total_us += int(cumulative)
+
+    heavy = sorted(module for module in modules if module.split(".")[0] in HEAVY_MODULES and "." not in module)
+    return total_us / 1000, heavy
+
+
+def _in_child(fn, *args):
+
+    # tqdm reads its environment when imported, which the child does before running fn
+    os.environ["TQDM_DISABLE"] = "1"
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+        return pool.submit(fn, *args).result()
+
+
+class Benchmark():
+
+    """
+        Drive DataGenerator and DataInjester against local fakes of the OpenAI chat
+        completions API and the Formbricks management API, over several data sizes
+        and concurrency levels, and record throughput, latency percentiles and peak memory.
+    """
+    def __init__(self, surveys=(5, 20), responses=(1000, 5000), concurrency=(1, 8, 32),
+                 llm_latency=0.2, api_latency=0.02, error_rate=0.0, database_url=None):
+        self.surveys = surveys
+        self.responses = responses
+        self.concurrency = concurrency
+        self.llm_latency = llm_latency
+        self.api_latency = api_latency
+        self.error_rate = error_rate
+        # Postgres to run the seed scenarios against with the postgres sink too, None skips it
+        self.database_url = database_url
+
+    def _bench_generate(self, openai, results):
+
+        for surveys in self.surveys:
+            for concurrency in self.concurrency:
+                with tempfile.TemporaryDirectory() as tmp:
+                    workdir = Path(tmp)
+                    _prepare_workdir(workdir, surveys)
+                    result = _in_child(_run_generate, str(workdir), openai.url, surveys, 5, concurrency)
+
+                result.update({"phase": "generate", "size": surveys, "concurrency": concurrency})
+                print(self._line(result))
+                results.append(result)
+
+    # Empty stand-in of the Response table the postgres scenarios write to
+    def _prepare_database(self):
+
+        from src.postgres_sink import _psycopg, create_standin_table
+
+        with _psycopg().connect(self.database_url, autocommit=True) as conn:
+            create_standin_table(conn, BENCH_SCHEMA)
+
+    def _bench_seed(self, formbricks, results):
+
+        from src.fake_servers import FAKE_SURVEY
+        from src.response_simulator import ResponseSimulator
+
+        # (sink, concurrency), the adaptive scenario gets the highest concurrency as its ceiling,
+        # COPY runs on a single connection so concurrency does not apply to it
+        scenarios = [("api", concurrency) for concurrency in self.concurrency]
+        scenarios.append(("adaptive", max(self.concurrency)))
+        if self.database_url:
+            self._prepare_database()
+            scenarios.append(("postgres", 1))
+
+        for responses in self.responses:
+            for sink, concurrency in scenarios:
+                with tempfile.TemporaryDirectory() as tmp:
+                    workdir = Path(tmp)
+                    _prepare_workdir(workdir, 1)
+                    (workdir / "surveys").mkdir()
+                    with open(workdir / "surveys" / "survey_b0.json", "w") as f:
+                        json.dump(FAKE_SURVEY, f)
+
+                    cwd = os.getcwd()
+                    os.chdir(workdir)
+                    try:
+                        ResponseSimulator(seed=0).simulate_survey("b0", responses)
+                    finally:
+                        os.chdir(cwd)
+
+                    result = _in_child(
+                        _run_seed, str(workdir), formbricks.url, responses, concurrency, sink, self.database_url
+                    )
+
+                result.update({"phase": "seed", "size": responses, "concurrency": concurrency, "sink": sink})
+                print(self._line(result))
+                results.append(result)
+
+    # Import time of the commands that should not load the heavy dependencies
+    def _bench_startup(self, results):
+
+        for args in STARTUP_COMMANDS:
+            import_ms, heavy = _import_time(args)
+            result = {
+                "phase": "startup",
+                "size": " ".join(args),
+                "concurrency": 1,
+                "throughput": None,
+                "import_ms": round(import_ms, 1),
+                "budget_ms": STARTUP_BUDGET_MS,
+                "heavy_modules": heavy,
+                "ok": import_ms <= STARTUP_BUDGET_MS and not heavy,
+            }
+            print(self._line(result))
+            results.append(result)
+
+    def _line(self, result):
+
+        if result["phase"] == "startup":
+            return (
+                f"startup  {result['size']:<26} imports {result['import_ms']:.1f} ms "
+                f"(budget {result['budget_ms']} ms){', heavy: ' + ', '.join(result['heavy_modules']) if result['heavy_modules'] else ''}"
+                f" {'OK' if result['ok'] else 'OVER BUDGET'}"
+            )
+
+        latency = result["latency_ms"]
+        sink = f" sink={result['sink']:<8}" if "sink" in result else ""
+        return (
+            f"{result['phase']:<8} size={result['size']:<6} concurrency={result['concurrency']:<3}{sink} "
+            f"{result['throughput']:.1f} {result['throughput_unit']}, "
+            f"p50/p95/p99 {latency['p50']}/{latency['p95']}/{latency['p99']} ms, "
+            f"errors {result['errors']}, peak rss {result['peak_rss_kb'] / 1024:.1f} MB"
+            + (f", settled at {result['final_concurrency']}" if result.get("sink") == "adaptive" else "")
+        )
+
+    def run(self, out="bench_results.json", phases=("generate", "seed", "startup")):
+
+        results = []
+        if "startup" in phases:
+            self._bench_startup(results)
+        with FakeOpenAI(latency=self.llm_latency, error_rate=self.error_rate) as openai, \
+                FakeFormbricks(latency=self.api_latency, error_rate=self.error_rate) as formbricks:
+            if "generate" in phases:
+                self._bench_generate(openai, results)
+            if "seed" in phases:
+                self._bench_seed(formbricks, results)
+
+        document = {
+            "meta": {
+                "created": datetime.now(timezone.utc).isoformat(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpus": os.cpu_count(),
+                "llm_latency": self.llm_latency,
+                "api_latency": self.api_latency,
+                "error_rate": self.error_rate,
+            },
+            "results": results,
+        }
+        with open(out, "w") as f:
+            json.dump(document, f, indent=2)
+        print(f"Results written to {out}")
+
+        return document
+
+    # Print the throughput change of every scenario found in both runs
+    def compare(self, current, previous_path):
+
+        with open(previous_path) as f:
+            previous = json.load(f)
+
+        key = lambda result: (result["phase"], result["size"], result["concurrency"], result.get("sink", "api"))
+        before = {key(result): result for result in previous["results"]}
+
+        print(f"Compared with {previous_path}:")
+        for result in current["results"]:
+            old = before.get(key(result))
+            if not old or not old["throughput"]:
+                continue
+            change = (result["throughput"] - old["throughput"]) / old["throughput"] * 100
+            print(
+                f"  {result['phase']:<8} size={result['size']:<6} concurrency={result['concurrency']:<3}"
+                f"{' sink=' + result['sink'] if 'sink' in result else ''} "
+                f"{old['throughput']:.1f} -> {result['throughput']:.1f} {result['throughput_unit']} ({change:+.1f}%)"
+            )
@@ -0,0 +1,615 @@
+import array
+import json
+import mmap
+import os
+import shutil
+import tempfile
+import time
+
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from src.payload_compiler import file_hash, iter_answers
+from src.survey_logic import SurveyLogicGraph, condition_holds
+
+
+# Column kinds: a rating is its own value (1-255), a code indexes a dictionary of the
+# distinct answers, text is an offset-indexed utf-8 buffer. 0 is a missing answer in every lane.
+RATING = "rating"
+CODE = "code"
+TEXT = "text"
+
+# Text presence lane: empty answers ("" and []) are told apart for "submitted", answers that
+# are not strings are kept as json to read them back as they were
+TEXT_MISSING, TEXT_EMPTY, TEXT_STRING, TEXT_JSON, TEXT_JSON_EMPTY = range(5)
+
+# bytes.translate tables over the one byte lanes
+PRESENT = bytes([0] + [1] * 255)
+SUBMITTED = bytes([0, 0, 1, 1] + [0] * 252)
+
+MAX_TEXT_LENGTH = 0xFFFF
+
+# Code widths, a code column is widened when its dictionary outgrows them
+CODE_TYPECODES = (("B", 0xFF), ("H", 0xFFFF), ("I", 0xFFFFFFFF))
+
+
+def _is_rating(value):
+    return type(value) is int and 0 < value < 256
+
+
+def _key(value):
+    return json.dumps(value, sort_keys=True)
+
+
+class ColumnWriter():
+
+    """
+        Encodes one question's answers as they are read, one add() per respondent (None when
+        they did not answer). A closed question starts as a rating column and turns into a
+        code column on its first answer that is not a 1-255 integer. Text goes straight to
+        its buffer file, only the per respondent arrays are kept in memory.
+    """
+    def __init__(self, directory, qid, question_type):
+        self.directory = Path(directory)
+        self.qid = qid
+        self.question_type = question_type
+        self.kind = TEXT if "text" in question_type.lower() else RATING
+
+        # ratings, or text presence
+        self.lanes = bytearray()
+        self.codes = None
+        self.dictionary = []
+        self._codes = {}
+
+        if self.kind == TEXT:
+            self.lengths = array.array("H")
+            self.offsets = array.array("Q", [0])
+            self._text = open(self.directory / f"{qid}.text", "wb")
+
+    def _to_codes(self):
+
+        ratings = sorted(set(self.lanes) - {0})
+        table = bytearray(256)
+        for code, value in enumerate(ratings, 1):
+            table[value] = code
+            self._codes[_key(value)] = code
+            self.dictionary.append(value)
+        self.codes = array.array("B", self.lanes.translate(table))
+        self.lanes = None
+        self.kind = CODE
+
+    def _code(self, value):
+
+        key = _key(value)
+        code = self._codes.get(key)
+        if code is None:
+            code = self._codes[key] = len(self.dictionary) + 1
+            self.dictionary.append(value)
+            for typecode, limit in CODE_TYPECODES:
+                if code <= limit:
+                    if typecode != self.codes.typecode:
+                        self.codes = array.array(typecode, self.codes)
+                    break
+        return code
+
+    def add(self, value):
+
+        if self.kind == TEXT:
+            if value is None:
+                self.lanes.append(TEXT_MISSING)
+                self.lengths.append(0)
+                self.offsets.append(self.offsets[-1])
+                return
+            if isinstance(value, str):
+                text = value
+                self.lanes.append(TEXT_STRING if value else TEXT_EMPTY)
+            else:
+                text = json.dumps(value)
+                self.lanes.append(TEXT_JSON_EMPTY if value == [] else TEXT_JSON)
+            data = text.encode("utf-8")
+            self._text.write(data)
+            self.offsets.append(self.offsets[-1] + len(data))
+            self.lengths.append(min(MAX_TEXT_LENGTH, len(text)))
+            return
+
+        if self.kind == RATING:
+            if value is None or _is_rating(value):
+                self.lanes.append(value or 0)
+                return
+            self._to_codes()
+        # coded first, the code can widen the array
+        code = 0 if value is None else self._code(value)
+        self.codes.append(code)
+
+    # Write the column files, returns the column's meta
+    def close(self):
+
+        qid = self.qid
+        meta = {"kind": self.kind, "type": self.question_type}
+        if self.kind == RATING:
+            with open(self.directory / f"{qid}.u8", "wb") as f:
+                f.write(self.lanes)
+        elif self.kind == CODE:
+            with open(self.directory / f"{qid}.codes", "wb") as f:
+                self.codes.tofile(f)
+            meta.update(typecode=self.codes.typecode, dictionary=self.dictionary)
+        else:
+            self._text.close()
+            offsets = self.offsets if self.offsets[-1] >= 2 ** 32 else array.array("I", self.offsets)
+            with open(self.directory / f"{qid}.present", "wb") as f:
+                f.write(self.lanes)
+            with open(self.directory / f"{qid}.lengths", "wb") as f:
+                self.lengths.tofile(f)
+            with open(self.directory / f"{qid}.offsets", "wb") as f:
+                offsets.tofile(f)
+            meta["typecode"] = offsets.typecode
+        return meta
+
+
+"""
+    Convert one survey's answers into its column directory, runs inside a worker process.
+    Written to a temporary directory then swapped in, readers never see half a store.
+    Every respondent is decoded from json and added row by row, the json decoding is most of
+    the time: a conversion costs a pass over the answers file, only the queries are columnar.
+"""
+def build_columns(survey_path, answers_path, target, source):
+
+    with open(survey_path, encoding="utf-8") as f:
+        questions = json.load(f)["survey"]["questions"]
+    qids = [question["question_id"] for question in questions]
+
+    target = Path(target)
+    directory = Path(tempfile.mkdtemp(dir=target.parent, prefix=f"{target.name}.", suffix=".tmp"))
+    try:
+        writers = [
+            ColumnWriter(directory, question["question_id"], question.get("question_type", ""))
+            for question in questions
+        ]
+        respondents = 0
+        for _, answer in iter_answers(answers_path):
+            row = {item["question_id"]: item.get("value") for item in answer.get("answers", [])}
+            for writer in writers:
+                writer.add(row.get(writer.qid))
+            respondents += 1
+
+        columns = {writer.qid: writer.close() for writer in writers}
+        with open(directory / "meta.json", "w", encoding="utf-8") as f:
+            json.dump({"source": source, "respondents": respondents, "questions": qids, "columns": columns}, f)
+
+        old = None
+        if target.exists():
+            old = target.with_name(directory.name + ".old")
+            os.rename(target, old)
+        os.rename(directory, target)
+        if old is not None:
+            shutil.rmtree(old, ignore_errors=True)
+    except BaseException:
+        shutil.rmtree(directory, ignore_errors=True)
+        raise
+
+    return respondents
+
+
+class SurveyColumns():
+
+    """
+        Read side of one survey's column directory. Column files are memory-mapped on first
+        use, a summary only pages in the columns it reads.
+        Every question reads as a lane: one byte per respondent, 0 when they did not answer
+        it. Answers that hold a condition, answered questions and so on are byte lanes of 0/1
+        turned into one int (int.from_bytes), so combining them over all the respondents at
+        once is a single &, | or ^, and int.bit_count() counts the respondents in them.
+    """
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path / "meta.json", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.respondents = self.meta["respondents"]
+        self.columns = self.meta["columns"]
+        self._maps = {}
+        # lane with every respondent in it
+        self.everyone = int.from_bytes(b"\x01" * self.respondents, "little")
+
+    def _map(self, name):
+
+        if name not in self._maps:
+            with open(self.path / name, "rb") as f:
+                # an empty file cannot be mapped
+                if os.fstat(f.fileno()).st_size:
+                    self._maps[name] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                else:
+                    self._maps[name] = b""
+        return self._maps[name]
+
+    def close(self):
+
+        for mapped in self._maps.values():
+            if isinstance(mapped, mmap.mmap):
+                mapped.close()
+        self._maps = {}
+
+    def _array(self, name, typecode):
+
+        column = array.array(typecode)
+        column.frombytes(self._map(name))
+        return column
+
+    # One byte per respondent, 0 when missing: the rating, the code or the text presence
+    def lanes(self, qid):
+
+        column = self.columns[qid]
+        if column["kind"] == RATING:
+            return self._map(f"{qid}.u8")[:]
+        if column["kind"] == TEXT:
+            return self._map(f"{qid}.present")[:]
+        if column["typecode"] == "B":
+            return self._map(f"{qid}.codes")[:]
+        # wider codes only go through the lane as present / missing
+        return bytes(1 if code else 0 for code in self._array(f"{qid}.codes", column["typecode"]))
+
+    def mask(self, lanes, table=PRESENT):
+        return int.from_bytes(lanes.translate(table), "little")
+
+    # Answers as they were generated, None when missing, for what the lanes cannot answer
+    def values(self, qid):
+
+        column = self.columns[qid]
+        if column["kind"] == RATING:
+            for value in self.lanes(qid):
+                yield value or None
+        elif column["kind"] == CODE:
+            dictionary = column["dictionary"]
+            for code in self._array(f"{qid}.codes", column["typecode"]):
+                yield dictionary[code - 1] if code else None
+        else:
+            offsets = self._array(f"{qid}.offsets", column["typecode"])
+            text = self._map(f"{qid}.text")
+            for i, present in enumerate(self.lanes(qid)):
+                if present == TEXT_MISSING:
+                    yield None
+                    continue
+                value = str(text[offsets[i]:offsets[i + 1]], "utf-8")
+                yield value if present in (TEXT_EMPTY, TEXT_STRING) else json.loads(value)
+
+    # Mask of the respondents whose answer to qid holds the condition
+    def condition(self, qid, operator, expected):
+
+        column = self.columns[qid]
+        if column["kind"] == RATING:
+            table = bytes(
+                1 if value and condition_holds(operator, value, expected) else 0 for value in range(256)
+            )
+            return self.mask(self.lanes(qid), table)
+
+        if column["kind"] == CODE:
+            # the condition is evaluated once per distinct answer
+            truth = [0] + [1 if condition_holds(operator, value, expected) else 0 for value in column["dictionary"]]
+            if column["typecode"] == "B":
+                return self.mask(self.lanes(qid), bytes(truth + [0] * (256 - len(truth))))
+            codes = self._array(f"{qid}.codes", column["typecode"])
+            return int.from_bytes(bytes(truth[code] for code in codes), "little")
+
+        if operator == "submitted":
+            return self.mask(self.lanes(qid), SUBMITTED)
+        lanes = bytes(
+            1 if value is not None and condition_holds(operator, value, expected) else 0 for value in self.values(qid)
+        )
+        return int.from_bytes(lanes, "little")
+
+    # {value: respondents} of a rating or coded question
+    def distribution(self, qid):
+
+        column = self.columns[qid]
+        if column["kind"] == RATING:
+            lanes = self.lanes(qid)
+            return {value: count for value in range(1, 256) if (count := lanes.count(value))}
+
+        if column["typecode"] == "B":
+            lanes = self.lanes(qid)
+            counts = {code: lanes.count(code) for code in range(1, len(column["dictionary"]) + 1)}
+        else:
+            counts = Counter(self._array(f"{qid}.codes", column["typecode"]))
+        dictionary = column["dictionary"]
+        return {_key(dictionary[code - 1]): count for code, count in counts.items() if code and count}
+
+    # {length in characters: respondents} over the respondents who answered a text question
+    def text_lengths(self, qid):
+
+        with memoryview(self._map(f"{qid}.lengths")) as view, view.cast("H") as lengths:
+            counts = Counter(lengths)
+        missing = self._map(f"{qid}.present")[:].count(TEXT_MISSING)
+        counts[0] -= missing
+        return {length: count for length, count in counts.items() if count}
+
+
+def _share(count, total):
+    return count / total if total else 0.0
+
+
+# Smallest length with at least share of the respondents at or below it
+def _quantile(counts, share):
+
+    total = sum(counts.values())
+    seen = 0
+    for length in sorted(counts):
+        seen += counts[length]
+        if seen >= share * total:
+            return length
+    return 0
+
+
+# Power of two buckets: 0, 1, 2-3, 4-7, ...
+def _length_histogram(counts):
+
+    buckets = {}
+    for length, count in counts.items():
+        low = 0 if length == 0 else 1 << (length.bit_length() - 1)
+        buckets[low] = buckets.get(low, 0) + count
+    return [
+        [str(low) if low < 2 else f"{low}-{2 * low - 1}", count]
+        for low, count in sorted(buckets.items())
+    ]
+
+
+"""
+    Summary of one survey's answers from its columns: the answers to every question, how
+    often each logic rule sent respondents on, and how many answered every question shown.
+    The visible path of every respondent is followed over all of them at once: shown[i] is
+    the mask of the respondents shown question i, the respondents who answered it are split
+    between its rules in order (the first that holds wins, like SurveyLogicGraph.next_index),
+    the others go on to the next question. A jump backwards is not followed, the survey
+    then fails check anyway.
+"""
+def survey_stats(columns, graph):
+
+    everyone = columns.everyone
+    shown = [0] * (graph.end + 1)
+    shown[0] = everyone
+    incomplete = 0
+    missing_required = 0
+    hidden = 0
+    backwards = False
+    questions = {}
+
+    for i, qid in enumerate(graph.question_ids):
+        lanes = columns.lanes(qid)
+        answered = columns.mask(lanes)
+        at = shown[i]
+        skipped = at & (answered ^ everyone)
+        incomplete |= skipped
+        if qid in graph.required:
+            missing_required |= skipped
+        hidden |= answered & (at ^ everyone)
+
+        remaining = at & answered
+        evaluated = remaining.bit_count()
+        taken = 0
+        rules = []
+        for operator, expected, target in graph.rules[i]:
+            matched = remaining & columns.condition(qid, operator, expected)
+            remaining ^= matched
+            taken |= matched
+            shown[target] |= matched
+            backwards = backwards or target <= i
+            count = matched.bit_count()
+            rules.append({
+                "rule": operator if expected is None else f"{operator} {expected}",
+                "go_to": graph.question_ids[target] if target < graph.end else "end",
+                "taken": count,
+                "rate": _share(count, evaluated),
+            })
+        shown[i + 1] |= at ^ taken
+
+        column = columns.columns[qid]
+        summary = {
+            "type": column["type"],
+            "kind": column["kind"],
+            "shown": at.bit_count(),
+            "answered": (at & answered).bit_count(),
+            "rules": rules,
+            "fallthrough": _share(evaluated - taken.bit_count(), evaluated),
+        }
+        summary["completion"] = _share(summary["answered"], summary["shown"])
+
+        if column["kind"] == RATING:
+            distribution = columns.distribution(qid)
+            total = sum(distribution.values())
+            summary["distribution"] = distribution
+            summary["mean"] = _share(sum(value * count for value, count in distribution.items()), total)
+        elif column["kind"] == CODE:
+            distribution = columns.distribution(qid)
+            summary["values"] = sorted(distribution.items(), key=lambda item: -item[1])
+            # multiple choice answers are lists, every choice counts once per respondent
+            choices = Counter()
+            for key, count in distribution.items():
+                value = json.loads(key)
+                if isinstance(value, list):
+                    for choice in {_key(choice) for choice in value}:
+                        choices[choice] += count
+            if choices:
+                summary["choices"] = choices.most_common()
+        else:
+            lengths = columns.text_lengths(qid)
+            total = sum(lengths.values())
+            summary["mean_length"] = _share(sum(length * count for length, count in lengths.items()), total)
+            summary["length_p50"] = _quantile(lengths, 0.5)
+            summary["length_p95"] = _quantile(lengths, 0.95)
+            summary["length_histogram"] = _length_histogram(lengths)
+
+        questions[qid] = summary
+
+    respondents = columns.respondents
+    completed = respondents - incomplete.bit_count()
+    return {
+        "respondents": respondents,
+        "completed": completed,
+        "completion": _share(completed, respondents),
+        "missing_required": missing_required.bit_count(),
+        "answered_hidden": hidden.bit_count(),
+        "backwards_jumps": backwards,
+        "questions": questions,
+    }
+
+
+def _format_stats(id, stats, top=5):
+
+    respondents = stats["respondents"]
+    lines = [
+        f"Survey {id}: {respondents:,} respondents, {stats['completion']:.1%} answered every question they were shown, "
+        f"{stats['missing_required']:,} skipped a required question, {stats['answered_hidden']:,} answered hidden questions"
+    ]
+    if stats["backwards_jumps"]:
+        lines.append("  - the logic jumps backwards, the paths after those jumps are not followed")
+
+    for qid, question in stats["questions"].items():
+        line = (
+            f"  - {qid} ({question['type']}): shown to {_share(question['shown'], respondents):.1%}, "
+            f"answered by {question['completion']:.1%} of them"
+        )
+        if question["kind"] == RATING:
+            answered = sum(question["distribution"].values())
+            line += f", mean {question['mean']:.2f}: " + ", ".join(
+                f"{value}: {_share(count, answered):.1%}" for value, count in sorted(question["distribution"].items())
+            )
+        elif question["kind"] == CODE:
+            items = question.get("choices") or question["values"]
+            answered = question["answered"] or 1
+            line += ": " + ", ".join(f"{key}: {_share(count, answered):.1%}" for key, count in items[:top])
+            if len(items) > top:
+                line += f", ... {len(items) - top} more"
+        else:
+            answered = sum(count for _, count in question["length_histogram"])
+            line += (
+                f", {question['mean_length']:.0f} characters on average (p50 {question['length_p50']}, "
+                f"p95 {question['length_p95']}): "
+                + ", ".join(f"{label}: {_share(count, answered):.1%}" for label, count in question["length_histogram"])
+            )
+        lines.append(line)
+
+        for rule in question["rules"]:
+            lines.append(f"      if {rule['rule']} -> {rule['go_to']}: {rule['rate']:.1%}")
+        if question["rules"]:
+            lines.append(f"      otherwise -> next: {question['fallthrough']:.1%}")
+
+    return "\n".join(lines)
+
+
+class ColumnStore():
+
+    """
+        Columnar copy of the generated answers in formbricks/columns/, one directory per survey:
+        a file per question column and meta.json. Ratings are one byte per respondent, other
+        closed answers a code (one, two or four bytes) into a dictionary of the distinct answers,
+        text an offset-indexed utf-8 buffer with a presence and a length column. The files are
+        raw arrays, memory-mapped when read.
+        A survey is converted again only when its survey or answers file changed, like the
+        PayloadCompiler: same size and mtime, or same hash. Stale surveys are converted over
+        a process pool.
+    """
+    def __init__(self, path=Path("formbricks") / "columns", workers=None, force=False):
+        self.path = Path(path)
+        self.workers = workers or os.cpu_count() or 1
+        # force converts every survey again, whatever its meta says
+        self.force = force
+        self.built = 0
+        self.reused = 0
+
+    def _source(self, row):
+
+        answers = os.stat(row["answers_path"])
+        return {
+            "survey_hash": file_hash(row["path"]),
+            "answers_path": str(row["answers_path"]),
+            "answers_size": answers.st_size,
+            "answers_mtime_ns": answers.st_mtime_ns,
+        }
+
+    # True when the columns of a survey match its current files
+    def _fresh(self, row, source):
+
+        try:
+            with open(self.path / row["id"] / "meta.json", encoding="utf-8") as f:
+                built = json.load(f)["source"]
+        except (OSError, ValueError, KeyError):
+            return False
+        if self.force or built["survey_hash"] != source["survey_hash"] or built["answers_path"] != source["answers_path"]:
+            return False
+        if built["answers_size"] == source["answers_size"] and built["answers_mtime_ns"] == source["answers_mtime_ns"]:
+            return True
+        # touched but maybe not changed, the hash decides
+        source["answers_hash"] = file_hash(row["answers_path"])
+        if built.get("answers_hash") != source["answers_hash"]:
+            return False
+        self._touch(row["id"], source)
+        return True
+
+    # Remember the new mtime of an answers file that did not change, to skip the hash next time
+    def _touch(self, id, source):
+
+        meta_path = self.path / id / "meta.json"
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        meta["source"] = source
+        fd, tmp_path = tempfile.mkstemp(dir=meta_path.parent, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, meta_path)
+
+    """
+        Bring the columns of rows (manifest survey rows with answers) up to date.
+        Returns (built, reused) counts.
+    """
+    def build(self, rows):
+
+        self.path.mkdir(parents=True, exist_ok=True)
+        tasks = []
+        for row in rows:
+            source = self._source(row)
+            if self._fresh(row, source):
+                self.reused += 1
+                continue
+            source.setdefault("answers_hash", file_hash(row["answers_path"]))
+            tasks.append((row["path"], row["answers_path"], str(self.path / row["id"]), source))
+
+        if len(tasks) == 1 or (tasks and self.workers == 1):
+            for task in tasks:
+                build_columns(*task)
+        elif tasks:
+            with ProcessPoolExecutor(max_workers=min(self.workers, len(tasks))) as pool:
+                list(pool.map(build_columns, *zip(*tasks)))
+
+        self.built += len(tasks)
+        return len(tasks), len(rows) - len(tasks)
+
+    """
+        Summaries of the surveys in rows, built first where needed. Prints one report per
+        survey, writes them to out when given and returns {survey id: summary}.
+    """
+    def stats(self, rows, out=None):
+
+        rows = [row for row in rows if row["answers_path"] is not None]
+        start = time.perf_counter()
+        built, reused = self.build(rows)
+        print(f"Columns of {len(rows)} survey(s): {built} converted, {reused} reused in {time.perf_counter() - start:.2f}s")
+
+        results = {}
+        start = time.perf_counter()
+        respondents = 0
+        for row in rows:
+            with open(row["path"], encoding="utf-8") as f:
+                graph = SurveyLogicGraph(json.load(f))
+            columns = SurveyColumns(self.path / row["id"])
+            try:
+                results[row["id"]] = survey_stats(columns, graph)
+            finally:
+                columns.close()
+            respondents += results[row["id"]]["respondents"]
+            print(_format_stats(row["id"], results[row["id"]]))
+
+        print(f"Summarized {respondents:,} responses in {time.perf_counter() - start:.2f}s")
+        if out:
+            with open(out, "w") as f:
+                json.dump(results, f, indent=2)
+            print(f"Results written to {out}")
+        return results
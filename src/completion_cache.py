@@ -0,0 +1,114 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+from pathlib import Path
+
+
+class CompletionCache():
+
+    """
+        Content addressed on-disk cache for LLM completions.
+        Entries are keyed by a hash of everything that decides the completion
+        and are evicted once older than max_age, or least recently used first
+        once the cache grows over max_bytes.
+        The age of an entry is the time it was written: its file mtime, which
+        nothing changes after put(). A hit only sets the atime, the last use
+        the size based eviction goes by.
+    """
+    def __init__(self, path=".cache/completions", max_bytes=512 * 1024 * 1024, max_age=30 * 24 * 3600, refresh=False):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        # refresh ignores existing entries but still stores the new completions
+        self.refresh = refresh
+
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def key(self, model, system, prompt, response_format, variant=None):
+
+        raw = json.dumps([model, system, prompt, response_format, variant], sort_keys=True)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _entry_path(self, key):
+        return self.path / key[:2] / f"{key}.json"
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, key):
+
+        entry_path = self._entry_path(key)
+        if self.refresh:
+            self._count(False)
+            return None
+
+        try:
+            created = entry_path.stat().st_mtime
+            now = time.time()
+            if now - created > self.max_age:
+                entry_path.unlink(missing_ok=True)
+                self._count(False)
+                return None
+
+            with open(entry_path, encoding="utf-8") as f:
+                entry = json.load(f)
+            # the last use, the mtime stays the time the entry was written
+            os.utime(entry_path, (now, created))
+        except (OSError, ValueError):
+            self._count(False)
+            return None
+
+        self._count(True)
+        return entry["content"]
+
+    def put(self, key, content):
+
+        entry_path = self._entry_path(key)
+        entry_path.parent.mkdir(parents=True, exist_ok=True)
+
+        # write then rename so a crash or a concurrent reader never sees half an entry
+        fd, tmp_path = tempfile.mkstemp(dir=entry_path.parent, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"created": time.time(), "content": content}, f)
+        os.replace(tmp_path, entry_path)
+
+    # Drop the entries written more than max_age ago, then the least recently used ones until under max_bytes
+    def evict(self):
+
+        if not self.path.exists():
+            return 0
+
+        now = time.time()
+        entries = []
+        removed = 0
+
+        for entry_path in self.path.glob("*/*.json"):
+            stat = entry_path.stat()
+            if now - stat.st_mtime > self.max_age:
+                entry_path.unlink(missing_ok=True)
+                removed += 1
+                continue
+            entries.append((stat.st_atime, stat.st_size, entry_path))
+
+        size = sum(entry[1] for entry in entries)
+        for _, entry_size, entry_path in sorted(entries):
+            if size <= self.max_bytes:
+                break
+            entry_path.unlink(missing_ok=True)
+            size -= entry_size
+            removed += 1
+
+        return removed
+
+    def __str__(self):
+        return f"{self.hits} hits, {self.misses} misses"
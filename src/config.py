@@ -0,0 +1,15 @@
+from functools import lru_cache
+
+from dotenv import load_dotenv
+
+
+CONFIG_FILE = "cli.env"
+
+
+"""
+    Load cli.env into the environment, once per process whoever asks first.
+    Variables already set in the environment win over the file.
+"""
+@lru_cache(maxsize=None)
+def load_config():
+    load_dotenv(CONFIG_FILE)
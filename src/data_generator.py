@@ -1,21 +1,105 @@
-from pprint import pprint
 from openai import OpenAI
-import requests
+import hashlib
+import heapq
+import itertools
 import json
 import os
-from dotenv import load_dotenv
+import re
+import threading
+import time
 from tqdm import tqdm
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 from pathlib import Path
 
-load_dotenv('cli.env')
+from src.config import load_config
+from src.json_stream import ObjectStream
+from src.manifest import Manifest
+from src.metrics import Metrics
+from src.payload_compiler import file_hash
+from src.schema_validator import validate_document
+from src.token_scheduler import TokenScheduler
+
+# Rough number of completion tokens a single generated survey takes, used to size packs
+SURVEY_COMPLETION_TOKENS = 800
+# Rough number of completion tokens a single generated user takes, the scheduler corrects it from usage
+ANSWER_COMPLETION_TOKENS = 120
+
+
+# Answers shards batch ingests received for surveys still missing others, until the last one comes back
+BATCH_SHARDS_DIR = Path("formbricks") / "batch"
+
+
+# Rough token count of a text, about 4 characters per token for English and JSON
+def estimate_tokens(text):
+    return len(text) // 4 + 1
+
 
 class DataGenerator():
 
-    def __init__(self):
+    def __init__(self, concurrency=4, batch_size=50, shard_retries=2, answer_format="jsonl", cache=None, validate=False,
+                 metrics=None, profiler=None, pack=False, pack_budget=8000, on_saved=None, manifest=None, stream=False,
+                 scheduler=None):
 
+        load_config()
         self._key = os.getenv("OPEN_AI_KEY", None)
+        # Optional override so the generator can be pointed at any OpenAI compatible endpoint
+        self._base_url = os.getenv("OPEN_AI_BASE_URL", None)
+        self.model = "gpt-4o-mini"
+
+        # Max number of completions in flight at the same time
+        self.concurrency = max(1, concurrency)
+
+        # Max users asked for in a single answers completion, bigger N is split into shards
+        self.batch_size = max(1, batch_size)
+        # How many times a failed shard is retried on its own
+        self.shard_retries = shard_retries
+
+        # jsonl writes one respondent per line, json the legacy {user_id: {...}} document
+        self.answer_format = answer_format
+
+        # On-disk completion cache, None sends every prompt to the API
+        self.cache = cache
+        self.system_message = "You output ONLY valid JSON. No explanations."
+        self.response_format = { "type": "json_object" }
+
+        # Reject completions that do not match the validation schemas, they are retried like failed shards
+        self.validate = validate
+
+        # Seconds taken by every completion request sent to the API
+        self.latencies = []
+
+        # Phase timings, per endpoint latency and token usage, see src/metrics.py
+        self.metrics = metrics or Metrics()
+        # Optional src.metrics.Profiler, every pool job then runs under cProfile
+        self.profiler = profiler
+
+        # Bundle several survey goals in one completion, as many as fit in pack_budget tokens
+        self.pack = pack
+        self.pack_budget = pack_budget
+        # Prompt schemas are read once, path -> parsed json
+        self._schemas = {}
 
+        # on_saved(kind, id) is called from the worker threads once a survey ("survey") or all
+        # the answers of a survey ("answers") are on disk, so later steps can start on them
+        self.on_saved = on_saved
+        # Every saved or failed survey and answers file is recorded there, see src/manifest.py
+        self.manifest = manifest or Manifest()
+
+        # Stream answers completions and append every user to its jsonl file as soon as it is
+        # complete, on_saved("answers", id) then fires once per user
+        self.stream = stream
+        if stream and answer_format != "jsonl":
+            raise ValueError("Streamed answers are appended as they arrive, they need the jsonl answer format")
+        # survey id -> [open answers file, users written], the lock guards both
+        self._answer_files = {}
+        self._answer_lock = threading.Lock()
+
+        # Releases the completions against the TPM / RPM quotas, shortest survey work first,
+        # see src/token_scheduler.py. Without quotas it still orders the queue
+        self.scheduler = scheduler or TokenScheduler()
+        # reservation of the job running on the current worker thread
+        self._local = threading.local()
 
         self.survey_prompt = """
                         You are generating a survey definition.
@@ -77,6 +161,36 @@ class DataGenerator():
 
                             """
 
+        self.packed_survey_prompt = """
+                        You are generating several survey definitions at once.
+
+                        Rules:
+                        - Output MUST be valid JSON
+                        - Do NOT add explanations
+                        - Do NOT invent platform-specific fields
+                        - Use short stable question IDs: q1, q2, q3
+                        - Include conditional logic if appropriate
+                        - Define the type of question
+                        - Every survey is independent, do not mix goals
+
+                        Survey goals, keyed by survey id:
+                        << survey_goals >>
+
+                        Question types allowed:
+                        - rating (1-5 stars)
+                        - openText
+                        - single choice
+                        - multiple choice
+
+                        OUTPUT:
+                        Return ONLY a JSON object with one key per survey id above,
+                        each value being a survey that follows the JSON schema.
+
+                        JSON schema:
+                        << schema >>
+
+                        """
+
     def _load_survey_prompts(self):
 
         self.survey_prompts = {}
@@ -85,13 +199,18 @@ class DataGenerator():
             self.survey_prompts = json.load(f)
         
 
-    def _generate_survey_prompt(self, survey_prompt):
+    # Prompt schemas do not change during a run, they are read from disk once
+    def _load_schema(self, path):
+
+        if path not in self._schemas:
+            with open(path) as f:
+                self._schemas[path] = json.load(f)
+        return self._schemas[path]
 
-        self._load_survey_prompts()
 
-        question_schema = None
-        with open("schemas/question_schema.json") as f:
-            question_schema = json.load(f)
+    def _generate_survey_prompt(self, survey_prompt):
+
+        question_schema = self._load_schema("schemas/question_schema.json")
         prompt = self.survey_prompt.replace("<< schema >>", json.dumps(question_schema))
         prompt = prompt.replace("<< survey_goal >>", survey_prompt)
         return prompt
@@ -99,9 +218,7 @@ class DataGenerator():
 
     def _generate_answer_prompt(self, survey_json, n):
 
-        answer_schema = {}
-        with open("schemas/answer_schema.json") as f:
-            answer_schema = json.load(f)
+        answer_schema = self._load_schema("schemas/answer_schema.json")
         
         prompt = self.answer_prompt.replace("<< answer_schema_json >>", json.dumps(answer_schema)) \
                                     .replace("<< survey_json >>", json.dumps(survey_json)) \
@@ -116,8 +233,13 @@ class DataGenerator():
 
         ques_path.mkdir(exist_ok=True)
 
+        text = json.dumps(obj=question, indent=2)
         with open(f"surveys/survey_{id}.json","w") as f:
-            json.dump(obj=question, fp=f, indent=2)
+            f.write(text)
+        self.manifest.record_survey(id, f"surveys/survey_{id}.json", hashlib.sha256(text.encode("utf-8")).hexdigest())
+
+        if self.on_saved:
+            self.on_saved("survey", id)
     
     def _save_answers(self, answers, id):
 
@@ -125,41 +247,393 @@ class DataGenerator():
 
         answer_path.mkdir(exist_ok=True)
 
-        with open(f"answers/answers_{id}.json","w") as f:
-            json.dump(obj=answers, fp=f, indent=2)
+        # answers for a survey generated before the manifest existed, register the survey first
+        if self.manifest.survey(id) is None and Path(f"surveys/survey_{id}.json").exists():
+            self.manifest.record_survey(id, f"surveys/survey_{id}.json", file_hash(f"surveys/survey_{id}.json"))
+
+        path = answer_path / (f"answers_{id}.json" if self.answer_format == "json" else f"answers_{id}.jsonl")
+        if self.answer_format == "json":
+            with open(f"answers/answers_{id}.json","w") as f:
+                json.dump(obj=answers, fp=f, indent=2)
+        else:
+            with open(f"answers/answers_{id}.jsonl","w") as f:
+                for user_id, answer in answers.items():
+                    f.write(json.dumps({"user_id": user_id, **answer}) + "\n")
+
+            # do not leave a stale legacy file around for the same survey
+            legacy = answer_path / f"answers_{id}.json"
+            if legacy.exists():
+                legacy.unlink()
+        self.manifest.record_answers(id, path, len(answers), file_hash(path))
+
+        if self.on_saved:
+            self.on_saved("answers", id)
+
+    """
+        Append one streamed user to answers/answers_{id}.jsonl, the file is truncated by the
+        first user of a run so a survey whose stream returns nothing keeps its previous answers.
+        Readers (seed, the pipeline) can pick the users up right away, the manifest count
+        follows every line.
+    """
+    def _append_answer(self, id, user_id, answer):
+
+        path = Path("answers") / f"answers_{id}.jsonl"
+        line = json.dumps({"user_id": user_id, **answer}) + "\n"
+
+        with self._answer_lock:
+            entry = self._answer_files.get(id)
+            if entry is None:
+                path.parent.mkdir(exist_ok=True)
+                if self.manifest.survey(id) is None and Path(f"surveys/survey_{id}.json").exists():
+                    self.manifest.record_survey(id, f"surveys/survey_{id}.json", file_hash(f"surveys/survey_{id}.json"))
+                entry = self._answer_files[id] = [open(path, "w", encoding="utf-8"), 0]
+            # a single write per line, a reader never sees half of it
+            entry[0].write(line)
+            entry[0].flush()
+            entry[1] += 1
+            count = entry[1]
+
+        self.manifest.record_answers(id, path, count, None)
+        if self.on_saved:
+            self.on_saved("answers", id)
+
+    # Close the streamed answers of a survey once all of its shards are settled, returns the users written
+    def _close_answers(self, id):
+
+        with self._answer_lock:
+            entry = self._answer_files.pop(id, None)
+        if entry is None:
+            return 0
+
+        f, count = entry
+        f.close()
+        self.manifest.record_answers(id, f.name, count, file_hash(f.name))
+        return count
     
 
-    def generate_survey(self):
+    def _get_client(self):
 
-        
+        return OpenAI(api_key=self._key, base_url=self._base_url)
 
-        if not self._key:
-            print("No OPEN AI Key provided")
-            return
-        
-        self._load_survey_prompts()
 
-        client = OpenAI(api_key=self._key)
+    def _messages(self, prompt):
+
+        return [{
+                "role": "system",
+                "content": self.system_message
+        }, 
+        {
+            "role": "user",
+            "content":prompt
+        }]
+
+
+    """
+        Scheduler reservation of a request from raw estimates: the prompt text at about 4
+        characters per token, and the expected completion (SURVEY_COMPLETION_TOKENS per
+        survey, ANSWER_COMPLETION_TOKENS per user). The scheduler corrects both with the
+        usage reported by the previous requests of the same kind.
+    """
+    def _reservation(self, kind, prompt, completion_tokens):
+
+        prompt_tokens = estimate_tokens(self.system_message) + estimate_tokens(prompt)
+        return self.scheduler.estimate(kind, prompt_tokens, completion_tokens)
+
+    # Run a pool job with its reservation, the completion it sends settles it
+    def _scheduled(self, reservation, fn, *args):
+
+        self._local.reservation = reservation
+        try:
+            return fn(*args)
+        finally:
+            # a job that failed before sending anything keeps its reservation spent
+            self._local.reservation = None
+
+    # Settle the reservation of the current job with the usage of its completion, sent=False when served from the cache
+    def _settle(self, usage=None, sent=True):
+
+        reservation = getattr(self._local, "reservation", None)
+        if reservation is not None:
+            self._local.reservation = None
+            self.scheduler.settle(reservation, usage, sent)
 
 
-        for survey_prompt in tqdm(self.survey_prompts['surveys'], desc="Generating Surveys"):
-            prompt = self._generate_survey_prompt(survey_prompt['prompt'])
+    """
+        Send a single prompt and parse the JSON the model returns.
+        variant tells apart identical prompts that must not share a completion (answer shards),
+        check can reject a parsed reply before it is cached.
+    """
+    def _complete(self, client, prompt, variant=None, check=None, endpoint="openai"):
 
+        key = None
+        if self.cache:
+            key = self.cache.key(self.model, self.system_message, prompt, self.response_format, variant)
+            content = self.cache.get(key)
+            if content is not None:
+                self._settle(sent=False)
+                return json.loads(content)
+
+        messages = self._messages(prompt)
+        sent = len(json.dumps(messages).encode("utf-8"))
+
+        start = time.perf_counter()
+        try:
             resp = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[{
-                        "role": "system",
-                        "content": "You output ONLY valid JSON. No explanations."
-                }, 
-                {
-                    "role": "user",
-                    "content":prompt
-                }],
-                response_format={ "type": "json_object" }
+                model=self.model,
+                messages=messages,
+                response_format=self.response_format
             )
+        except Exception:
+            self.metrics.observe(endpoint, time.perf_counter() - start, sent, error=True)
+            self._settle()
+            raise
+        elapsed = time.perf_counter() - start
+        self.latencies.append(elapsed)
+        self.metrics.observe(endpoint, elapsed, sent)
+        self.metrics.add_usage(resp.usage)
+        self._settle(resp.usage)
+
+        content = resp.choices[0].message.content
+        with self.metrics.phase("parse_completion"):
+            data = json.loads(content)
+            if check:
+                check(data)
+
+        if key:
+            self.cache.put(key, content)
+
+        return data
+
+    """
+        Stream a completion and yield the (key, value) members of the JSON object it returns,
+        each one as soon as it is complete, see src/json_stream.py. A cached completion is
+        replayed the same way. The text is only kept, and cached, when the cache is on, and
+        only cached once the whole object arrived.
+    """
+    def _stream_members(self, client, prompt, variant=None, endpoint="openai"):
+
+        key = None
+        if self.cache:
+            key = self.cache.key(self.model, self.system_message, prompt, self.response_format, variant)
+            content = self.cache.get(key)
+            if content is not None:
+                self._settle(sent=False)
+                yield from json.loads(content).items()
+                return
+
+        messages = self._messages(prompt)
+        sent = len(json.dumps(messages).encode("utf-8"))
+        parser = ObjectStream()
+        chunks = [] if key else None
+
+        start = time.perf_counter()
+        first = None
+        usage = None
+        try:
+            with client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                response_format=self.response_format,
+                stream=True,
+                stream_options={"include_usage": True}
+            ) as stream:
+                for chunk in stream:
+                    # the last chunk has no choices, only the usage of the whole completion
+                    self.metrics.add_usage(chunk.usage)
+                    usage = chunk.usage or usage
+                    if not chunk.choices or not chunk.choices[0].delta.content:
+                        continue
+                    text = chunk.choices[0].delta.content
+                    if chunks is not None:
+                        chunks.append(text)
+                    for member in parser.feed(text):
+                        if first is None:
+                            first = time.perf_counter() - start
+                            self.metrics.observe(f"{endpoint}:first_member", first)
+                        yield member
+            parser.close()
+        except Exception:
+            self.metrics.observe(endpoint, time.perf_counter() - start, sent, error=True)
+            self._settle(usage)
+            raise
+        elapsed = time.perf_counter() - start
+        self.latencies.append(elapsed)
+        self.metrics.observe(endpoint, elapsed, sent)
+        self._settle(usage)
+
+        if key:
+            self.cache.put(key, "".join(chunks))
+
+
+    # Raise when a completion does not match its validation schema
+    def _check_schema(self, kind, data):
+
+        if not self.validate:
+            return
+
+        errors = validate_document(kind, data)
+        if errors:
+            raise ValueError(f"{len(errors)} schema error(s), first: {errors[0]}")
+
+
+    def _generate_one_survey(self, client, survey_prompt):
 
-            data = json.loads(resp.choices[0].message.content)
+        prompt = self._generate_survey_prompt(survey_prompt['prompt'])
+        data = self._complete(
+            client, prompt, check=lambda data: self._check_schema("survey", data), endpoint="openai:survey"
+        )
+        with self.metrics.phase("save"):
             self._save_survey(data, survey_prompt['id'])
+        return data
+
+
+    def _generate_packed_survey_prompt(self, survey_prompts):
+
+        goals = {survey_prompt['id']: survey_prompt['prompt'] for survey_prompt in survey_prompts}
+        question_schema = self._load_schema("schemas/question_schema.json")
+        # goals stay on a single line so the ids are easy to spot in the prompt
+        prompt = self.packed_survey_prompt.replace("<< schema >>", json.dumps(question_schema))
+        prompt = prompt.replace("<< survey_goals >>", json.dumps(goals))
+        return prompt
+
+
+    """
+        Group survey prompts into packs that fit in pack_budget tokens: the shared prompt
+        once, plus the goal and the expected completion of every survey in the pack.
+        A goal that does not fit next to any other one ends up alone in its pack.
+    """
+    def _pack_survey_prompts(self, survey_prompts):
+
+        fixed = estimate_tokens(self._generate_packed_survey_prompt([]))
+        packs = []
+        pack = []
+        used = fixed
+
+        for survey_prompt in survey_prompts:
+            cost = estimate_tokens(json.dumps(survey_prompt['prompt'])) + SURVEY_COMPLETION_TOKENS
+            if pack and used + cost > self.pack_budget:
+                packs.append(pack)
+                pack = []
+                used = fixed
+            pack.append(survey_prompt)
+            used += cost
+
+        if pack:
+            packs.append(pack)
+        return packs
+
+
+    """
+        Generate every survey of a pack in a single completion and save the ones that came back.
+        Returns {id: survey}, the ids missing from it have to be generated on their own.
+    """
+    def _generate_survey_pack(self, client, survey_prompts):
+
+        prompt = self._generate_packed_survey_prompt(survey_prompts)
+
+        def check(data):
+            if not isinstance(data, dict):
+                raise ValueError("packed completion is not a JSON object")
+
+        data = self._complete(client, prompt, check=check, endpoint="openai:survey_pack")
+
+        surveys = {}
+        for survey_prompt in survey_prompts:
+            id = survey_prompt['id']
+            survey = data.get(id)
+            if not isinstance(survey, dict):
+                continue
+            # the model sometimes drops the top level "survey" key inside a pack
+            if "survey" not in survey and "questions" in survey:
+                survey = {"survey": survey}
+            if "survey" not in survey:
+                continue
+            if self.validate and validate_document("survey", survey):
+                continue
+
+            with self.metrics.phase("save"):
+                self._save_survey(survey, id)
+            surveys[id] = survey
+
+        return surveys
+
+
+    # Split n users into (offset, size) shards of at most batch_size users
+    def _answer_shards(self, n):
+
+        return [
+            (offset, min(self.batch_size, n - offset))
+            for offset in range(0, n, self.batch_size)
+        ]
+
+
+    def _check_answer_shard(self, data, size):
+
+        self._check_schema("answers", data)
+        if len(data) < size:
+            raise ValueError(f"expected {size} users, got {len(data)}")
+
+
+    # Generate the users of a single shard, a short or invalid reply fails the shard
+    def _generate_answer_shard(self, client, survey, offset, size):
+
+        prompt = self._generate_answer_prompt(survey, size)
+        data = self._complete(
+            client, prompt, variant=f"shard-{offset}",
+            check=lambda data: self._check_answer_shard(data, size), endpoint="openai:answers"
+        )
+
+        return list(data.values())[:size]
+
+
+    """
+        Stream the users of a single shard straight to the answers file of the survey, under
+        their final ids. progress["received"] counts the users written, they are kept when
+        the stream fails halfway and only the rest of the shard is asked again.
+        A member that is not a respondent, an object with an answers list, is never written,
+        even without --validate: the shard comes up short and is retried like a failed one.
+    """
+    def _stream_answer_shard(self, client, survey, id, offset, size, n, progress):
+
+        width = max(3, len(str(n)))
+        prompt = self._generate_answer_prompt(survey, size)
+        members = self._stream_members(client, prompt, variant=f"shard-{offset}", endpoint="openai:answers")
+        rejected = 0
+
+        try:
+            for _, user in members:
+                # users past the size of the shard are ignored, the completion is still read to the end
+                if progress["received"] == size:
+                    continue
+                if not isinstance(user, dict) or not isinstance(user.get("answers"), list):
+                    rejected += 1
+                    continue
+                self._check_schema("answers", {"user": user})
+                self._append_answer(id, f"user_{offset + progress['received'] + 1:0{width}d}", user)
+                progress["received"] += 1
+        except Exception:
+            if progress["received"] < size:
+                raise
+        finally:
+            members.close()
+
+        if progress["received"] < size:
+            reason = f", {rejected} member(s) were not a respondent" if rejected else ""
+            raise ValueError(f"expected {size} users, got {progress['received']}{reason}")
+        return progress["received"]
+
+
+    # Merge shards and renumber users so ids are stable and never collide across shards
+    def _merge_answer_shards(self, shards, n):
+
+        width = max(3, len(str(n)))
+        merged = {}
+
+        for offset in sorted(shards):
+            for i, user in enumerate(shards[offset]):
+                merged[f"user_{offset + i + 1:0{width}d}"] = user
+
+        return merged
 
 
     def _get_survey(self, id):
@@ -171,54 +645,441 @@ class DataGenerator():
 
         with open(file_path) as f:
             return json.load(f)    
-    
+
+
+    """
+        Run surveys and answers generation on a bounded thread pool.
+        Answers are split into shards of at most batch_size users, and the
+        shards of a survey are queued as soon as that survey comes back.
+        A failed shard is retried on its own, the shards that succeeded are kept.
+        Queued requests are released by the token scheduler, the one with the least
+        estimated work left on its survey first, so started surveys are finished before
+        new ones are started and completed surveys per minute stay as high as the quota allows.
+    """
+    def _run_pipeline(self, surveys=True, answers=True, n=5):
+
+        if not self._key:
+            print("No OPEN AI Key provided")
+            return
+
+        with self.metrics.phase("generate"):
+            return self._run_jobs(surveys, answers, n)
+
+
+    def _run_jobs(self, surveys, answers, n):
+
+        self._load_survey_prompts()
+        client = self._get_client()
+        # pool jobs run in worker threads, each of them is profiled on its own thread
+        profiled = self.profiler.wrap if self.profiler else (lambda fn: fn)
+
+        plan = self._answer_shards(n)
+        survey_jobs = len(self.survey_prompts['surveys'])
+        total = survey_jobs * (int(surveys) + (len(plan) if answers else 0))
+
+        failed = []
+        # survey id -> {offset: users}
+        shard_results = {}
+        attempts = {}
+        # streamed survey id -> shards not settled yet, its users are already on disk
+        streaming = {}
+
+        # tokens of all the answers of a survey that is not generated yet, the survey is in every shard prompt
+        unstarted = sum(
+            self._reservation("answers", self._generate_answer_prompt({}, size), size * ANSWER_COMPLETION_TOKENS).tokens
+            + SURVEY_COMPLETION_TOKENS
+            for _, size in plan
+        ) if answers else 0
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool, \
+                tqdm(total=total, desc=f"Generating (concurrency {self.concurrency})") as bar:
+
+            pending = {}
+            # (estimated tokens left on the survey(s), order, reservation, job, args, pending entry)
+            queued = []
+            order = itertools.count()
+
+            def enqueue(remaining, reservation, job, args, entry):
+                heapq.heappush(queued, (remaining, next(order), reservation, job, args, entry))
+
+            # Start queued jobs while there is a free worker and quota, returns the seconds until the next one fits
+            def dispatch():
+                while queued and len(pending) < self.concurrency:
+                    delay = self.scheduler.reserve(queued[0][2])
+                    if delay:
+                        return delay
+                    _, _, reservation, job, args, entry = heapq.heappop(queued)
+                    pending[pool.submit(profiled(self._scheduled), reservation, job, *args)] = entry
+                return None
+
+            def shard_reservation(survey, size):
+                return self._reservation(
+                    "answers", self._generate_answer_prompt(survey, size), size * ANSWER_COMPLETION_TOKENS
+                )
+
+            # remaining: tokens left on the survey, the shard's own tokens when not given
+            def submit_shard(id, survey, offset, size, remaining=None, reservation=None):
+                attempts[(id, offset)] = attempts.get((id, offset), 0) + 1
+                reservation = reservation or shard_reservation(survey, size)
+                remaining = reservation.tokens if remaining is None else remaining
+                if self.stream:
+                    progress = {"received": 0}
+                    enqueue(
+                        remaining, reservation, self._stream_answer_shard,
+                        (client, survey, id, offset, size, n, progress), ("shard", id, (survey, offset, size, progress))
+                    )
+                    return
+                enqueue(
+                    remaining, reservation, self._generate_answer_shard,
+                    (client, survey, offset, size), ("shard", id, (survey, offset, size))
+                )
+
+            def submit_answers(id, survey):
+                if self.stream:
+                    streaming[id] = len(plan)
+                else:
+                    shard_results[id] = {}
+                # every shard of a survey is queued with the tokens of all of them
+                reservations = [shard_reservation(survey, size) for _, size in plan]
+                remaining = sum(reservation.tokens for reservation in reservations)
+                for (offset, size), reservation in zip(plan, reservations):
+                    submit_shard(id, survey, offset, size, remaining, reservation)
+
+            # A streamed shard is settled, the answers file is closed with the last one
+            def settle_stream(id):
+                streaming[id] -= 1
+                if streaming[id]:
+                    return
+                del streaming[id]
+                with self.metrics.phase("save"):
+                    count = self._close_answers(id)
+                if count < n:
+                    tqdm.write(f"Kept {count} of {n} users for {id}, the rest of its shards failed")
+                if count and self.on_saved:
+                    self.on_saved("answers", id)
+
+            def submit_survey(survey_prompt):
+                reservation = self._reservation(
+                    "survey", self._generate_survey_prompt(survey_prompt['prompt']), SURVEY_COMPLETION_TOKENS
+                )
+                enqueue(
+                    reservation.tokens + unstarted, reservation, self._generate_one_survey,
+                    (client, survey_prompt), ("survey", survey_prompt['id'], None)
+                )
+
+            if surveys and self.pack:
+                packs = self._pack_survey_prompts(self.survey_prompts['surveys'])
+                print(f"Packed {survey_jobs} survey goals into {len(packs)} request(s)")
+                for pack in packs:
+                    # a pack of one is the regular survey prompt, so it shares its cache entry
+                    if len(pack) == 1:
+                        submit_survey(pack[0])
+                        continue
+                    reservation = self._reservation(
+                        "survey_pack", self._generate_packed_survey_prompt(pack), SURVEY_COMPLETION_TOKENS * len(pack)
+                    )
+                    enqueue(
+                        reservation.tokens + unstarted * len(pack), reservation, self._generate_survey_pack,
+                        (client, pack), ("pack", None, pack)
+                    )
+
+            for survey_prompt in self.survey_prompts['surveys']:
+                id = survey_prompt['id']
+                if surveys:
+                    if not self.pack:
+                        submit_survey(survey_prompt)
+                    continue
+
+                survey = self._get_survey(id)
+                if not survey:
+                    print(f"No survey generated for {id}")
+                    bar.update(len(plan))
+                    continue
+                submit_answers(id, survey)
+
+            delay = dispatch()
+            while pending or queued:
+                if not pending:
+                    # nothing running, the next job waits for quota
+                    time.sleep(delay)
+                    delay = dispatch()
+                    continue
+
+                done, _ = wait(pending, timeout=delay, return_when=FIRST_COMPLETED)
+                finished = [(fut, pending.pop(fut)) for fut in done]
+                # the freed workers get their next jobs before the results are processed
+                dispatch()
+                for fut, (kind, id, shard) in finished:
+
+                    if kind == "pack":
+                        try:
+                            data = fut.result()
+                        except Exception as e:
+                            tqdm.write(f"Packed survey request failed, generating its surveys one by one: {e}")
+                            data = {}
+
+                        for survey_prompt in shard:
+                            if survey_prompt['id'] not in data:
+                                # missing from the pack, asked again on its own
+                                tqdm.write(f"Survey {survey_prompt['id']} missing from its pack, generating it on its own")
+                                submit_survey(survey_prompt)
+                                continue
+                            bar.update(1)
+                            if answers:
+                                submit_answers(survey_prompt['id'], data[survey_prompt['id']])
+                        continue
+
+                    try:
+                        data = fut.result()
+                    except Exception as e:
+                        if kind == "shard":
+                            survey, offset, size = shard[:3]
+                            tries = attempts[(id, offset)]
+                            if self.stream:
+                                # the users received before the failure are on disk, only the rest is asked again
+                                received = shard[3]["received"]
+                                offset, size = offset + received, size - received
+                                attempts[(id, offset)] = tries
+                            if tries <= self.shard_retries:
+                                tqdm.write(f"Retrying shard {offset}+{size} for {id}: {e}")
+                                submit_shard(id, survey, offset, size)
+                                continue
+                            shard_results.pop(id, None)
+
+                        tqdm.write(f"Failed generating {kind} for {id}: {e}")
+                        failed.append((kind, id) if kind != "shard" else (kind, id, shard[1]))
+                        self.manifest.record_failure(id, kind, e)
+                        bar.update(1)
+                        if kind == "shard" and self.stream:
+                            settle_stream(id)
+                        # the answers for a failed survey can never be generated
+                        if kind == "survey" and answers:
+                            bar.update(len(plan))
+                        continue
+
+                    bar.update(1)
+
+                    if kind == "survey" and answers:
+                        submit_answers(id, data)
+
+                    if kind == "shard" and self.stream:
+                        settle_stream(id)
+
+                    if kind == "shard" and id in shard_results:
+                        shard_results[id][shard[1]] = data
+                        if len(shard_results[id]) == len(plan):
+                            with self.metrics.phase("save"):
+                                self._save_answers(self._merge_answer_shards(shard_results.pop(id), n), id)
+
+                delay = dispatch()
+
+        print(f"Token scheduler: {self.scheduler}")
+
+        if failed:
+            print(f"{len(failed)} generation job(s) failed: {failed}")
+
+        if self.cache:
+            self.cache.evict()
+            print(f"Completion cache: {self.cache}")
+
+        return failed
+
+
+    def generate_survey(self):
+
+        return self._run_pipeline(surveys=True, answers=False)
+
+
     def generate_answers(self, n = 5):
         
         print(f"Generating {n} answers for each question")
+        return self._run_pipeline(surveys=False, answers=True, n=n)
+
+
+    def generate(self, n=5):
+
+        return self._run_pipeline(surveys=True, answers=True, n=n)
+
+
+    # One request line of the OpenAI Batch API input format
+    def _batch_request(self, custom_id, prompt):
+
+        return {
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": self.model,
+                "messages": self._messages(prompt),
+                "response_format": self.response_format
+            }
+        }
+
+
+    """
+        Batch mode, step 1: write the pending prompts as an OpenAI Batch input file.
+        Surveys that were not generated yet get a survey request (custom_id "survey:{id}").
+        Surveys that exist without answers get one request per answers shard
+        (custom_id "answers:{id}:{offset}:{size}:{n}"), except the shards an earlier ingest
+        already received. Answers need their survey first, so a full run is prepare -> ingest
+        for the surveys, then again for the answers. Returns the number of requests written.
+    """
+    def prepare_batch(self, path, n=5):
+
         self._load_survey_prompts()
-        
-        if not self._key:
-            print("No OPEN AI Key provided")
+        plan = self._answer_shards(n)
+
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        surveys = 0
+        shards = 0
+        with open(path, "w", encoding="utf-8") as f:
+            for survey_prompt in self.survey_prompts['surveys']:
+                id = survey_prompt['id']
+
+                if not os.path.exists(f"surveys/survey_{id}.json"):
+                    prompt = self._generate_survey_prompt(survey_prompt['prompt'])
+                    f.write(json.dumps(self._batch_request(f"survey:{id}", prompt)) + "\n")
+                    surveys += 1
+                    continue
+
+                if any(Path("answers").glob(f"answers_{id}.json*")):
+                    continue
+
+                survey = self._get_survey(id)
+                received = self._load_batch_shards(id, n)
+                for offset, size in plan:
+                    if len(received.get(offset, ())) == size:
+                        continue
+                    prompt = self._generate_answer_prompt(survey, size)
+                    f.write(json.dumps(self._batch_request(f"answers:{id}:{offset}:{size}:{n}", prompt)) + "\n")
+                    shards += 1
+
+        if not surveys and not shards:
+            print("Every survey already has its answers, nothing to prepare")
+        else:
+            print(f"Wrote {surveys} survey and {shards} answers shard request(s) to {path}")
+        return surveys + shards
+
+
+    # {offset: users} of the answers shards kept for a survey of n users, empty when there are none for that n
+    def _load_batch_shards(self, id, n):
+
+        path = BATCH_SHARDS_DIR / f"answers_{id}.json"
+        if not path.exists():
+            return {}
+        with open(path) as f:
+            kept = json.load(f)
+        if kept["n"] != n:
+            return {}
+        return {int(offset): users for offset, users in kept["shards"].items()}
+
+    # Keep the shards received for a survey until the rest comes back, None drops them once the answers are saved
+    def _keep_batch_shards(self, id, n, shards):
+
+        path = BATCH_SHARDS_DIR / f"answers_{id}.json"
+        if shards is None:
+            path.unlink(missing_ok=True)
             return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w") as f:
+            json.dump({"n": n, "shards": shards}, f)
 
-        client = OpenAI(api_key=self._key)
-        for survey_prompt in tqdm(self.survey_prompts['surveys'], desc=f"Generating Surveys answers, {n} each"):
-            survey = self._get_survey(survey_prompt["id"])
-            if not survey:
-                print(f"No survey generated for {survey_prompt['id']}")
-                continue
-            
-            prompt = self._generate_answer_prompt(survey,n)
-            resp = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[{
-                        "role": "system",
-                        "content": "You output ONLY valid JSON. No explanations."
-                }, 
-                {
-                    "role": "user",
-                    "content":prompt
-                }],
-                response_format={ "type": "json_object" }
-            )
+    # Whether shards {offset: users} cover users 0 to n once each
+    def _covers(self, shards, n):
 
-            data = json.loads(resp.choices[0].message.content)
-            self._save_answers(data, survey_prompt['id'])              
+        end = 0
+        for offset in sorted(shards):
+            if offset != end:
+                return False
+            end += len(shards[offset])
+        return end == n
 
-    def generate(self, n=5):
+    # Parse the completion of a Batch API result line, raises when the request failed
+    def _batch_result_content(self, result):
 
-        self.generate_survey()
-        self.generate_answers(n=n)
+        if result.get("error"):
+            raise ValueError(result["error"].get("message", result["error"]))
 
-if __name__ == "__main__":
+        response = result.get("response") or {}
+        if response.get("status_code") != 200:
+            raise ValueError(f"status {response.get('status_code')}")
 
-    aa = DataGenerator()
-    aa.generate()
-    
+        body = response["body"]
+        self.metrics.add_usage(body.get("usage"))
+        return json.loads(body["choices"][0]["message"]["content"])
 
 
+    """
+        Batch mode, step 2: fan a Batch API results file out into surveys/ and answers/.
+        The file is read line by line. Answers of a survey are only written once all of its
+        shards came back valid, in this file or an earlier one: the shards of a survey still
+        missing some are kept in formbricks/batch/. Returns the custom_ids that failed,
+        prepare_batch asks for them again and only them.
+    """
+    def ingest_batch(self, path):
 
+        failed = []
+        # survey id -> {offset: users}, and its planned (size of every shard, n)
+        shard_results = {}
+        plans = {}
+        saved_surveys = 0
+        saved_answers = 0
 
+        with open(path, encoding="utf-8") as f:
+            for line in tqdm(f, desc="Ingesting batch results", unit="result"):
+                if not line.strip():
+                    continue
+                result = json.loads(line)
+                custom_id = result.get("custom_id", "")
 
+                survey = re.fullmatch(r"survey:(.+)", custom_id)
+                shard = re.fullmatch(r"answers:(.+):(\d+):(\d+):(\d+)", custom_id)
+                if not survey and not shard:
+                    tqdm.write(f"Skipping unknown custom_id {custom_id!r}")
+                    continue
 
-    
+                try:
+                    data = self._batch_result_content(result)
+                    if survey:
+                        self._check_schema("survey", data)
+                    else:
+                        self._check_answer_shard(data, int(shard.group(3)))
+                except Exception as e:
+                    tqdm.write(f"Failed result {custom_id}: {e}")
+                    failed.append(custom_id)
+                    if survey:
+                        self.manifest.record_failure(survey.group(1), "survey", e)
+                    else:
+                        self.manifest.record_failure(shard.group(1), "answers", e)
+                    continue
+
+                if survey:
+                    self._save_survey(data, survey.group(1))
+                    saved_surveys += 1
+                    continue
+
+                id, offset, size, n = shard.group(1), int(shard.group(2)), int(shard.group(3)), int(shard.group(4))
+                plans[id] = n
+                shard_results.setdefault(id, {})[offset] = list(data.values())[:size]
+
+        for id, shards in shard_results.items():
+            n = plans[id]
+            shards = {**self._load_batch_shards(id, n), **shards}
+            if not self._covers(shards, n):
+                users = sum(len(shard_users) for shard_users in shards.values())
+                print(f"Answers for {id} are incomplete ({users} of {n} users), the shards received are kept")
+                self._keep_batch_shards(id, n, shards)
+                continue
+            self._save_answers(self._merge_answer_shards(shards, n), id)
+            self._keep_batch_shards(id, n, None)
+            saved_answers += 1
+
+        print(f"Saved {saved_surveys} survey(s) and answers for {saved_answers} survey(s), {len(failed)} result(s) failed")
+        return failed
+
+if __name__ == "__main__":
+
+    aa = DataGenerator()
+    aa.generate()
@@ -1,28 +1,85 @@
-from pprint import pprint
-import cuid2
-from openai import OpenAI
 import requests
 import json
 import os
-from dotenv import load_dotenv
-from tqdm import tqdm
+import time
 import uuid
-from pprint import pprint
 from datetime import datetime, timezone
 
 from pathlib import Path
 
-load_dotenv('cli.env')
+from src.response_uploader import ResponseUploader, UploadSummary
+from src.upload_journal import UploadJournal
+from src.survey_logic import SurveyLogicGraph, LogicReport
+from src.schema_validator import SchemaValidator
+from src.config import load_config
+from src.metrics import Metrics
+from src.payload_compiler import PayloadCompiler, iter_answers, response_data, survey_to_blocks
+from src.manifest import Manifest
+from src.dedup import Deduplicator
 
 class DataInjester():
 
-    def __init__(self):
-        self.formbricks_host = os.getenv("FORMBRICKS_HOST","http://localhost:3000")
-        self.environment_key = os.getenv("ENVIRONMENT_ID",None)
-        self.API_KEY = os.getenv("API_KEY",None)
+    """
+        target overrides the environment with a topology target (name, host, environment_id,
+        api_key), its journal then lives in formbricks/{name}/ and its uploads are recorded
+        under its name in the manifest.
+        surveys restricts the upload to these survey ids, on_result(ok) is called per response.
+    """
+    def __init__(self, concurrency=16, retries=3, resume=False, check_logic=True, validate=False, dedup=None, metrics=None,
+                 target=None, surveys=None, on_result=None, sink=None, adaptive=True, compiler=None, manifest=None,
+                 dedup_threshold=None, rescan=False):
+        load_config()
+        target = target or {}
+        self.formbricks_host = target.get("host") or os.getenv("FORMBRICKS_HOST","http://localhost:3000")
+        self.environment_key = target.get("environment_id") or os.getenv("ENVIRONMENT_ID",None)
+        self.API_KEY = target.get("api_key") or os.getenv("API_KEY",None)
 
         self.formbricks_paths = Path("formbricks")
-        self.formbricks_paths.mkdir(exist_ok=True)
+        if target.get("name"):
+            self.formbricks_paths = self.formbricks_paths / target["name"]
+        self.formbricks_paths.mkdir(parents=True, exist_ok=True)
+
+        # Surveys, answers and what was created where, see src/manifest.py. The default environment is target ""
+        self.manifest = manifest or Manifest()
+        # Walk surveys/ and answers/ once before reading the manifest, see Manifest.sync
+        self.rescan = rescan
+        self._scanned = False
+        self.target_name = target.get("name", "")
+        # a formbricks_ids.json left by an older version becomes this target's uploads
+        self.manifest.import_formbricks_ids(self.target_name, self.formbricks_paths / "formbricks_ids.json")
+
+        # Survey ids this injester uploads, None uploads every survey
+        self.surveys = None if surveys is None else set(surveys)
+        self.on_result = on_result
+
+        # Where responses go, a src.response_uploader.ResponseSink. None posts them to the API
+        self.sink = sink
+
+        # Upload engine settings for the API, concurrency is the ceiling of the adaptive limit
+        self.concurrency = concurrency
+        self.retries = retries
+        self.adaptive = adaptive
+        self._uploaders = {}
+        self.upload_summary = UploadSummary()
+
+        # Journal of accepted responses, resume skips whatever it already holds
+        self.resume = resume
+        self.journal = UploadJournal(self.formbricks_paths / "upload_journal.jsonl")
+
+        # Check survey logic and answers against it before anything is uploaded
+        self.check_logic_enabled = check_logic
+        # Validate surveys and answers against the validation schemas before uploading
+        self.validate = validate
+        # "flag" or "drop" near-duplicate open text answers before uploading, see src/dedup.py
+        self.dedup = dedup
+        # None keeps the threshold of the last dedup run, changing it indexes every survey again
+        self.dedup_threshold = dedup_threshold
+
+        # Phase timings, per endpoint latency and bytes sent, see src/metrics.py
+        self.metrics = metrics or Metrics()
+
+        # Cache of compiled payloads shared by every target, see src/payload_compiler.py
+        self.compiler = compiler or PayloadCompiler()
 
     def _id(self):
         return uuid.uuid4().hex[:24]
@@ -30,128 +87,20 @@ class DataInjester():
     
     # Convert the generated survey into formbricks payload
     def _survey_questions_to_blocks(self,generated_survey):
-        OPERATOR_MAP = {
-            "<=": "isLessThanOrEqual",
-            "<": "isLessThan",
-            ">": "isGreaterThan",
-            ">=": "isGreaterThanOrEqual",
-            "==": "equals",
-            "!=": "notEquals",
-        }
-
-        questions = generated_survey["survey"]["questions"]
 
-        # Map question_id -> block cuid
-        qid_to_block = {
-            q["question_id"]: self._id()
-            for q in questions
-        }
-
-        blocks = []
-
-        for q in questions:
-            qid = q["question_id"]
-            qtype = q["question_type"]
-
-            # ---------- Question ----------
-            fb_question = {
-                "id": qid,
-                "type": qtype,
-                "required": q["logic"].get("required", False),
-                "headline": {"default": q["question_text"]}
-            }
-
-            if qtype == "rating":
-                fb_question.update({
-                    "range": q["config"]["rating"]["max_value"],
-                    "scale": "star",
-                    "isColorCodingEnabled": False,
-                    "lowerLabel": {"default": "Not satisfied"},
-                    "upperLabel": {"default": "Very satisfied"},
-                })
-
-            if qtype == "openText":
-                fb_question.update({
-                    "inputType": "text",
-                    "placeholder": {
-                        "default": q["config"]["text"].get("placholder", "")
-                    }
-                })
-
-            # ---------- Logic ----------
-            logic_conditions = q["logic"].get("conditions", [])
-            fb_logic = []
-            if logic_conditions:
-                for rule in logic_conditions:
-                    rule_if = rule["if"]
-                    operator = OPERATOR_MAP[rule_if["operator"]]
-
-                    fb_logic.append({
-                        "id":self._id(),
-                        "conditions": {
-                            "id":self._id(),
-                            "connector": "and",
-                            "conditions": [
-                                {
-                                    "id":self._id(),
-                                    "operator": operator,
-                                    "leftOperand": {
-                                        "type": "element",
-                                        "value": qid
-                                    },
-                                    "rightOperand": {
-                                        "type": "static",
-                                        "value": rule_if["value"]
-                                    }
-                                }
-                            ]
-                        },
-                        "actions": [
-                            {
-                                "id":self._id(),
-                                "objective": "jumpToBlock",
-                                "target": qid_to_block[rule_if["go_to"]]
-                            }
-                        ]
-                    })
-            # ---------- Block ----------
-            block = {
-                "id": qid_to_block[qid],
-                "name": f"Block for {qid}",
-                "type": "question",
-                "elements": [fb_question]
-            }
-            if len(fb_logic) > 0:
-                block["logic"] = fb_logic 
-
-            blocks.append(block)
-
-
-        payload = {
-            "name": generated_survey["survey"]["name"],
-            "type": "link",
-            "status": "inProgress",
-            "environmentId": self.environment_key,
-            "blocks": blocks,
-            "questions": [],
-            "endings": [],
-            "hiddenFields": {"enabled": False, "fieldIds": []}
-}
+        payload = survey_to_blocks(generated_survey, self._id)
+        payload["environmentId"] = self.environment_key
         return payload
 
     
     # Convert the generated answer into formbricks payload
     def _build_formbricks_response_payload(self, survey_id, answers, language="en",finished=True):
-        now = datetime.now(timezone.utc).isoformat()
-
-        data = {}
 
-        for ans in answers['answers']:
-            qid = ans["question_id"]
-            value = ans["value"]
+        return self._response_payload(survey_id, response_data(answers), language, finished)
 
-            # Formbricks expects arrays as values
-            data[qid] = value
+    # Response payload around compiled response data, only the ids and timestamps are added
+    def _response_payload(self, survey_id, data, language="en", finished=True):
+        now = datetime.now(timezone.utc).isoformat()
 
         return {
             "createdAt": now,
@@ -164,111 +113,225 @@ class DataInjester():
         }
 
 
-    # Save the ids returned from uploading surveys 
-    def _save_formbricks_ids(self, ids):
+    # {survey id: Formbricks id} of the surveys created on this target
+    def _load_formbricks_ids(self):
+
+        return self.manifest.formbricks_ids(self.target_name)
+
+    # Register the corpus when the manifest is empty or a rescan was asked for, at most once per run
+    def _scan(self):
+
+        if not self._scanned:
+            self.manifest.sync(self.rescan)
+            self._scanned = True
+
+    """
+        Manifest rows of the generated surveys this injester works on: all of them, those in
+        self.surveys, and only ids when given.
+    """
+    def _survey_rows(self, ids=None):
+
+        self._scan()
+        if self.surveys is not None:
+            ids = self.surveys if ids is None else set(ids) & self.surveys
+        return self.manifest.surveys(ids)
 
-        with open(self.formbricks_paths/ "formbricks_ids.json","w") as f:
-            json.dump(ids, f)
-    
     
-    # Generate formbricks surveys from LLM generated surveys and upload 
-    def _generate_formbricks_survey_json_and_upload(self):
-        
-        directory = Path("surveys")
+    # Generate formbricks surveys from LLM generated surveys and upload, ids only uploads these surveys
+    def _generate_formbricks_survey_json_and_upload(self, ids=None):
+
+        # surveys already created on this target are skipped, a fresh seed has reset them
+        pending = {row["id"] for row in self.manifest.pending(self.target_name, ids)}
 
         formbricks_jsons = {}
-        
-        for json_file in directory.rglob("*.json"):
-            print(f"Processing: {json_file}")
+        for row in self._survey_rows(ids):
+            if row["id"] not in pending or row["path"] in self.compiler.failures:
+                continue
 
-            survey = {}
-            with json_file.open("r", encoding="utf-8") as f:
-                survey = json.load(f)
+            print(f"Processing: {row['path']}")
 
-                payload = self._survey_questions_to_blocks(survey)
-                formbricks_jsons[str(json_file)] = payload
-        
+            payload = self.compiler.survey(row["path"])
+            payload["environmentId"] = self.environment_key
+            formbricks_jsons[row["id"]] = payload
         
-        survey_ids = self._upload_surveys(formbricks_jsons)
-
-        self._save_formbricks_ids(survey_ids)
+        with self.metrics.phase("upload_surveys"):
+            return self._upload_surveys(formbricks_jsons)
 
 
     # Generate formbricks answers from LLM generated answers and upload 
     def _generate_formbricks_survey_answer_json_upload(self):
-        
-        survey_id_path = Path("formbricks")
-        answers_directory = Path("answers")
 
-        formbricks_ids = {}
+        created = self._load_formbricks_ids()
+        for row in self._survey_rows():
+            if row["id"] not in created:
+                print(f"Survey {row['id']} was not uploaded, skipping its answers")
+                continue
+            self._upload_survey_answers(row["id"], created[row["id"]], row["answers_path"])
 
-        with open(survey_id_path / "formbricks_ids.json") as f:
-            formbricks_ids = json.load(f)
 
-        
-        survey_ids = {}
-        for question, id in formbricks_ids.items():
-            
-            file_name = question.split("/")
-            survey_id = file_name[1].split(".")[0].split("_")[1]
-            print(survey_id)
-            survey_ids[survey_id] = id
+    """
+        Upload the answers of one survey, once its Formbricks id is known. respondents,
+        (user_id, response data) pairs, replaces the compiled answers file.
+    """
+    def _upload_survey_answers(self, id, fb_id, answers_path, respondents=None):
 
-        
-        print(survey_ids)
-        for id,fb_id in survey_ids.items():
+        if answers_path is None:
+            print(f"Answers for {id} does not exists")
+            return
+
+        if respondents is None and str(answers_path) in self.compiler.failures:
+            print(f"Answers for {id} could not be compiled, skipping them: {self.compiler.failures[str(answers_path)]}")
+            return
 
-            answers_path = answers_directory / f"answers_{id}.json"
+        # read line -> build payload -> upload, nothing is held for the whole file
+        payloads = self._response_payloads(id, fb_id, answers_path, respondents)
 
-            
-            if not answers_path.exists():
-                print(f"Answers for {id} does not exists")
+        with self.metrics.phase("upload_answers"):
+            summary = self._upload_answers(
+                payloads,
+                on_success=lambda user_id: self.journal.record(id, user_id),
+                on_send=lambda user_id, payload: self.journal.record_sent(id, user_id, payload["data"])
+            )
+        print(f"Answers for {id}: {summary}")
+        self.upload_summary.merge(summary)
+        self.manifest.add_responses(self.target_name, id, summary.succeeded, summary.failed)
+        return summary
+
+
+    # Yield (user_id, payload) for the respondents of a survey that are not journaled yet
+    def _response_payloads(self, id, fb_id, answers_path, respondents=None):
+
+        if respondents is None:
+            respondents = self.compiler.responses(answers_path)
+        for user_id, data in respondents:
+            if (id, user_id) in self.journal:
                 continue
-            
-            answers = {}
+            yield user_id, self._response_payload(fb_id, data)
 
-            with open(answers_path) as f:
-                answers = json.load(f)
 
-            answers_formatted = {}
+    """
+        Responses that were in flight when a previous seed died may or may not have been stored.
+        Only the latest responses of those surveys are fetched, enough to cover the in-doubt ones,
+        and every in-doubt response found there is journaled instead of being sent twice.
+    """
+    def _reconcile_in_doubt(self):
 
-            for user_id, answer in answers.items():
-                temp = self._build_formbricks_response_payload(survey_id=fb_id, answers=answer)
-                answers_formatted[user_id] = temp
-            
-            # with open(f"answers_{fb_id}.json","w") as f:
-            #     json.dump(answers_formatted,f, indent=2)
-            
-            self._upload_answers(answers_formatted)
+        in_doubt = self.journal.in_doubt()
+        if not in_doubt:
+            return
 
-    
-    # Upload surveys using API
+        survey_ids = self._load_formbricks_ids()
+
+        url = f"{self.formbricks_host}/api/v1/management/responses"
+
+        for id, users in in_doubt.items():
+            fb_id = survey_ids.get(id)
+            if not fb_id:
+                continue
+
+            start = time.perf_counter()
+            try:
+                res = requests.get(
+                    url=url,
+                    headers=self._get_header(),
+                    params={"surveyId": fb_id, "limit": len(users) + self.concurrency}
+                )
+                self.metrics.observe("formbricks:list_responses", time.perf_counter() - start, error=not res.ok)
+                res.raise_for_status()
+                stored = res.json()["data"]
+            except Exception as e:
+                print(f"Could not check in-doubt responses for {id}, they will be sent again: {e}")
+                continue
+
+            fingerprints = {}
+            for response in stored:
+                fingerprint = self.journal.fingerprint(response.get("data", {}))
+                fingerprints[fingerprint] = fingerprints.get(fingerprint, 0) + 1
+
+            for user_id, fingerprint in users.items():
+                if fingerprints.get(fingerprint, 0) > 0:
+                    fingerprints[fingerprint] -= 1
+                    self.journal.record(id, user_id)
+
+            print(f"Survey {id}: {len(users)} responses in doubt, {len(users) - len(self.journal.in_doubt().get(id, {}))} already stored")
+
+
+    # Yield (user_id, answer) one respondent at a time
+    def _iter_answers(self, answers_path):
+
+        return iter_answers(answers_path)
+
+    """
+        Compile the payloads of the surveys to upload and of their answers, only the sources
+        that changed since the last build are compiled again, answers=False leaves the answers
+        out. A survey that cannot be compiled is recorded as failed on this target and is not
+        created, the others go on.
+    """
+    def compile(self, ids=None, answers=True):
+
+        rows = self._survey_rows(ids)
+        sources = []
+        for row in rows:
+            sources.append(("survey", row["path"]))
+            if answers and row["answers_path"] is not None:
+                sources.append(("responses", row["answers_path"]))
+
+        with self.metrics.phase("compile"):
+            self.compiler.build(sources)
+        print(f"Payloads: {self.compiler}")
+
+        for row in rows:
+            error = self.compiler.failures.get(row["path"])
+            if error is not None:
+                print(f"Survey {row['id']} could not be compiled, skipping it: {error}")
+                self.manifest.record_upload(self.target_name, row["id"], error=f"compile failed: {error}")
+
+
+    # Uploader of a management API endpoint, kept for the whole seed so its adaptive limit carries over
+    def _api_uploader(self, endpoint):
+
+        if endpoint not in self._uploaders:
+            self._uploaders[endpoint] = ResponseUploader(
+                url=f"{self.formbricks_host}/api/v1/management/{endpoint}",
+                headers=self._get_header(),
+                concurrency=self.concurrency,
+                retries=self.retries,
+                metrics=self.metrics,
+                endpoint=f"formbricks:{endpoint}",
+                adaptive=self.adaptive
+            )
+        return self._uploaders[endpoint]
+
+    """
+        Upload surveys using API, every id is recorded in the manifest as soon as it comes back,
+        so a crash never loses one. Surveys the API rejected, or that ran out of retries, are
+        recorded as failed. Returns {survey id: Formbricks id} of the surveys created.
+    """
     def _upload_surveys(self, jsons):
         
         survey_ids = {}
-        
-        header = self._get_header()
-        url = f"{self.formbricks_host}/api/v1/management/surveys"
-        
-        for id,survey in jsons.items():
-            res = requests.post(url=url, headers=header, data=json.dumps(survey))
-            if res.status_code == 200:
-                data = res.json()
-                survey_ids[id] = data['data']['id']
-            else:
-                survey_ids[id] = "ERROR"
+
+        def on_response(id, data):
+            survey_ids[id] = data['data']['id']
+            self.manifest.record_upload(self.target_name, id, formbricks_id=survey_ids[id])
+
+        summary = self._api_uploader("surveys").upload(jsons.items(), desc="Uploading surveys", on_response=on_response)
+
+        failed = [id for id in jsons if id not in survey_ids]
+        for id in failed:
+            self.manifest.record_upload(self.target_name, id, error=f"survey creation failed: {summary.errors}")
+        print(f"Surveys: {summary}")
         
         return survey_ids
 
-    # Upload answers using API
-    def _upload_answers(self, jsons):
+    # Upload answers to the sink, by default the API over a pooled and concurrent uploader
+    def _upload_answers(self, payloads, on_success=None, on_send=None):
 
-        header = self._get_header()
-        url = f"{self.formbricks_host}/api/v1/management/responses"
+        uploader = self.sink or self._api_uploader("responses")
 
-        for answer in tqdm(jsons.values(), desc="Uploading Answers for survey"):
-            res = requests.post(url=url, headers=header, data=json.dumps(answer))
-            
+        return uploader.upload(
+            payloads, desc="Uploading Answers for survey", on_success=on_success, on_send=on_send, on_result=self.on_result
+        )
 
     
     # Get api key
@@ -278,6 +341,28 @@ class DataInjester():
             "x-api-key":self.API_KEY
         }
 
+    # Compile every survey's logic once and check all of its respondents in a single pass, ids restricts the surveys checked
+    def check_logic(self, ids=None):
+
+        reports = []
+
+        for row in self._survey_rows(ids):
+            id = row["id"]
+            with open(row["path"], encoding="utf-8") as f:
+                graph = SurveyLogicGraph(json.load(f))
+
+            report = LogicReport(id, graph)
+            answers_path = row["answers_path"]
+            if answers_path is not None:
+                for user_id, answer in self._iter_answers(answers_path):
+                    values = {a["question_id"]: a["value"] for a in answer["answers"]}
+                    report.add(user_id, *graph.check_respondent(values))
+
+            reports.append(report)
+
+        return reports
+
+
     # Check if previous steps have been taken or not
     def can_proceed(self):
 
@@ -286,45 +371,81 @@ class DataInjester():
             if not self.environment_key or not self.API_KEY:
                 return False,"No enviroment key or api key"
             
-            # check if file exists and are valid
-            survey_directory = Path("surveys")
-            answer_directory = Path("answers")
-            survey_ids = []
-            answer_ids = []
-            for json_file in survey_directory.rglob("*.json"):
-                stem = json_file.stem
-                survey_id = stem.split("_")[1]
-                survey_ids.append(survey_id)
-            
-            for json_file in answer_directory.rglob("*.json"):
-                stem = json_file.stem
-                answer_id = stem.split("_")[1]
-                answer_ids.append(answer_id)
-            
-            if len(survey_ids) != len(answer_ids):
-                return False, "surveys and answers count are not matching, equal amount of file not there"
+            # check that every generated survey has its answers, from the manifest counts
+            self._scan()
+            counts = self.manifest.readiness()
 
-            intr = set(survey_ids) & set(answer_ids)
-            if intr != set(survey_ids):
-                return False, "surveys and answers ids are not matching"
+            if not counts["generated"]:
+                return False, "No generated surveys, run formbricks generate first"
 
+            if counts["without_answers"]:
+                return False, f"{counts['without_answers']} survey(s) have no answers, generate their answers first"
+
+            if counts["orphan_answers"]:
+                return False, f"{counts['orphan_answers']} answers file(s) have no generated survey"
 
-        
             return True, "all good"
         except Exception as e:
             return False, f"Some Error :{e}, cannot proceed"
 
-    # Main function to handle seeding
+    # Load the journal and reconcile it when resuming, else start a fresh one and forget what the target holds
+    def _open_journal(self):
+
+        if self.resume:
+            self.journal.load()
+            with self.metrics.phase("reconcile"):
+                self._reconcile_in_doubt()
+            print(f"Resuming, {len(self.journal)} responses already uploaded")
+        else:
+            self.journal.reset()
+            self.manifest.reset_uploads(self.target_name)
+
+    # Main function to handle seeding, False when it stopped before uploading anything
     def seed(self):
 
         status, msg = self.can_proceed()
         if not status:
             print(msg)
-            return
+            return False
+
+        if self.validate:
+            validator = SchemaValidator()
+            with self.metrics.phase("validate"):
+                results = validator.validate()
+            if not validator.report(results):
+                print("Schema validation failed, nothing was uploaded")
+                return False
+
+        if self.dedup:
+            # before the logic check and the compiled payloads, dropping rewrites answers files
+            with self.metrics.phase("dedup"):
+                Deduplicator(
+                    threshold=self.dedup_threshold, drop=self.dedup == "drop", manifest=self.manifest
+                ).run(self._survey_rows())
+
+        if self.check_logic_enabled:
+            with self.metrics.phase("check_logic"):
+                reports = self.check_logic()
+            failed = [report for report in reports if not report.ok]
+            for report in failed:
+                print(report)
+            if failed:
+                print("Survey logic check failed, nothing was uploaded (use --no-logic-check to upload anyway)")
+                return False
+
+        self._open_journal()
+        self.compile()
 
-        
-        #self._generate_formbricks_survey_json_and_upload()
-        self._generate_formbricks_survey_answer_json_upload()
+        try:
+            self._generate_formbricks_survey_json_and_upload()
+            self._generate_formbricks_survey_answer_json_upload()
+        finally:
+            self.journal.close()
+            if self.sink:
+                self.sink.close()
+
+        print(f"Upload summary: {self.upload_summary}")
+        return True
 
 
 
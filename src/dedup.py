@@ -0,0 +1,569 @@
+import array
+import hashlib
+import json
+import math
+import os
+import random
+import sqlite3
+import tempfile
+import time
+import zlib
+
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from src.payload_compiler import file_hash, iter_answers
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS settings (
+    key   TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS files (
+    survey_id     TEXT PRIMARY KEY,
+    path          TEXT NOT NULL,
+    -- the answers file is indexed up to here, the last complete line
+    indexed_bytes INTEGER NOT NULL,
+    prefix_hash   TEXT NOT NULL,
+    -- the open text questions come from the survey, a changed survey is indexed again
+    survey_hash   TEXT NOT NULL,
+    updated       REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS answers (
+    survey_id    TEXT NOT NULL,
+    question_id  TEXT NOT NULL,
+    user_id      TEXT NOT NULL,
+    -- MinHash signature of a representative, NULL for a near-duplicate
+    signature    BLOB,
+    -- user id of the representative a near-duplicate was matched to
+    duplicate_of TEXT,
+    similarity   REAL,
+    PRIMARY KEY (survey_id, question_id, user_id)
+);
+"""
+
+# Signature slots and shingle size, part of the index settings: changing them reindexes everything
+NUM_PERM = 64
+SHINGLE = 5
+SEED = 1
+
+# Probability that a pair at the threshold shares at least one LSH band
+RECALL = 0.99
+
+# Threshold of a fresh index, later runs keep the one the index was built with unless given another
+DEFAULT_THRESHOLD = 0.8
+
+# Densification order: an empty slot j borrows from the first filled slot of DENSIFY[j]
+_rng = random.Random(SEED)
+DENSIFY = []
+for _slot in range(NUM_PERM):
+    _order = list(range(NUM_PERM))
+    _rng.shuffle(_order)
+    DENSIFY.append(_order)
+
+
+def _normalize(text):
+    return " ".join(text.lower().split())
+
+
+"""
+    MinHash signature of a text, over its character shingles. One hash per shingle
+    (crc32, stable from one run to the next) picks the signature slot it competes for
+    and its value, empty slots then borrow the value of another slot in a fixed random
+    order (one permutation hashing with optimal densification). The share of equal slots
+    of two signatures estimates the Jaccard similarity of their shingle sets, like a
+    signature of NUM_PERM independent permutations at a fraction of the cost.
+    Returns the signature as bytes, NUM_PERM uint32.
+"""
+def minhash(text):
+
+    data = _normalize(text).encode("utf-8")
+    if len(data) <= SHINGLE:
+        hashes = {zlib.crc32(data)}
+    else:
+        hashes = {zlib.crc32(data[i:i + SHINGLE]) for i in range(len(data) - SHINGLE + 1)}
+
+    # smaller hashes come last and win their slot
+    slots = {value % NUM_PERM: value for value in sorted(hashes, reverse=True)}
+    signature = array.array("I", bytes(4 * NUM_PERM))
+    for j in range(NUM_PERM):
+        value = slots.get(j)
+        if value is None:
+            for other in DENSIFY[j]:
+                value = slots.get(other)
+                if value is not None:
+                    break
+        signature[j] = value
+    return signature.tobytes()
+
+
+# Share of equal slots of two signatures (arrays of NUM_PERM uint32)
+def similarity(a, b):
+    return sum(x == y for x, y in zip(a, b)) / NUM_PERM
+
+
+# Rows per band: as many as possible while a pair at the threshold still shares a band with RECALL
+def band_rows(threshold):
+
+    for rows in range(NUM_PERM, 0, -1):
+        bands = NUM_PERM // rows
+        if 1 - (1 - threshold ** rows) ** bands >= RECALL:
+            return rows
+    return 1
+
+
+class LSHIndex():
+
+    """
+        Locality sensitive hashing over MinHash signatures: each signature is cut into bands
+        of `rows` slots, two signatures become candidates when one band is equal, so a
+        query only compares against the signatures sharing a bucket instead of all of them.
+        Only representatives are inserted, a near-duplicate is compared once and not kept,
+        a text repeated thousands of times stays one entry.
+    """
+    def __init__(self, rows):
+        self.rows = rows
+        self.bands = NUM_PERM // rows
+        # band -> {band slots: key, or [keys] once several representatives share them}, a lone
+        # key is no list: millions of one element lists cost more to build than the index
+        self.buckets = [{} for _ in range(self.bands)]
+        self.signatures = {}
+
+    def _keys(self, signature):
+
+        width = 4 * self.rows
+        return [signature[band * width:(band + 1) * width] for band in range(self.bands)]
+
+    def _add(self, bucket, band_key, key):
+
+        members = bucket.get(band_key)
+        if members is None:
+            bucket[band_key] = key
+        elif type(members) is list:
+            members.append(key)
+        else:
+            bucket[band_key] = [members, key]
+
+    def insert(self, key, signature):
+
+        self.signatures[key] = signature
+        for bucket, band_key in zip(self.buckets, self._keys(signature)):
+            self._add(bucket, band_key, key)
+
+    # Insert (key, signature) pairs, band by band, for the representatives of an earlier run
+    def load(self, pairs):
+
+        pairs = list(pairs)
+        self.signatures.update(pairs)
+        width = 4 * self.rows
+        for band, bucket in enumerate(self.buckets):
+            start, end = band * width, (band + 1) * width
+            # _add inlined, this runs for every band of every representative
+            get = bucket.get
+            for key, signature in pairs:
+                band_key = signature[start:end]
+                members = get(band_key)
+                if members is None:
+                    bucket[band_key] = key
+                elif type(members) is list:
+                    members.append(key)
+                else:
+                    bucket[band_key] = [members, key]
+
+    # (key, similarity) of the first representative at or above threshold, None when there is none
+    def query(self, signature, threshold):
+
+        slots = array.array("I", signature)
+        seen = set()
+        for bucket, band_key in zip(self.buckets, self._keys(signature)):
+            members = bucket.get(band_key)
+            if members is None:
+                continue
+            for key in members if type(members) is list else (members,):
+                if key in seen:
+                    continue
+                seen.add(key)
+                score = similarity(slots, array.array("I", self.signatures[key]))
+                if score >= threshold:
+                    return key, score
+        return None
+
+
+def _prefix_hash(path, size):
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while size > 0:
+            chunk = f.read(min(size, 1 << 20))
+            if not chunk:
+                break
+            digest.update(chunk)
+            size -= len(chunk)
+    return digest.hexdigest()
+
+
+# (offset after the line, answer) of the complete jsonl lines from offset, a line being written is left for later
+def _read_lines(path, offset):
+
+    with open(path, "rb") as f:
+        f.seek(offset)
+        for line in f:
+            if not line.endswith(b"\n"):
+                return
+            offset += len(line)
+            if line.strip():
+                yield offset, json.loads(line)
+
+
+# Open text question ids of a survey
+def _text_questions(survey_path):
+
+    with open(survey_path, encoding="utf-8") as f:
+        questions = json.load(f)["survey"]["questions"]
+    return [q["question_id"] for q in questions if "text" in q.get("question_type", "").lower()]
+
+
+"""
+    Index the answers of one survey that are not in the index yet, runs inside a worker
+    process. A jsonl file whose indexed prefix did not change is picked up after it (answers
+    are appended), any other change indexes the whole file again.
+    Returns the rows to write: reset (drop the survey's rows first), the new indexed size
+    and prefix hash, and (question id, user id, signature, duplicate of, similarity) rows.
+"""
+def index_answers(db_path, id, survey_path, answers_path, threshold):
+
+    conn = sqlite3.connect(db_path, timeout=30)
+    try:
+        state = conn.execute(
+            "SELECT path, indexed_bytes, prefix_hash, survey_hash FROM files WHERE survey_id = ?", (id,)
+        ).fetchone()
+        survey_hash = file_hash(survey_path)
+        if state is not None and state[3] != survey_hash:
+            state = None
+        size = os.path.getsize(answers_path)
+        start = 0
+        if (
+            state is not None and state[0] == str(answers_path) and Path(answers_path).suffix == ".jsonl"
+            and size >= state[1] and _prefix_hash(answers_path, state[1]) == state[2]
+        ):
+            start = state[1]
+        elif state is not None and state[0] == str(answers_path) and size == state[1] and file_hash(answers_path) == state[2]:
+            # a legacy json file that did not change
+            start = size
+
+        rows = band_rows(threshold)
+        indexes = {qid: LSHIndex(rows) for qid in _text_questions(survey_path)}
+        # nothing was added, the representatives are not needed
+        if start and start < size:
+            for qid, index in indexes.items():
+                index.load(conn.execute(
+                    """
+                    SELECT user_id, signature FROM answers
+                    WHERE survey_id = ? AND question_id = ? AND signature IS NOT NULL
+                    """,
+                    (id, qid)
+                ))
+    finally:
+        conn.close()
+
+    if Path(answers_path).suffix == ".json":
+        answers = () if start else ((size, {"user_id": user_id, **answer}) for user_id, answer in iter_answers(answers_path))
+    else:
+        answers = _read_lines(answers_path, start)
+
+    indexed = start
+    results = []
+    # (question id, normalized text) -> (representative, similarity) of the texts seen in this run,
+    # a text repeated word for word is matched without a signature
+    repeated = {}
+    for indexed, answer in answers:
+        user_id = answer["user_id"]
+        for item in answer.get("answers", []):
+            qid = item["question_id"]
+            value = item.get("value")
+            if qid not in indexes or not isinstance(value, str) or not value.strip():
+                continue
+            text = _normalize(value)
+            match = repeated.get((qid, text))
+            if match is None:
+                signature = minhash(text)
+                match = indexes[qid].query(signature, threshold)
+                if match is None:
+                    indexes[qid].insert(user_id, signature)
+                    repeated[qid, text] = (user_id, 1.0)
+                    results.append((qid, user_id, signature, None, None))
+                    continue
+                repeated[qid, text] = match
+            results.append((qid, user_id, None, match[0], match[1]))
+
+    prefix_hash = file_hash(answers_path) if Path(answers_path).suffix == ".json" else _prefix_hash(answers_path, indexed)
+    return {
+        "id": id, "path": str(answers_path), "reset": start == 0, "indexed_bytes": indexed,
+        "prefix_hash": prefix_hash, "survey_hash": survey_hash, "rows": results,
+    }
+
+
+class Deduplicator():
+
+    """
+        Near-duplicate detection over the open text answers in answers/, between generation
+        and seeding. Every answer gets a MinHash signature, an LSH index per survey and
+        question finds the earlier answers it may repeat, an answer whose estimated Jaccard
+        similarity to one of them (over character shingles) reaches threshold is flagged as
+        its near-duplicate. The first answer of a group stays its representative.
+        Signatures are kept in formbricks/dedup.db (SQLite), so a run only indexes the answers
+        added since the last one, surveys are indexed over a process pool.
+        drop=True blanks the flagged answers of optional questions without logic in the answers
+        files. Answers to required questions or to questions logic depends on stay flagged,
+        removing them would drop the respondent or send it down another path.
+        threshold=None keeps the threshold the index was built with (DEFAULT_THRESHOLD for a
+        new one), another threshold indexes everything again.
+    """
+    def __init__(self, path=Path("formbricks") / "dedup.db", threshold=None, drop=False, workers=None, manifest=None):
+        self.path = Path(path)
+        self.threshold = threshold
+        self.drop = drop
+        self.workers = workers or os.cpu_count() or 1
+        self.manifest = manifest
+        self._conn = None
+
+    def _connect(self):
+
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(SCHEMA)
+            if self.threshold is None:
+                stored = self._conn.execute("SELECT value FROM settings WHERE key = 'threshold'").fetchone()
+                self.threshold = float(stored[0]) if stored else DEFAULT_THRESHOLD
+            self._check_settings()
+        return self._conn
+
+    def close(self):
+
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    # Signatures and matches only hold for the settings they were made with, others start over
+    def _check_settings(self):
+
+        settings = {"num_perm": str(NUM_PERM), "shingle": str(SHINGLE), "seed": str(SEED), "threshold": str(self.threshold)}
+        stored = dict(self._conn.execute("SELECT key, value FROM settings").fetchall())
+        if stored == settings:
+            return
+        if stored:
+            print("Dedup settings changed, indexing every survey again")
+        self._conn.execute("BEGIN")
+        self._conn.execute("DELETE FROM answers")
+        self._conn.execute("DELETE FROM files")
+        self._conn.execute("DELETE FROM settings")
+        self._conn.executemany("INSERT INTO settings (key, value) VALUES (?, ?)", settings.items())
+        self._conn.execute("COMMIT")
+
+    def _write(self, result):
+
+        conn = self._connect()
+        conn.execute("BEGIN")
+        try:
+            if result["reset"]:
+                conn.execute("DELETE FROM answers WHERE survey_id = ?", (result["id"],))
+            conn.executemany(
+                """
+                INSERT OR REPLACE INTO answers (survey_id, question_id, user_id, signature, duplicate_of, similarity)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                [(result["id"], *row) for row in result["rows"]]
+            )
+            conn.execute(
+                """
+                INSERT INTO files (survey_id, path, indexed_bytes, prefix_hash, survey_hash, updated) VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (survey_id) DO UPDATE SET
+                    path = excluded.path, indexed_bytes = excluded.indexed_bytes, prefix_hash = excluded.prefix_hash,
+                    survey_hash = excluded.survey_hash, updated = excluded.updated
+                """,
+                (result["id"], result["path"], result["indexed_bytes"], result["prefix_hash"], result["survey_hash"], time.time())
+            )
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    # Index the new answers of rows (manifest survey rows), returns the number of answers indexed
+    def index(self, rows):
+
+        self._connect()
+        tasks = [(str(self.path), row["id"], row["path"], row["answers_path"], self.threshold) for row in rows]
+        indexed = 0
+
+        if len(tasks) == 1 or (tasks and self.workers == 1):
+            for task in tasks:
+                result = index_answers(*task)
+                self._write(result)
+                indexed += len(result["rows"])
+        elif tasks:
+            with ProcessPoolExecutor(max_workers=min(self.workers, len(tasks))) as pool:
+                for result in pool.map(index_answers, *zip(*tasks)):
+                    self._write(result)
+                    indexed += len(result["rows"])
+        return indexed
+
+    # {question id: set of user ids} of the answers flagged in a survey
+    def _duplicates(self, id):
+
+        duplicates = {}
+        for qid, user_id in self._connect().execute(
+            "SELECT question_id, user_id FROM answers WHERE survey_id = ? AND duplicate_of IS NOT NULL", (id,)
+        ):
+            duplicates.setdefault(qid, set()).add(user_id)
+        return duplicates
+
+    """
+        Rewrite the answers file of a survey without the flagged answers of its optional questions
+        that no logic depends on, every respondent stays. Returns the number of answers removed
+        and the number left flagged on required or logic questions.
+    """
+    def _drop(self, row):
+
+        duplicates = self._duplicates(row["id"])
+        if not duplicates:
+            return 0, 0
+
+        with open(row["path"], encoding="utf-8") as f:
+            questions = json.load(f)["survey"]["questions"]
+        # without these answers the respondent would skip a required question or take another path
+        strict = {
+            q["question_id"] for q in questions
+            if str(q.get("logic", {}).get("required", False)).lower() == "true" or q.get("logic", {}).get("conditions")
+        }
+        droppable = {qid: users for qid, users in duplicates.items() if qid not in strict}
+        kept_flagged = sum(len(users) for qid, users in duplicates.items() if qid in strict)
+        if not droppable:
+            return 0, kept_flagged
+
+        answers_path = Path(row["answers_path"])
+        removed_answers = kept = 0
+        fd, tmp_path = tempfile.mkstemp(dir=answers_path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as out:
+                legacy = {}
+                for user_id, answer in iter_answers(answers_path):
+                    flagged = {qid for qid, users in droppable.items() if user_id in users}
+                    if flagged:
+                        items = answer.get("answers", [])
+                        answer["answers"] = [item for item in items if item["question_id"] not in flagged]
+                        removed_answers += len(items) - len(answer["answers"])
+                    kept += 1
+                    if answers_path.suffix == ".json":
+                        legacy[user_id] = answer
+                    else:
+                        out.write(json.dumps({"user_id": user_id, **answer}) + "\n")
+                if answers_path.suffix == ".json":
+                    json.dump(legacy, out)
+            os.replace(tmp_path, answers_path)
+        except BaseException:
+            Path(tmp_path).unlink(missing_ok=True)
+            raise
+
+        digest = file_hash(answers_path)
+        if self.manifest is not None:
+            self.manifest.record_answers(row["id"], answers_path, kept, digest)
+
+        # the dropped answers left the file, the others are unchanged: the new file counts as
+        # indexed, without indexing it again
+        conn = self._connect()
+        conn.execute("BEGIN")
+        try:
+            conn.executemany(
+                "DELETE FROM answers WHERE survey_id = ? AND question_id = ? AND duplicate_of IS NOT NULL",
+                [(row["id"], qid) for qid in droppable]
+            )
+            conn.execute(
+                "UPDATE files SET indexed_bytes = ?, prefix_hash = ?, updated = ? WHERE survey_id = ?",
+                (answers_path.stat().st_size, digest, time.time(), row["id"])
+            )
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return removed_answers, kept_flagged
+
+    """
+        Diversity of the open text answers of a survey, per question: answers, near-duplicates,
+        groups of near-duplicates (a representative and the answers matched to it), the largest
+        group, and the effective number of distinct answers (exp of the entropy of the group
+        sizes: n distinct answers give n, one answer repeated everywhere gives 1).
+    """
+    def metrics(self, id):
+
+        groups = {}
+        for qid, size in self._connect().execute(
+            """
+            SELECT question_id, COUNT(*) FROM answers WHERE survey_id = ?
+            GROUP BY question_id, COALESCE(duplicate_of, user_id)
+            """,
+            (id,)
+        ):
+            groups.setdefault(qid, []).append(size)
+
+        metrics = {}
+        for qid, sizes in groups.items():
+            answers = sum(sizes)
+            entropy = -sum(size / answers * math.log(size / answers) for size in sizes)
+            metrics[qid] = {
+                "answers": answers,
+                "duplicates": answers - len(sizes),
+                "duplicate_rate": (answers - len(sizes)) / answers,
+                "groups": len(sizes),
+                "largest_group": max(sizes),
+                "effective_distinct": math.exp(entropy),
+            }
+        return metrics
+
+    """
+        Index, drop when asked, and report the surveys in rows (manifest survey rows). Writes
+        the metrics to out when given and returns {survey id: {question id: metrics}}.
+    """
+    def run(self, rows, out=None):
+
+        rows = [row for row in rows if row["answers_path"] is not None]
+        start = time.perf_counter()
+        indexed = self.index(rows)
+        print(
+            f"Indexed {indexed:,} new open text answer(s) of {len(rows)} survey(s) in {time.perf_counter() - start:.2f}s "
+            f"(threshold {self.threshold}, {NUM_PERM // band_rows(self.threshold)} bands of {band_rows(self.threshold)})"
+        )
+
+        results = {}
+        totals = [0, 0]
+        for row in rows:
+            if self.drop:
+                removed_answers, kept_flagged = self._drop(row)
+                if removed_answers or kept_flagged:
+                    print(
+                        f"Survey {row['id']}: dropped {removed_answers} near-duplicate answer(s), "
+                        f"{kept_flagged} left flagged on required or logic questions"
+                    )
+
+            results[row["id"]] = self.metrics(row["id"])
+            for qid, metrics in results[row["id"]].items():
+                totals[0] += metrics["answers"]
+                totals[1] += metrics["duplicates"]
+                print(
+                    f"Survey {row['id']} {qid}: {metrics['answers']:,} answers, {metrics['duplicates']:,} near-duplicates "
+                    f"({metrics['duplicate_rate']:.1%}) in {metrics['groups']:,} groups, largest group {metrics['largest_group']:,}, "
+                    f"effective distinct answers {metrics['effective_distinct']:,.0f} ({metrics['effective_distinct'] / metrics['answers']:.1%})"
+                )
+
+        flagged = "left" if self.drop else "flagged"
+        print(f"{totals[1]:,} of {totals[0]:,} open text answers {flagged} as near-duplicates ({totals[1] / totals[0] if totals[0] else 0:.1%})")
+        self.close()
+
+        if out:
+            with open(out, "w") as f:
+                json.dump(results, f, indent=2)
+            print(f"Results written to {out}")
+        return results
@@ -0,0 +1,491 @@
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+
+# Survey returned by the fake LLM, same shape as surveys/survey_s1.json
+FAKE_SURVEY = {
+    "survey": {
+        "name": "Customer Satisfaction Survey",
+        "description": "A survey to understand customer satisfaction levels.",
+        "questions": [
+            {
+                "question_id": "q1",
+                "question_type": "rating",
+                "question_text": "How would you rate your overall experience?",
+                "config": {"rating": {"max_value": 5, "min_value": 1}},
+                "logic": {
+                    "required": True,
+                    "conditions": [
+                        {"if": {"id": "q1", "value": 3, "operator": "<=", "go_to": "q2"}},
+                        {"if": {"id": "q1", "value": 3, "operator": ">", "go_to": "q3"}}
+                    ]
+                }
+            },
+            {
+                "question_id": "q2",
+                "question_type": "openText",
+                "question_text": "What should we improve?",
+                "config": {"text": {"placholder": "Your feedback here..."}},
+                "logic": {"required": False, "conditions": []}
+            },
+            {
+                "question_id": "q3",
+                "question_type": "openText",
+                "question_text": "What did you like?",
+                "config": {"text": {"placholder": "Your feedback here..."}},
+                "logic": {"required": False, "conditions": []}
+            }
+        ]
+    }
+}
+
+
+class _FakeServer(ThreadingHTTPServer):
+
+    daemon_threads = True
+    # the default backlog of 5 resets connections as soon as a client opens a real pool
+    request_queue_size = 256
+
+
+class _FakeHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+    # buffer whole responses and disable Nagle, otherwise delayed ACKs add ~40ms per keep-alive request
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body, headers=None):
+
+        raw = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(raw)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(raw)
+        self.wfile.flush()
+
+    """
+        Body of the request as json. None when it is shorter than its Content-Length (the
+        client died while sending it) or not json, the request is then counted as malformed
+        and must not be served.
+    """
+    def _read_json(self):
+
+        length = int(self.headers.get("Content-Length", 0))
+        raw = self.rfile.read(length) if length else b""
+        try:
+            if len(raw) < length:
+                raise ValueError(f"body cut at {len(raw)} of {length} bytes")
+            return json.loads(raw) if raw else {}
+        except ValueError:
+            self.server.fake.count_malformed()
+            self.close_connection = True
+            return None
+
+    # Answer a malformed request, the client may already be gone
+    def _reject(self):
+
+        try:
+            self._send(400, {"error": "malformed request"})
+        except OSError:
+            pass
+
+    # Sleep for the configured latency, returns True when an error should be injected instead
+    def _inject(self):
+
+        fake = self.server.fake
+        fake.count_request()
+        if fake.latency:
+            time.sleep(fake.latency * random.uniform(1 - fake.jitter, 1 + fake.jitter))
+        return fake.error_rate and random.random() < fake.error_rate
+
+
+class FakeServer():
+
+    """
+        Base of the local stand-ins, an HTTP server on a background thread.
+        latency (seconds, +/- jitter) is added to every request and error_rate of the
+        requests fail with error_status instead of being served. With a capacity, the
+        requests above it are turned away with a 429, and a Retry-After of retry_after seconds when set.
+    """
+    handler = _FakeHandler
+
+    def __init__(self, latency=0.0, error_rate=0.0, error_status=503, jitter=0.2, host="127.0.0.1", port=0,
+                 capacity=None, retry_after=1):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.jitter = jitter
+        self.host = host
+        self.port = port
+        self.capacity = capacity
+        self.retry_after = retry_after
+
+        self.requests = 0
+        self.in_flight = 0
+        self.rejected = 0
+        # requests with a truncated or invalid body, answered 400 and never served
+        self.malformed = 0
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    def count_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def count_malformed(self):
+        with self._lock:
+            self.malformed += 1
+
+    # Take a slot for a request, False when the server is at capacity
+    def enter(self):
+        with self._lock:
+            if self.capacity is not None and self.in_flight >= self.capacity:
+                self.rejected += 1
+                return False
+            self.in_flight += 1
+            return True
+
+    def leave(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self._server.server_address[1]}"
+
+    def start(self):
+
+        self._server = _FakeServer((self.host, self.port), self.handler)
+        self._server.fake = self
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+class _FormbricksHandler(_FakeHandler):
+
+    def do_GET(self):
+
+        fake = self.server.fake
+        url = urlparse(self.path)
+
+        if url.path == "/health":
+            return self._send(200, {"status": "ok"})
+
+        if url.path == "/api/v1/management/responses":
+            query = parse_qs(url.query)
+            survey_id = query.get("surveyId", [None])[0]
+            limit = int(query.get("limit", ["10"])[0])
+            with fake._lock:
+                stored = list(fake.responses.get(survey_id, [])[-limit:])
+            # newest first, like the real API
+            return self._send(200, {"data": [{"data": data} for data in reversed(stored)]})
+
+        self._send(404, {"error": "not found"})
+
+    def do_POST(self):
+
+        fake = self.server.fake
+        body = self._read_json()
+        if body is None:
+            return self._reject()
+
+        if not fake.enter():
+            headers = {"Retry-After": str(fake.retry_after)} if fake.retry_after else None
+            return self._send(429, {"error": "too many requests"}, headers)
+        try:
+            self._serve_post(fake, body)
+        finally:
+            fake.leave()
+
+    def _serve_post(self, fake, body):
+
+        if self._inject():
+            return self._send(fake.error_status, {"error": "injected error"})
+
+        if self.path == "/api/v1/management/surveys":
+            survey_id = uuid.uuid4().hex[:24]
+            with fake._lock:
+                fake.surveys[survey_id] = body
+            return self._send(200, {"data": {"id": survey_id}})
+
+        if self.path == "/api/v1/management/responses":
+            with fake._lock:
+                fake.responses.setdefault(body.get("surveyId"), []).append(body.get("data", {}))
+            return self._send(200, {"data": {"id": uuid.uuid4().hex[:24]}})
+
+        self._send(404, {"error": "not found"})
+
+
+class FakeFormbricks(FakeServer):
+
+    """
+        Local stand-in for the Formbricks management API: creates surveys, stores
+        responses and lists the latest responses of a survey.
+    """
+    handler = _FormbricksHandler
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.surveys = {}
+        # survey id -> [response data]
+        self.responses = {}
+
+    @property
+    def response_count(self):
+        with self._lock:
+            return sum(len(responses) for responses in self.responses.values())
+
+
+class _OpenAIHandler(_FakeHandler):
+
+    def do_POST(self):
+
+        fake = self.server.fake
+        body = self._read_json()
+        if body is None:
+            return self._reject()
+
+        if self._inject():
+            return self._send(fake.error_status, {"error": {"message": "injected error", "type": "server_error"}})
+
+        if not self.path.endswith("/chat/completions"):
+            return self._send(404, {"error": {"message": "not found"}})
+
+        completion = fake.chat_completion(body)
+        retry_after = fake.admit(completion["usage"]["total_tokens"])
+        if retry_after is not None:
+            return self._send(
+                429,
+                {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+                {"retry-after-ms": str(math.ceil(retry_after * 1000)), "retry-after": str(math.ceil(retry_after))}
+            )
+        if body.get("stream"):
+            return self._stream(completion)
+        # the same generation time as a streamed reply, all of it before the first byte
+        if fake.stream_delay:
+            chunks = -(-len(completion["choices"][0]["message"]["content"]) // fake.stream_chunk)
+            time.sleep(chunks * fake.stream_delay)
+        self._send(200, completion)
+
+    # Server-sent events of chat.completion.chunk objects, the way the API streams a completion
+    def _stream(self, completion):
+
+        fake = self.server.fake
+        content = completion["choices"][0]["message"]["content"]
+        # a cut stream stops halfway, without a finish_reason or [DONE]
+        end = len(content) // 2 if random.random() < fake.stream_cut_rate else len(content)
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        def event(choices, usage=None):
+            chunk = {
+                "id": completion["id"],
+                "object": "chat.completion.chunk",
+                "created": completion["created"],
+                "model": completion["model"],
+                "choices": choices,
+                "usage": usage
+            }
+            self.wfile.write(b"data: " + json.dumps(chunk).encode("utf-8") + b"\n\n")
+            self.wfile.flush()
+
+        for start in range(0, end, fake.stream_chunk):
+            event([{"index": 0, "delta": {"content": content[start:min(end, start + fake.stream_chunk)]}, "finish_reason": None}])
+            if fake.stream_delay:
+                time.sleep(fake.stream_delay)
+        if end < len(content):
+            return
+
+        event([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+        event([], completion["usage"])
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+class FakeOpenAI(FakeServer):
+
+    """
+        Local stand-in for the OpenAI chat completions API. Survey prompts get a fixed
+        survey back, answer prompts get N respondents that follow that survey's logic.
+        Generating stream_chunk characters takes stream_delay seconds. A request with stream
+        gets the completion as server-sent events, one per chunk as it is generated, and
+        stream_cut_rate of the streams stop halfway.
+        With tpm / rpm, the tokens (prompt and completion) and requests served are capped like
+        an account quota, which the API enforces over short periods rather than per calendar
+        minute: a bucket of one minute's worth, refilled continuously. Requests over it get a
+        429 with the Retry-After after which they would fit.
+    """
+    handler = _OpenAIHandler
+
+    USERS = re.compile(r"responses for (\d+) different users")
+    # packed survey prompts carry their goals as a single line json object
+    PACKED = re.compile(r"Survey goals, keyed by survey id:\s*(\{[^\n]*\})")
+
+    # pack_drop_rate: share of the surveys left out of a packed reply
+    def __init__(self, pack_drop_rate=0.0, stream_chunk=32, stream_delay=0.0, stream_cut_rate=0.0, tpm=None, rpm=None,
+                 **kwargs):
+        super().__init__(**kwargs)
+        self.pack_drop_rate = pack_drop_rate
+        self.stream_chunk = max(1, stream_chunk)
+        self.stream_delay = stream_delay
+        self.stream_cut_rate = stream_cut_rate
+
+        self.tpm = tpm
+        self.rpm = rpm
+        # tokens and requests left in the quota, as of _refilled
+        self._tokens_left = tpm
+        self._requests_left = rpm
+        self._refilled = time.monotonic()
+        self.rate_limited = 0
+        self.tokens_served = 0
+        # (time.monotonic(), tokens) of every request admitted under the quota, in order
+        self.admitted = []
+
+    # Count a request of tokens against the quota, None when served, else the seconds until it would fit
+    def admit(self, tokens):
+
+        if not self.tpm and not self.rpm:
+            return None
+
+        with self._lock:
+            now = time.monotonic()
+            elapsed, self._refilled = now - self._refilled, now
+
+            retry_after = 0.0
+            if self.tpm:
+                self._tokens_left = min(self.tpm, self._tokens_left + elapsed * self.tpm / 60.0)
+                # a request bigger than the whole quota fits once it is full
+                needed = min(tokens, self.tpm)
+                if self._tokens_left < needed:
+                    retry_after = (needed - self._tokens_left) * 60.0 / self.tpm
+            if self.rpm:
+                self._requests_left = min(self.rpm, self._requests_left + elapsed * self.rpm / 60.0)
+                if self._requests_left < 1:
+                    retry_after = max(retry_after, (1 - self._requests_left) * 60.0 / self.rpm)
+
+            if retry_after > 0:
+                self.rate_limited += 1
+                return retry_after
+
+            if self.tpm:
+                self._tokens_left -= tokens
+            if self.rpm:
+                self._requests_left -= 1
+            self.tokens_served += tokens
+            self.admitted.append((now, tokens))
+            return None
+
+    # Chat completion object for a request body, usage is estimated at 4 characters per token
+    def chat_completion(self, body):
+
+        prompt = body["messages"][-1]["content"]
+        content = json.dumps(self.complete(prompt))
+
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "fake"),
+            "choices": [{
+                "index": 0,
+                "finish_reason": "stop",
+                "message": {"role": "assistant", "content": content}
+            }],
+            "usage": {
+                "prompt_tokens": len(prompt) // 4,
+                "completion_tokens": len(content) // 4,
+                "total_tokens": (len(prompt) + len(content)) // 4
+            }
+        }
+
+    """
+        Turn an OpenAI Batch input file into a results file, the way the Batch API would
+        once the batch is completed. error_rate of the requests, and those whose custom_id is
+        in fail, come back failed.
+    """
+    def run_batch(self, requests_path, results_path, error_rate=0.0, fail=()):
+
+        with open(requests_path, encoding="utf-8") as requests, open(results_path, "w", encoding="utf-8") as results:
+            for line in requests:
+                if not line.strip():
+                    continue
+                request = json.loads(line)
+                if request["custom_id"] in fail or random.random() < error_rate:
+                    status, body = 500, {"error": {"message": "injected error", "type": "server_error"}}
+                else:
+                    status, body = 200, self.chat_completion(request["body"])
+
+                result = {
+                    "id": f"batch_req_{uuid.uuid4().hex[:12]}",
+                    "custom_id": request["custom_id"],
+                    "response": {"status_code": status, "request_id": uuid.uuid4().hex, "body": body},
+                    "error": None
+                }
+
+                results.write(json.dumps(result) + "\n")
+
+    def complete(self, prompt):
+
+        packed = self.PACKED.search(prompt)
+        if packed:
+            return {
+                id: FAKE_SURVEY
+                for id in json.loads(packed.group(1))
+                if random.random() >= self.pack_drop_rate
+            }
+
+        match = self.USERS.search(prompt)
+        if not match:
+            return FAKE_SURVEY
+
+        users = {}
+        for i in range(1, int(match.group(1)) + 1):
+            rating = random.randint(1, 5)
+            answers = [{"question_id": "q1", "value": rating}]
+            if rating <= 3:
+                answers.append({"question_id": "q2", "value": f"Improvement idea number {random.randint(1, 10**6)}"})
+            else:
+                answers.append({"question_id": "q3", "value": f"Liked feature number {random.randint(1, 10**6)}"})
+            users[f"user_{i:03d}"] = {"name": f"User {i}", "email": f"user{i}@example.com", "answers": answers}
+        return users
+
+
+if __name__ == "__main__":
+
+    # python -m src.fake_servers requests.jsonl results.jsonl [error rate]
+    import sys
+
+    FakeOpenAI().run_batch(sys.argv[1], sys.argv[2], float(sys.argv[3]) if len(sys.argv) > 3 else 0.0)
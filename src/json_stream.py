@@ -0,0 +1,90 @@
+import json
+
+
+class ObjectStream():
+
+    """
+        Incremental parser for a JSON object that arrives in pieces, like a streamed completion.
+        feed() takes the next piece of text and returns the (key, value) members of the top
+        level object completed by it, so a member is available as soon as its closing comma
+        or brace arrives, whatever the size of the whole document.
+        Only the text of the member being received is kept, every member is parsed once with
+        json.loads. close() raises ValueError when the object never ended, the members already
+        returned stay valid.
+    """
+    def __init__(self):
+        # text of the member being received, from the character after the last top level , or {
+        self._buffer = []
+        self._started = False
+        self.done = False
+
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+        # members returned so far
+        self.count = 0
+
+    def _member(self, text):
+
+        text = text.strip()
+        if not text:
+            return None
+        member = json.loads("{" + text + "}")
+        if len(member) != 1:
+            raise ValueError(f"expected one member, got {text[:80]!r}")
+        self.count += 1
+        return next(iter(member.items()))
+
+    def feed(self, text):
+
+        members = []
+        start = 0
+
+        for i, char in enumerate(text):
+            if self.done:
+                if not char.isspace():
+                    raise ValueError(f"unexpected {char!r} after the end of the object")
+                continue
+
+            if not self._started:
+                if char == "{":
+                    self._started = True
+                    start = i + 1
+                elif not char.isspace():
+                    raise ValueError(f"expected a JSON object, got {char!r}")
+                continue
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+
+            if char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._depth += 1
+            elif char in "]}" and self._depth > 0:
+                self._depth -= 1
+            elif char in ",}" and self._depth == 0:
+                self._buffer.append(text[start:i])
+                member = self._member("".join(self._buffer))
+                self._buffer = []
+                start = i + 1
+                if member is not None:
+                    members.append(member)
+                if char == "}":
+                    self.done = True
+
+        if self._started and not self.done:
+            self._buffer.append(text[start:])
+        return members
+
+    def close(self):
+
+        if not self.done:
+            raise ValueError(f"stream ended before the end of the object, after {self.count} member(s)")
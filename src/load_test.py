@@ -0,0 +1,307 @@
+import asyncio
+import itertools
+import json
+import random
+import time
+
+import httpx
+
+from src.metrics import percentiles
+
+
+PATTERNS = ("constant", "ramp", "step")
+
+# Seconds skipped ahead while the target rate is zero
+IDLE_STEP = 0.01
+
+
+class LoadProfile():
+
+    """
+        Target arrival rate over time.
+        constant: `rate` requests/sec for the whole duration
+        ramp:     linear from `rate` to `end_rate`
+        step:     `steps` equal plateaus from `rate` to `end_rate`
+        With poisson the gaps between arrivals are exponential, otherwise evenly spaced.
+    """
+    def __init__(self, pattern="constant", rate=10.0, duration=60.0, end_rate=None, steps=4, poisson=False):
+        if pattern not in PATTERNS:
+            raise ValueError(f"Unknown pattern {pattern!r}, expected one of {', '.join(PATTERNS)}")
+        self.pattern = pattern
+        self.rate = rate
+        self.end_rate = rate if end_rate is None else end_rate
+        self.duration = duration
+        self.steps = max(1, steps)
+        self.poisson = poisson
+
+    def rate_at(self, t):
+
+        if self.pattern == "constant" or self.duration <= 0:
+            return self.rate
+        progress = min(1.0, t / self.duration)
+        if self.pattern == "ramp":
+            return self.rate + (self.end_rate - self.rate) * progress
+        step = min(self.steps - 1, int(progress * self.steps))
+        if self.steps == 1:
+            return self.rate
+        return self.rate + (self.end_rate - self.rate) * step / (self.steps - 1)
+
+    # Yield the arrival offsets (seconds from the start) of every request of the run
+    def arrivals(self, seed=None):
+
+        rng = random.Random(seed)
+        t = 0.0
+        while t < self.duration:
+            rate = self.rate_at(t)
+            if rate <= 0:
+                t += IDLE_STEP
+                continue
+            t += rng.expovariate(rate) if self.poisson else 1.0 / rate
+            if t < self.duration:
+                yield t
+
+    def __str__(self):
+        if self.pattern == "constant":
+            return f"constant {self.rate:g} req/s for {self.duration:g}s"
+        if self.pattern == "ramp":
+            return f"ramp {self.rate:g} -> {self.end_rate:g} req/s over {self.duration:g}s"
+        return f"{self.steps} steps {self.rate:g} -> {self.end_rate:g} req/s over {self.duration:g}s"
+
+
+class Window():
+
+    def __init__(self, start):
+        self.start = start
+        # requests scheduled to start in this window
+        self.offered = 0
+        self.dropped = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.errors = {}
+        # seconds from the scheduled start to the response, queueing on our side included
+        self.latencies = []
+        # how late the scheduler fired requests, it should stay close to 0
+        self.max_lag = 0.0
+
+    def to_dict(self, width):
+        return {
+            "start": round(self.start, 3),
+            "offered_rps": self.offered / width,
+            "achieved_rps": self.succeeded / width,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "error_rate": self.failed / (self.succeeded + self.failed) if self.succeeded + self.failed else 0.0,
+            "errors": {str(key): count for key, count in self.errors.items()},
+            "latency_ms": percentiles(self.latencies),
+            "max_lag_ms": round(self.max_lag * 1000, 3),
+        }
+
+
+class LoadTest():
+
+    """
+        Open-loop load generator replaying the seeded responses against the Formbricks
+        responses endpoint. Requests start at the times the LoadProfile sets, whether the
+        earlier ones have completed or not, so a slow server shows up as latency and errors
+        instead of quietly lowering the offered load. Latency is measured from the time a
+        request was scheduled, not the time it was sent.
+        No more than max_in_flight requests are open at once, arrivals above it are dropped
+        and reported, never queued. Stats are kept per window of `window` seconds: offered
+        and achieved requests/sec, errors and latency percentiles.
+        injester gives the target and the payloads, see DataInjester.
+    """
+    def __init__(self, injester, profile, window=5.0, max_in_flight=512, timeout=30, seed=None):
+        self.injester = injester
+        self.profile = profile
+        self.window = window
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self.seed = seed
+
+        self.windows = []
+        self.in_flight = 0
+
+    # (survey id, Formbricks survey id, answers file) of the surveys that were seeded
+    def _targets(self, survey_ids=None):
+
+        injester = self.injester
+        if survey_ids is None:
+            survey_ids = injester._load_formbricks_ids()
+
+        targets = []
+        for row in injester._survey_rows(survey_ids):
+            if row["answers_path"] is not None:
+                targets.append((row["id"], survey_ids[row["id"]], row["answers_path"]))
+        return targets
+
+    # The targets whose compiled answers have at least one response, the others have nothing to replay
+    def _replayable(self, targets):
+
+        compiler = self.injester.compiler
+        return [
+            (id, fb_id, answers_path) for id, fb_id, answers_path in targets
+            if str(answers_path) not in compiler.failures and next(compiler.responses(answers_path), None) is not None
+        ]
+
+    # Endless payloads, one survey after the other, every survey starts over once replayed. targets must be replayable
+    def _payloads(self, targets):
+
+        streams = {}
+        for id, fb_id, answers_path in itertools.cycle(targets):
+            stream = streams.get(id)
+            data = next(stream, None) if stream else None
+            if data is None:
+                streams[id] = stream = self.injester.compiler.responses(answers_path)
+                data = next(stream, None)
+                if data is None:
+                    continue
+            yield self.injester._response_payload(fb_id, data[1])
+
+    def _window(self, offset):
+
+        index = int(offset // self.window)
+        while len(self.windows) <= index:
+            self.windows.append(Window(len(self.windows) * self.window))
+        return self.windows[index]
+
+    async def _send(self, client, url, body, scheduled, start):
+
+        window = self._window(scheduled)
+        try:
+            res = await client.post(url, content=body)
+            error = None if res.status_code < 300 else res.status_code
+        except httpx.HTTPError as e:
+            error = type(e).__name__
+        finally:
+            self.in_flight -= 1
+
+        # counted in the window the request was scheduled in, so a window is never credited
+        # with the load of an earlier one
+        window.latencies.append(time.perf_counter() - start - scheduled)
+        if error is None:
+            window.succeeded += 1
+        else:
+            window.failed += 1
+            window.errors[error] = window.errors.get(error, 0) + 1
+
+    # Seconds of the run a window covers, the last one can be cut short by the duration
+    def _width(self, window):
+        return max(1e-9, min(self.window, self.profile.duration - window.start))
+
+    # Print every window once the requests scheduled in it had another window to complete
+    async def _report(self, start, stop):
+
+        printed = 0
+        while printed < len(self.windows) or not stop.is_set():
+            now = time.perf_counter() - start
+            while printed < len(self.windows) and (
+                stop.is_set() or now >= (printed + 1) * self.window + min(self.timeout, self.window)
+            ):
+                window = self.windows[printed]
+                print(self._line(window.to_dict(self._width(window))))
+                printed += 1
+            if stop.is_set():
+                break
+            await asyncio.sleep(0.2)
+
+    async def _run(self, payloads):
+
+        injester = self.injester
+        url = f"{injester.formbricks_host}/api/v1/management/responses"
+        headers = {**injester._get_header(), "Content-Type": "application/json"}
+        limits = httpx.Limits(max_connections=self.max_in_flight, max_keepalive_connections=self.max_in_flight)
+
+        tasks = set()
+        stop = asyncio.Event()
+
+        async with httpx.AsyncClient(headers=headers, limits=limits, timeout=self.timeout) as client:
+            start = time.perf_counter()
+            reporter = asyncio.create_task(self._report(start, stop))
+
+            for scheduled in self.profile.arrivals(self.seed):
+                delay = scheduled - (time.perf_counter() - start)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+                window = self._window(scheduled)
+                window.offered += 1
+                window.max_lag = max(window.max_lag, -delay)
+                if self.in_flight >= self.max_in_flight:
+                    window.dropped += 1
+                    continue
+
+                # encoded before the clock check of the next arrival, the loop never waits on a response
+                body = json.dumps(next(payloads)).encode("utf-8")
+                self.in_flight += 1
+                task = asyncio.create_task(self._send(client, url, body, scheduled, start))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+
+            if tasks:
+                await asyncio.gather(*tasks)
+            stop.set()
+            await reporter
+            return time.perf_counter() - start
+
+    def _line(self, window, label=None):
+
+        latency = window["latency_ms"]
+        return (
+            f"{label or format(window['start'], '>7.1f') + 's'}  offered {window['offered_rps']:7.1f}/s  achieved {window['achieved_rps']:7.1f}/s  "
+            f"errors {window['error_rate']:6.1%}  p50/p95/p99 {latency['p50']}/{latency['p95']}/{latency['p99']} ms"
+            + (f"  dropped {window['dropped']}" if window["dropped"] else "")
+            + (f"  lag {window['max_lag_ms']:.0f} ms" if window["max_lag_ms"] >= 50 else "")
+            + (f"  {window['errors']}" if window["errors"] else "")
+        )
+
+    """
+        Replay the responses of the seeded surveys, or of survey_ids ({survey id: Formbricks
+        survey id}) when given, and write the per window results to out. Returns the results.
+    """
+    def run(self, out="loadtest_results.json", survey_ids=None):
+
+        targets = self._targets(survey_ids)
+        if not targets:
+            print("No seeded survey with answers to replay, run formbricks seed first")
+            return None
+
+        self.injester.compile()
+        replayable = self._replayable(targets)
+        if not replayable:
+            print(f"None of the {len(targets)} seeded survey(s) has a response to replay, their answers files are empty")
+            return None
+        targets = replayable
+        print(f"Replaying {len(targets)} survey(s) against {self.injester.formbricks_host}: {self.profile}")
+
+        elapsed = asyncio.run(self._run(self._payloads(targets)))
+
+        windows = [window.to_dict(self._width(window)) for window in self.windows]
+        totals = Window(0.0)
+        for window in self.windows:
+            totals.offered += window.offered
+            totals.dropped += window.dropped
+            totals.succeeded += window.succeeded
+            totals.failed += window.failed
+            totals.latencies.extend(window.latencies)
+            totals.max_lag = max(totals.max_lag, window.max_lag)
+            for key, count in window.errors.items():
+                totals.errors[key] = totals.errors.get(key, 0) + count
+
+        # rates over the scheduled duration, like the windows, the drain after it adds no load
+        total = totals.to_dict(self.profile.duration)
+        print(self._line(total, "   total"))
+
+        results = {
+            "host": self.injester.formbricks_host,
+            "profile": str(self.profile),
+            "window": self.window,
+            "elapsed": elapsed,
+            "total": total,
+            "windows": windows,
+        }
+        if out:
+            with open(out, "w") as f:
+                json.dump(results, f, indent=2)
+            print(f"Results written to {out}")
+        return results
@@ -0,0 +1,421 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from pathlib import Path
+
+from src.payload_compiler import file_hash
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS surveys (
+    id            TEXT PRIMARY KEY,
+    path          TEXT,
+    source_hash   TEXT,
+    -- generated | failed
+    status        TEXT NOT NULL,
+    error         TEXT,
+    answers_path  TEXT,
+    answers_hash  TEXT,
+    answers_count INTEGER NOT NULL DEFAULT 0,
+    updated       REAL NOT NULL,
+    -- size and mtime of the files when they were hashed, scan() only hashes them again once they change
+    survey_size      INTEGER,
+    survey_mtime_ns  INTEGER,
+    answers_size     INTEGER,
+    answers_mtime_ns INTEGER
+);
+CREATE INDEX IF NOT EXISTS surveys_status ON surveys (status, answers_path);
+
+CREATE TABLE IF NOT EXISTS uploads (
+    target             TEXT NOT NULL,
+    survey_id          TEXT NOT NULL,
+    formbricks_id      TEXT,
+    -- created | failed
+    state              TEXT NOT NULL,
+    error              TEXT,
+    responses_uploaded INTEGER NOT NULL DEFAULT 0,
+    responses_failed   INTEGER NOT NULL DEFAULT 0,
+    updated            REAL NOT NULL,
+    PRIMARY KEY (target, survey_id)
+);
+CREATE INDEX IF NOT EXISTS uploads_state ON uploads (target, state);
+"""
+
+
+# Columns added to surveys since the first manifests, added to an older manifest when it is opened
+SURVEYS_COLUMNS = ("survey_size", "survey_mtime_ns", "answers_size", "answers_mtime_ns")
+
+
+# (size, mtime_ns) of a file, (None, None) when it is gone
+def _stat(path):
+
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None, None
+    return stat.st_size, stat.st_mtime_ns
+
+
+# Respondents in an answers file, one per non empty jsonl line or one per key of a legacy json document
+def count_answers(path):
+
+    path = Path(path)
+    if path.suffix == ".json":
+        with open(path) as f:
+            return len(json.load(f))
+    with open(path, "rb") as f:
+        return sum(1 for line in f if line.strip())
+
+
+class Manifest():
+
+    """
+        SQLite record of the corpus and of what was seeded where, shared by DataGenerator,
+        DataInjester and the topology workers (WAL, so several processes can write to it).
+        surveys has one row per survey id: its file and content hash, whether generation
+        succeeded, its answers file and respondent count.
+        uploads has one row per (target, survey id): the Formbricks id or the error of the
+        survey creation, and how many responses went up. The default environment is target "".
+        One connection per instance, guarded by a lock so generator threads can share it.
+    """
+    def __init__(self, path=Path("formbricks") / "manifest.db"):
+        self.path = Path(path)
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+            self._conn.row_factory = sqlite3.Row
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(SCHEMA)
+            columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(surveys)")}
+            for column in SURVEYS_COLUMNS:
+                if column not in columns:
+                    self._conn.execute(f"ALTER TABLE surveys ADD COLUMN {column} INTEGER")
+        return self._conn
+
+    def _execute(self, sql, params=()):
+
+        with self._lock:
+            return self._connect().execute(sql, params).fetchall()
+
+    def _executemany(self, sql, rows):
+
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN")
+            try:
+                conn.executemany(sql, rows)
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def close(self):
+
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    # ---------- Corpus ----------
+
+    def record_survey(self, id, path, source_hash):
+
+        self._execute(
+            """
+            INSERT INTO surveys (id, path, source_hash, status, error, updated, survey_size, survey_mtime_ns)
+            VALUES (?, ?, ?, 'generated', NULL, ?, ?, ?)
+            ON CONFLICT (id) DO UPDATE SET
+                path = excluded.path, source_hash = excluded.source_hash, status = 'generated', error = NULL,
+                updated = excluded.updated, survey_size = excluded.survey_size,
+                survey_mtime_ns = excluded.survey_mtime_ns
+            """,
+            (id, str(path), source_hash, time.time(), *_stat(path))
+        )
+
+    # answers_hash is None while a streamed file is still being appended to
+    def record_answers(self, id, path, count, answers_hash):
+
+        self._execute(
+            """
+            INSERT INTO surveys (id, status, answers_path, answers_hash, answers_count, updated, answers_size, answers_mtime_ns)
+            VALUES (?, 'failed', ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (id) DO UPDATE SET
+                answers_path = excluded.answers_path, answers_hash = excluded.answers_hash,
+                answers_count = excluded.answers_count, updated = excluded.updated,
+                answers_size = excluded.answers_size, answers_mtime_ns = excluded.answers_mtime_ns
+            """,
+            (id, str(path), answers_hash, count, time.time(), *_stat(path))
+        )
+
+    # A failed survey generation marks the survey failed, failed answers only keep the error
+    def record_failure(self, id, kind, error):
+
+        self._execute(
+            """
+            INSERT INTO surveys (id, status, error, updated) VALUES (?, 'failed', ?, ?)
+            ON CONFLICT (id) DO UPDATE SET
+                status = CASE WHEN ? = 'survey' THEN 'failed' ELSE status END,
+                error = excluded.error, updated = excluded.updated
+            """,
+            (id, f"{kind}: {error}", time.time(), kind)
+        )
+
+    # Generated surveys, or only these ids, ordered by id
+    def surveys(self, ids=None):
+
+        if ids is None:
+            return self._execute("SELECT * FROM surveys WHERE status = 'generated' ORDER BY id")
+        # the ids go in as one json array, however many there are
+        return self._execute(
+            "SELECT * FROM surveys WHERE status = 'generated' AND id IN (SELECT value FROM json_each(?)) ORDER BY id",
+            (json.dumps(list(ids)),)
+        )
+
+    def survey(self, id):
+
+        rows = self._execute("SELECT * FROM surveys WHERE id = ?", (id,))
+        return rows[0] if rows else None
+
+    # Counts the readiness check needs, straight from the index
+    def readiness(self):
+
+        row = self._execute(
+            """
+            SELECT
+                COUNT(*) FILTER (WHERE status = 'generated') AS generated,
+                COUNT(*) FILTER (WHERE status = 'failed') AS failed,
+                COUNT(*) FILTER (WHERE status = 'generated' AND answers_path IS NULL) AS without_answers,
+                COUNT(*) FILTER (WHERE status = 'failed' AND answers_path IS NOT NULL) AS orphan_answers,
+                COALESCE(SUM(answers_count) FILTER (WHERE status = 'generated'), 0) AS responses
+            FROM surveys
+            """
+        )[0]
+        return dict(row)
+
+    def is_empty(self):
+        return not self._execute("SELECT 1 FROM surveys LIMIT 1")
+
+    """
+        The manifest is authoritative, its writers keep it current: walk the corpus only when
+        rescan is asked for (--rescan) or when the manifest has never seen it (a corpus from an
+        older version, or a deleted manifest). Returns the number of files (re)registered.
+    """
+    def sync(self, rescan=False):
+
+        if rescan or self.is_empty():
+            return self.scan()
+        return 0
+
+    """
+        Bring the manifest in line with surveys/ and answers/, the only place ids are read from
+        file names. New files are registered, files whose size or mtime changed are hashed and
+        counted again, and deleted files are forgotten: a survey without its file is marked
+        failed (its answers are then reported as orphans), a row left with neither file goes.
+        Costs one stat per file, see sync() for when it runs. Returns the number of files
+        (re)registered.
+    """
+    def scan(self, surveys_directory=Path("surveys"), answers_directory=Path("answers")):
+
+        known = {row["id"]: row for row in self._execute("SELECT * FROM surveys")}
+        now = time.time()
+
+        surveys = []
+        survey_ids = set()
+        for path in sorted(Path(surveys_directory).glob("survey_*.json")):
+            id = path.stem.split("_", 1)[1]
+            survey_ids.add(id)
+            size, mtime_ns = _stat(path)
+            row = known.get(id)
+            if (
+                row is not None and row["status"] == "generated" and row["path"] == str(path)
+                and row["survey_size"] == size and row["survey_mtime_ns"] == mtime_ns
+            ):
+                continue
+            surveys.append((id, str(path), file_hash(path), now, size, mtime_ns))
+
+        answers_paths = {}
+        for path in sorted(Path(answers_directory).glob("answers_*.json*")):
+            if path.suffix not in (".json", ".jsonl"):
+                continue
+            id = path.stem.split("_", 1)[1]
+            # jsonl wins over a legacy json file of the same survey
+            if id not in answers_paths or path.suffix == ".jsonl":
+                answers_paths[id] = path
+
+        answers = []
+        for id, path in answers_paths.items():
+            size, mtime_ns = _stat(path)
+            row = known.get(id)
+            if (
+                row is not None and row["answers_path"] == str(path) and row["answers_hash"] is not None
+                and row["answers_size"] == size and row["answers_mtime_ns"] == mtime_ns
+            ):
+                continue
+            answers.append((str(path), count_answers(path), file_hash(path), now, size, mtime_ns, id))
+
+        # rows whose files are gone, the paths are checked too in case they live elsewhere
+        lost_surveys = [
+            (now, id) for id, row in known.items()
+            if row["status"] == "generated" and id not in survey_ids and not os.path.exists(row["path"] or "")
+        ]
+        lost_answers = [
+            (now, id) for id, row in known.items()
+            if row["answers_path"] is not None and id not in answers_paths and not os.path.exists(row["answers_path"])
+        ]
+
+        self._executemany(
+            """
+            INSERT INTO surveys (id, path, source_hash, status, updated, survey_size, survey_mtime_ns)
+            VALUES (?, ?, ?, 'generated', ?, ?, ?)
+            ON CONFLICT (id) DO UPDATE SET
+                path = excluded.path, source_hash = excluded.source_hash, status = 'generated', error = NULL,
+                updated = excluded.updated, survey_size = excluded.survey_size, survey_mtime_ns = excluded.survey_mtime_ns
+            """,
+            surveys
+        )
+        self._executemany(
+            """
+            INSERT INTO surveys (answers_path, answers_count, answers_hash, updated, answers_size, answers_mtime_ns, id, status)
+            VALUES (?, ?, ?, ?, ?, ?, ?, 'failed')
+            ON CONFLICT (id) DO UPDATE SET
+                answers_path = excluded.answers_path, answers_count = excluded.answers_count,
+                answers_hash = excluded.answers_hash, updated = excluded.updated,
+                answers_size = excluded.answers_size, answers_mtime_ns = excluded.answers_mtime_ns
+            """,
+            answers
+        )
+        self._executemany(
+            """
+            UPDATE surveys SET status = 'failed', error = 'survey file deleted', path = NULL, source_hash = NULL,
+                survey_size = NULL, survey_mtime_ns = NULL, updated = ?
+            WHERE id = ?
+            """,
+            lost_surveys
+        )
+        self._executemany(
+            """
+            UPDATE surveys SET answers_path = NULL, answers_hash = NULL, answers_count = 0,
+                answers_size = NULL, answers_mtime_ns = NULL, updated = ?
+            WHERE id = ?
+            """,
+            lost_answers
+        )
+        if lost_surveys or lost_answers:
+            # nothing left to point at, generation errors (no file ever written) are kept
+            self._execute("DELETE FROM surveys WHERE path IS NULL AND answers_path IS NULL AND error = 'survey file deleted'")
+        return len(surveys) + len(answers)
+
+    # ---------- Uploads ----------
+
+    # Formbricks id of a created survey, or the error it failed with
+    def record_upload(self, target, id, formbricks_id=None, error=None):
+
+        self._execute(
+            """
+            INSERT INTO uploads (target, survey_id, formbricks_id, state, error, updated) VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (target, survey_id) DO UPDATE SET
+                formbricks_id = excluded.formbricks_id, state = excluded.state, error = excluded.error,
+                updated = excluded.updated
+            """,
+            (target, id, formbricks_id, "created" if formbricks_id else "failed", error, time.time())
+        )
+
+    def add_responses(self, target, id, succeeded, failed):
+
+        self._execute(
+            """
+            UPDATE uploads SET responses_uploaded = responses_uploaded + ?, responses_failed = responses_failed + ?,
+                updated = ?
+            WHERE target = ? AND survey_id = ?
+            """,
+            (succeeded, failed, time.time(), target, id)
+        )
+
+    # Forget what was seeded to a target, a fresh (non resumed) seed starts from nothing
+    def reset_uploads(self, target):
+        self._execute("DELETE FROM uploads WHERE target = ?", (target,))
+
+    def has_uploads(self, target):
+        return bool(self._execute("SELECT 1 FROM uploads WHERE target = ? LIMIT 1", (target,)))
+
+    # {survey id: Formbricks id} of the surveys created on a target
+    def formbricks_ids(self, target):
+
+        rows = self._execute(
+            "SELECT survey_id, formbricks_id FROM uploads WHERE target = ? AND state = 'created' ORDER BY survey_id",
+            (target,)
+        )
+        return {row["survey_id"]: row["formbricks_id"] for row in rows}
+
+    # Generated surveys not created on a target yet, failed creations included
+    def pending(self, target, ids=None):
+
+        return self._execute(
+            """
+            SELECT s.* FROM surveys s
+            LEFT JOIN uploads u ON u.target = ? AND u.survey_id = s.id AND u.state = 'created'
+            WHERE s.status = 'generated' AND u.survey_id IS NULL
+                AND (? IS NULL OR s.id IN (SELECT value FROM json_each(?)))
+            ORDER BY s.id
+            """,
+            (target, *(2 * [None if ids is None else json.dumps(list(ids))]))
+        )
+
+    # (created, failed, responses uploaded, responses failed) of a target
+    def upload_counts(self, target):
+
+        row = self._execute(
+            """
+            SELECT
+                COUNT(*) FILTER (WHERE state = 'created') AS created,
+                COUNT(*) FILTER (WHERE state = 'failed') AS failed,
+                COALESCE(SUM(responses_uploaded), 0) AS responses_uploaded,
+                COALESCE(SUM(responses_failed), 0) AS responses_failed
+            FROM uploads WHERE target = ?
+            """,
+            (target,)
+        )[0]
+        return dict(row)
+
+    """
+        Import a formbricks_ids.json written before the manifest ({survey path: Formbricks id
+        or "ERROR"}), for a target that has no uploads recorded yet. The file is renamed to
+        formbricks_ids.json.imported. Returns the number of surveys imported.
+    """
+    def import_formbricks_ids(self, target, path):
+
+        path = Path(path)
+        if not path.exists() or self.has_uploads(target):
+            return 0
+
+        with open(path) as f:
+            ids = json.load(f)
+
+        now = time.time()
+        rows = []
+        for survey_path, fb_id in ids.items():
+            id = Path(survey_path).stem.split("_", 1)[1]
+            if fb_id == "ERROR":
+                rows.append((target, id, None, "failed", "imported from formbricks_ids.json", now))
+            else:
+                rows.append((target, id, fb_id, "created", None, now))
+
+        self._executemany(
+            """
+            INSERT OR REPLACE INTO uploads (target, survey_id, formbricks_id, state, error, updated)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            rows
+        )
+        # kept for reference, but never imported twice
+        path.rename(path.with_name(path.name + ".imported"))
+        return len(rows)
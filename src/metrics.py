@@ -0,0 +1,272 @@
+import cProfile
+import json
+import pstats
+import threading
+import time
+
+from contextlib import contextmanager
+from pathlib import Path
+
+
+# Upper bounds (seconds) of the request latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+PREFIX = "formbricks_seeder"
+
+
+# p50/p95/p99 in ms of latencies in seconds, None when there are none
+def percentiles(values):
+
+    if not values:
+        return {"p50": None, "p95": None, "p99": None}
+
+    values = sorted(values)
+    pick = lambda q: round(values[min(len(values) - 1, int(q * len(values)))] * 1000, 3)
+    return {"p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99)}
+
+
+class Histogram():
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        # counts[i] holds the observations <= buckets[i], the last slot is +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                return
+        self.counts[-1] += 1
+
+    # Cumulative (upper bound, count) pairs, the way Prometheus exposes buckets
+    def cumulative(self):
+
+        total = 0
+        pairs = []
+        for bound, count in zip(list(self.buckets) + ["+Inf"], self.counts):
+            total += count
+            pairs.append((bound, total))
+        return pairs
+
+
+class Metrics():
+
+    """
+        Instrumentation of a generate or seed run: wall time per phase, a latency
+        histogram, request count, error count and bytes sent per endpoint, and the
+        prompt/completion tokens reported by the LLM. Safe to share between threads.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        # phase -> [seconds, times entered], a phase entered from several threads adds up
+        self.phases = {}
+        self.latency = {}
+        self.requests = {}
+        self.errors = {}
+        self.bytes_sent = {}
+        self.tokens = {"prompt": 0, "completion": 0}
+
+    @contextmanager
+    def phase(self, name):
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                seconds, count = self.phases.get(name, (0.0, 0))
+                self.phases[name] = (seconds + elapsed, count + 1)
+
+    # Record one request sent to an endpoint
+    def observe(self, endpoint, seconds, bytes_sent=0, error=False):
+
+        with self._lock:
+            if endpoint not in self.latency:
+                self.latency[endpoint] = Histogram()
+            self.latency[endpoint].observe(seconds)
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+            self.bytes_sent[endpoint] = self.bytes_sent.get(endpoint, 0) + bytes_sent
+            if error:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+    # Add the usage block of a completion (prompt_tokens, completion_tokens), an object or a dict
+    def add_usage(self, usage):
+
+        if usage is None:
+            return
+        get = usage.get if isinstance(usage, dict) else lambda key: getattr(usage, key, 0)
+        with self._lock:
+            self.tokens["prompt"] += get("prompt_tokens") or 0
+            self.tokens["completion"] += get("completion_tokens") or 0
+
+    # Add the to_dict() of another run, a worker process, to this one. Both use LATENCY_BUCKETS
+    def merge(self, data):
+
+        with self._lock:
+            for name, phase in data["phases"].items():
+                seconds, count = self.phases.get(name, (0.0, 0))
+                self.phases[name] = (seconds + phase["seconds"], count + phase["count"])
+
+            for endpoint, stats in data["endpoints"].items():
+                if endpoint not in self.latency:
+                    self.latency[endpoint] = Histogram()
+                histogram = self.latency[endpoint]
+                latency = stats["latency_seconds"]
+                # the buckets are cumulative, the histogram keeps a count per bucket
+                below = 0
+                for i, count in enumerate(latency["buckets"].values()):
+                    histogram.counts[i] += count - below
+                    below = count
+                histogram.count += latency["count"]
+                histogram.sum += latency["sum"]
+
+                self.requests[endpoint] = self.requests.get(endpoint, 0) + stats["requests"]
+                self.bytes_sent[endpoint] = self.bytes_sent.get(endpoint, 0) + stats["bytes_sent"]
+                if stats["errors"]:
+                    self.errors[endpoint] = self.errors.get(endpoint, 0) + stats["errors"]
+
+            for kind, count in data["tokens"].items():
+                self.tokens[kind] = self.tokens.get(kind, 0) + count
+
+    def to_dict(self):
+
+        with self._lock:
+            return {
+                "phases": {
+                    name: {"seconds": round(seconds, 6), "count": count}
+                    for name, (seconds, count) in self.phases.items()
+                },
+                "endpoints": {
+                    endpoint: {
+                        "requests": self.requests[endpoint],
+                        "errors": self.errors.get(endpoint, 0),
+                        "bytes_sent": self.bytes_sent[endpoint],
+                        "latency_seconds": {
+                            "count": histogram.count,
+                            "sum": round(histogram.sum, 6),
+                            "buckets": {str(bound): count for bound, count in histogram.cumulative()},
+                        },
+                    }
+                    for endpoint, histogram in self.latency.items()
+                },
+                "tokens": dict(self.tokens),
+            }
+
+    # Prometheus text exposition format
+    def to_prometheus(self):
+
+        data = self.to_dict()
+        lines = []
+
+        def family(name, kind, help):
+            lines.append(f"# HELP {PREFIX}_{name} {help}")
+            lines.append(f"# TYPE {PREFIX}_{name} {kind}")
+
+        family("phase_seconds", "gauge", "Wall time spent in each phase")
+        for name, phase in data["phases"].items():
+            lines.append(f'{PREFIX}_phase_seconds{{phase="{name}"}} {phase["seconds"]}')
+
+        family("request_duration_seconds", "histogram", "Request latency per endpoint")
+        for endpoint, stats in data["endpoints"].items():
+            latency = stats["latency_seconds"]
+            for bound, count in latency["buckets"].items():
+                lines.append(f'{PREFIX}_request_duration_seconds_bucket{{endpoint="{endpoint}",le="{bound}"}} {count}')
+            lines.append(f'{PREFIX}_request_duration_seconds_sum{{endpoint="{endpoint}"}} {latency["sum"]}')
+            lines.append(f'{PREFIX}_request_duration_seconds_count{{endpoint="{endpoint}"}} {latency["count"]}')
+
+        for name, key, help in (
+            ("requests_total", "requests", "Requests sent per endpoint, retries included"),
+            ("request_errors_total", "errors", "Requests per endpoint that failed"),
+            ("request_bytes_total", "bytes_sent", "Request body bytes sent per endpoint"),
+        ):
+            family(name, "counter", help)
+            for endpoint, stats in data["endpoints"].items():
+                lines.append(f'{PREFIX}_{name}{{endpoint="{endpoint}"}} {stats[key]}')
+
+        family("llm_tokens_total", "counter", "Tokens reported by the LLM usage blocks")
+        for kind, count in data["tokens"].items():
+            lines.append(f'{PREFIX}_llm_tokens_total{{type="{kind}"}} {count}')
+
+        return "\n".join(lines) + "\n"
+
+    # Write {path}.json and {path}.prom, any suffix given on path is replaced
+    def write(self, path):
+
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        with open(path.with_suffix(".json"), "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+        with open(path.with_suffix(".prom"), "w") as f:
+            f.write(self.to_prometheus())
+
+        print(f"Metrics written to {path.with_suffix('.json')} and {path.with_suffix('.prom')}")
+
+
+class Profiler():
+
+    """
+        cProfile over several threads. cProfile only sees the thread it was enabled in,
+        so every thread that runs wrapped work gets its own profiler and they are merged
+        into a single pstats file on dump, with the pstats files of worker processes added
+        by add_dump().
+    """
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._profiles = []
+        self._dumps = []
+
+    def _profile(self):
+
+        profile = getattr(self._local, "profile", None)
+        if profile is None:
+            profile = self._local.profile = cProfile.Profile()
+            with self._lock:
+                self._profiles.append(profile)
+        return profile
+
+    # Run fn(*args) under the calling thread's profiler
+    def run(self, fn, *args, **kwargs):
+
+        profile = self._profile()
+        # a nested call is already being profiled
+        if getattr(self._local, "active", False):
+            return fn(*args, **kwargs)
+
+        self._local.active = True
+        profile.enable()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            profile.disable()
+            self._local.active = False
+
+    def wrap(self, fn):
+        return lambda *args, **kwargs: self.run(fn, *args, **kwargs)
+
+    # Merge the pstats file another process wrote into the next dump
+    def add_dump(self, path):
+
+        with self._lock:
+            self._dumps.append(path)
+
+    def dump(self, path):
+
+        with self._lock:
+            profiles = [profile for profile in self._profiles if profile.getstats()]
+            dumps = list(self._dumps)
+        if not profiles and not dumps:
+            return
+
+        stats = pstats.Stats(*profiles, *dumps)
+        stats.dump_stats(path)
+
+        print(f"Profile written to {path} (open it with: python -m pstats {path})")
@@ -0,0 +1,435 @@
+import hashlib
+import itertools
+import json
+import os
+import tempfile
+
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+
+OPERATOR_MAP = {
+    "<=": "isLessThanOrEqual",
+    "<": "isLessThan",
+    ">": "isGreaterThan",
+    ">=": "isGreaterThanOrEqual",
+    "==": "equals",
+    "!=": "notEquals",
+    "submitted": "isSubmitted",
+    "selected": "includesOneOf",
+}
+# Operators without a value, Formbricks gets no right operand for them
+VALUELESS_OPERATORS = {"submitted"}
+
+# Bytes read at a time when hashing a source file
+HASH_CHUNK = 1024 * 1024
+
+# What compiling a malformed source raises, it fails that source and not the build
+CONTENT_ERRORS = (ValueError, LookupError, TypeError, AttributeError)
+
+
+def file_hash(path):
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Endless ids derived from a seed, the same seed always gives the same ids in the same order
+def deterministic_ids(seed):
+
+    for n in itertools.count():
+        yield hashlib.sha256(f"{seed}:{n}".encode("utf-8")).hexdigest()[:24]
+
+
+"""
+    Check the shape survey_to_blocks and SurveyLogicGraph rely on: {"survey": {"questions": [...]}}
+    where every question is an object with a question_id and a question_type, and its
+    logic, when present, an object whose conditions are a list of {"if": {...}}.
+    Raises ValueError on the first thing out of place.
+"""
+def check_survey_structure(generated_survey):
+
+    survey = generated_survey.get("survey") if isinstance(generated_survey, dict) else None
+    if not isinstance(survey, dict):
+        raise ValueError('not a survey, expected {"survey": {...}}')
+    questions = survey.get("questions")
+    if not isinstance(questions, list):
+        raise ValueError("survey.questions is not a list")
+
+    for i, q in enumerate(questions):
+        if not isinstance(q, dict):
+            raise ValueError(f"question {i + 1} is not an object")
+        for key in ("question_id", "question_type"):
+            if not isinstance(q.get(key), str):
+                raise ValueError(f"question {i + 1} has no {key}")
+        qid = q["question_id"]
+        if not isinstance(q.get("config", {}), dict):
+            raise ValueError(f"{qid}: config is not an object")
+        logic = q.get("logic", {})
+        if not isinstance(logic, dict):
+            raise ValueError(f"{qid}: logic is not an object")
+        conditions = logic.get("conditions", [])
+        if not isinstance(conditions, list):
+            raise ValueError(f"{qid}: logic.conditions is not a list")
+        if not all(isinstance(rule, dict) and isinstance(rule.get("if"), dict) for rule in conditions):
+            raise ValueError(f'{qid}: a condition is not an {{"if": {{...}}}} object')
+
+
+"""
+    Convert a generated survey into a Formbricks survey payload. new_id() gives the block,
+    logic, condition and action ids. environmentId is left to the caller, the payload does
+    not depend on the environment it is uploaded to.
+    Raises ValueError on a malformed survey (see check_survey_structure) and on logic Formbricks
+    cannot express: an unknown operator, a missing value or a go_to to a question that does not exist.
+"""
+def survey_to_blocks(generated_survey, new_id):
+
+    check_survey_structure(generated_survey)
+    questions = generated_survey["survey"]["questions"]
+
+    # Map question_id -> block cuid
+    qid_to_block = {
+        q["question_id"]: new_id()
+        for q in questions
+    }
+
+    blocks = []
+
+    for q in questions:
+        qid = q["question_id"]
+        qtype = q["question_type"]
+
+        # ---------- Question ----------
+        fb_question = {
+            "id": qid,
+            "type": qtype,
+            "required": q["logic"].get("required", False),
+            "headline": {"default": q["question_text"]}
+        }
+
+        if qtype == "rating":
+            fb_question.update({
+                "range": q["config"]["rating"]["max_value"],
+                "scale": "star",
+                "isColorCodingEnabled": False,
+                "lowerLabel": {"default": "Not satisfied"},
+                "upperLabel": {"default": "Very satisfied"},
+            })
+
+        if qtype == "openText":
+            fb_question.update({
+                "inputType": "text",
+                "placeholder": {
+                    "default": q["config"]["text"].get("placholder", "")
+                }
+            })
+
+        # ---------- Logic ----------
+        logic_conditions = q["logic"].get("conditions", [])
+        fb_logic = []
+        if logic_conditions:
+            for rule in logic_conditions:
+                rule_if = rule["if"]
+                operator = OPERATOR_MAP.get(rule_if.get("operator"))
+                if operator is None:
+                    raise ValueError(f"{qid} uses operator {rule_if.get('operator')!r}, Formbricks has no equivalent")
+                if rule_if.get("go_to") not in qid_to_block:
+                    raise ValueError(f"{qid} jumps to unknown question {rule_if.get('go_to')}")
+
+                # ids drawn in the order of the payload, logic, conditions, condition, action
+                logic_id, conditions_id = new_id(), new_id()
+                condition = {
+                    "id":new_id(),
+                    "operator": operator,
+                    "leftOperand": {
+                        "type": "element",
+                        "value": qid
+                    }
+                }
+                if rule_if["operator"] not in VALUELESS_OPERATORS:
+                    if "value" not in rule_if:
+                        raise ValueError(f"{qid} uses operator {rule_if['operator']} without a value")
+                    value = rule_if["value"]
+                    # includesOneOf takes a list of choices
+                    if rule_if["operator"] == "selected" and not isinstance(value, list):
+                        value = [value]
+                    condition["rightOperand"] = {
+                        "type": "static",
+                        "value": value
+                    }
+
+                fb_logic.append({
+                    "id":logic_id,
+                    "conditions": {
+                        "id":conditions_id,
+                        "connector": "and",
+                        "conditions": [condition]
+                    },
+                    "actions": [
+                        {
+                            "id":new_id(),
+                            "objective": "jumpToBlock",
+                            "target": qid_to_block[rule_if["go_to"]]
+                        }
+                    ]
+                })
+        # ---------- Block ----------
+        block = {
+            "id": qid_to_block[qid],
+            "name": f"Block for {qid}",
+            "type": "question",
+            "elements": [fb_question]
+        }
+        if len(fb_logic) > 0:
+            block["logic"] = fb_logic
+
+        blocks.append(block)
+
+    return {
+        "name": generated_survey["survey"]["name"],
+        "type": "link",
+        "status": "inProgress",
+        "environmentId": None,
+        "blocks": blocks,
+        "questions": [],
+        "endings": [],
+        "hiddenFields": {"enabled": False, "fieldIds": []}
+    }
+
+
+# Formbricks response data of a generated respondent, {question_id: value}
+def response_data(answers):
+
+    return {ans["question_id"]: ans["value"] for ans in answers["answers"]}
+
+
+"""
+    Yield (user_id, answer) one respondent at a time, from jsonl or a legacy json document.
+    A jsonl file can still be appended to by a streamed generation, an unterminated last line
+    that does not parse is the user being written and is left for the next read.
+"""
+def iter_answers(answers_path):
+
+    answers_path = Path(answers_path)
+    if answers_path.suffix == ".json":
+        with open(answers_path) as f:
+            yield from json.load(f).items()
+        return
+
+    with open(answers_path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                answer = json.loads(line)
+            except ValueError:
+                if line.endswith("\n"):
+                    raise
+                return
+            yield answer.pop("user_id"), answer
+
+
+"""
+    Compile one source file into target, runs inside a worker process.
+    A survey becomes its payload, with ids derived from the source hash. An answers file
+    becomes jsonl lines of {"user_id", "data"}. Written to a temporary file then renamed,
+    so an interrupted build never leaves half an entry behind.
+"""
+def compile_source(kind, source, target, digest):
+
+    target = Path(target)
+    fd, tmp_path = tempfile.mkstemp(dir=target.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as out:
+            if kind == "survey":
+                with open(source, encoding="utf-8") as f:
+                    survey = json.load(f)
+                ids = deterministic_ids(digest)
+                json.dump(survey_to_blocks(survey, lambda: next(ids)), out)
+            else:
+                for user_id, answer in iter_answers(source):
+                    out.write(json.dumps({"user_id": user_id, "data": response_data(answer)}) + "\n")
+        os.replace(tmp_path, target)
+    except BaseException:
+        Path(tmp_path).unlink(missing_ok=True)
+        raise
+
+    return source
+
+
+class PayloadCompiler():
+
+    """
+        Incremental build of the Formbricks payloads into formbricks/compiled/.
+        Each survey and answers file is compiled once per content hash, into
+        survey_{hash}.json or responses_{hash}.jsonl. index.json remembers the hash, size and
+        mtime of every source, so an unchanged file is not even read again. Stale sources are
+        compiled over a process pool. Environment, Formbricks survey id and timestamps are not
+        part of the compiled payloads, they are added at upload time, so one build serves every
+        target of a topology.
+    """
+    def __init__(self, path=Path("formbricks") / "compiled", workers=None, force=False):
+        self.path = Path(path)
+        self.workers = workers or os.cpu_count() or 1
+        # force recompiles every source, whatever the index says
+        self.force = force
+        self.compiled = 0
+        self.reused = 0
+        # source -> why it could not be compiled, such a source has no compiled payload
+        self.failures = {}
+        self._index = None
+
+    @property
+    def index(self):
+
+        if self._index is None:
+            try:
+                with open(self.path / "index.json", encoding="utf-8") as f:
+                    self._index = json.load(f)
+            except (OSError, ValueError):
+                self._index = {}
+        return self._index
+
+    def _save_index(self):
+
+        self.path.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(self.index, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path / "index.json")
+
+    def _target(self, kind, digest):
+
+        if kind == "survey":
+            return self.path / f"survey_{digest}.json"
+        return self.path / f"responses_{digest}.jsonl"
+
+    # Index entry of a source when its compiled file can be reused, None when it has to be (re)built
+    def _fresh(self, source, stat):
+
+        entry = self.index.get(str(source))
+        if self.force or entry is None or not self._target(entry["kind"], entry["hash"]).exists():
+            return None
+        if entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+            return entry
+        # touched but maybe not changed, the hash decides
+        if file_hash(source) == entry["hash"]:
+            entry["mtime_ns"] = stat.st_mtime_ns
+            return entry
+        return None
+
+    """
+        Bring the compiled payloads of sources, a list of ("survey" | "responses", path),
+        up to date. Returns (compiled, reused) counts.
+        A source whose content cannot be compiled (see survey_to_blocks) does not stop the
+        build, it is left out of the index and recorded in failures.
+    """
+    def build(self, sources):
+
+        self.path.mkdir(parents=True, exist_ok=True)
+        tasks = []
+        reused = 0
+        touched = False
+
+        for kind, source in sources:
+            self.failures.pop(str(source), None)
+            stat = os.stat(source)
+            mtime_ns = self.index.get(str(source), {}).get("mtime_ns")
+            if self._fresh(source, stat):
+                reused += 1
+                touched = touched or mtime_ns != stat.st_mtime_ns
+                continue
+
+            digest = file_hash(source)
+            self.index[str(source)] = {"kind": kind, "hash": digest, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+            target = self._target(kind, digest)
+            # another source with the same content was already compiled
+            if target.exists() and not self.force:
+                reused += 1
+            else:
+                tasks.append((kind, str(source), str(target), digest))
+            touched = True
+
+        # a source listed twice, or two sources with the same content, are compiled once
+        unique = list({task[2]: task for task in tasks}.values())
+        reused += len(tasks) - len(unique)
+        tasks = unique
+
+        # compiled file -> error, for the tasks whose source content could not be compiled
+        failed = {}
+        if len(tasks) == 1 or (tasks and self.workers == 1):
+            for task in tasks:
+                try:
+                    compile_source(*task)
+                except CONTENT_ERRORS as e:
+                    failed[task[2]] = f"{type(e).__name__}: {e}"
+        elif tasks:
+            with ProcessPoolExecutor(max_workers=min(self.workers, len(tasks))) as pool:
+                futures = [(task[2], pool.submit(compile_source, *task)) for task in tasks]
+                for target, future in futures:
+                    try:
+                        future.result()
+                    except CONTENT_ERRORS as e:
+                        failed[target] = f"{type(e).__name__}: {e}"
+
+        if failed:
+            # every source with that content failed, built again on the next build
+            for source, entry in list(self.index.items()):
+                target = str(self._target(entry["kind"], entry["hash"]))
+                if target in failed:
+                    del self.index[source]
+                    self.failures[source] = failed[target]
+
+        if touched:
+            self.prune()
+            self._save_index()
+
+        self.compiled += len(tasks) - len(failed)
+        self.reused += reused
+        return len(tasks) - len(failed), reused
+
+    # Forget sources that were deleted and drop the compiled files no source points to anymore
+    def prune(self):
+
+        for source in [source for source in self.index if not os.path.exists(source)]:
+            del self.index[source]
+
+        live = {self._target(entry["kind"], entry["hash"]).name for entry in self.index.values()}
+        removed = 0
+        for compiled_path in list(self.path.glob("survey_*.json")) + list(self.path.glob("responses_*.jsonl")):
+            if compiled_path.name not in live:
+                compiled_path.unlink(missing_ok=True)
+                removed += 1
+        return removed
+
+    def _compiled_path(self, source):
+
+        entry = self.index.get(str(source))
+        if entry is None:
+            raise KeyError(f"{source} is not compiled, build() it first")
+        return self._target(entry["kind"], entry["hash"])
+
+    # Compiled payload of a survey source, environmentId still unset
+    def survey(self, source):
+
+        with open(self._compiled_path(source), encoding="utf-8") as f:
+            return json.load(f)
+
+    # Yield (user_id, data) for the respondents of a compiled answers source
+    def responses(self, source):
+
+        with open(self._compiled_path(source), encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    yield entry["user_id"], entry["data"]
+
+    def __str__(self):
+
+        text = f"{self.compiled} compiled, {self.reused} reused"
+        if self.failures:
+            text += f", {len(self.failures)} failed"
+        return text
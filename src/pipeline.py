@@ -0,0 +1,305 @@
+import json
+import os
+import queue
+import threading
+import time
+import traceback
+
+from pathlib import Path
+
+import requests
+
+from src.payload_compiler import iter_answers, response_data
+from src.survey_logic import LogicReport, SurveyLogicGraph
+
+
+"""
+    Poll url until it answers 2xx, waiting initial seconds between tries and doubling up to
+    maximum. Returns the seconds it took, raises TimeoutError after timeout seconds.
+"""
+def wait_until_ready(url, timeout=300.0, initial=0.5, maximum=5.0):
+
+    start = time.perf_counter()
+    delay = initial
+    last_error = None
+
+    while True:
+        try:
+            res = requests.get(url, timeout=min(5.0, maximum))
+            if res.ok:
+                return time.perf_counter() - start
+            last_error = f"HTTP {res.status_code}"
+        except requests.RequestException as e:
+            last_error = type(e).__name__
+
+        elapsed = time.perf_counter() - start
+        if elapsed + delay > timeout:
+            raise TimeoutError(f"{url} was not ready after {elapsed:.0f}s (last error: {last_error})")
+        time.sleep(delay)
+        delay = min(maximum, delay * 2)
+
+
+class Pipeline():
+
+    """
+        Start Formbricks, generate and seed in one go, with the stages overlapping:
+        - start() (docker compose up) runs while the LLM generation is already going
+        - the health endpoint is polled with backoff, surveys are created as soon as it answers
+        - every survey is created as soon as it is generated, and its responses are uploaded as
+          soon as all of its answers are generated and its Formbricks id exists, or user by user
+          while they are generated with a streaming generator (the upload journal skips the
+          users already sent)
+        generator is a DataGenerator and injester a DataInjester, both sharing metrics.
+        Answers files are read from where the previous event left them, so every respondent
+        is read, checked against the survey logic and uploaded once however many events a
+        streamed survey sends.
+        Stage timings are reported at the end, with the time a sequential run would have taken.
+    """
+    def __init__(self, generator, injester, start=None, health_path="/health", ready_timeout=300.0, check_logic=True):
+        self.generator = generator
+        self.injester = injester
+        self.start = start
+        self.health_url = injester.formbricks_host.rstrip("/") + health_path
+        self.ready_timeout = ready_timeout
+        self.check_logic_enabled = check_logic
+        self.metrics = injester.metrics
+
+        # stage -> [start, end] in seconds from the start of the run
+        self.stages = {}
+        # seconds the seeder spent uploading, the rest of its stage it waited on generation
+        self.seed_busy = 0.0
+        self.failed = []
+        # what stopped the seeder, the run is then not reported as a success
+        self.seed_error = None
+
+        # survey id -> bytes of its answers file already read
+        self._offsets = {}
+        # survey id -> LogicReport of its respondents read so far
+        self._reports = {}
+        self._logic_failed = set()
+        # surveys never created, their answers are skipped
+        self._skipped = set()
+
+        self._events = queue.Queue()
+        self._ready = threading.Event()
+        self._ready_error = None
+        self._t0 = None
+
+    def _now(self):
+        return time.perf_counter() - self._t0
+
+    def _stage(self, name, start, end=None):
+        self.stages[name] = [start, self._now() if end is None else end]
+
+    # Called by the generator threads, the seeder picks the events up in order
+    def _on_saved(self, kind, id):
+        self._events.put((kind, id))
+
+    # docker compose up, then poll the health endpoint
+    def _bring_up(self):
+
+        try:
+            if self.start:
+                start = self._now()
+                with self.metrics.phase("up"):
+                    self.start()
+                self._stage("up", start)
+
+            start = self._now()
+            with self.metrics.phase("wait_ready"):
+                wait_until_ready(self.health_url, timeout=self.ready_timeout)
+            self._stage("wait_ready", start)
+            print(f"Formbricks is ready at {self.health_url} after {self._now():.1f}s")
+        except Exception as e:
+            self._ready_error = e
+        finally:
+            self._ready.set()
+
+    """
+        (user_id, answer) of the respondents appended to an answers file since the last call.
+        Only complete lines are read, a streamed user still being written is picked up with the
+        next event. A file that shrank was rewritten and is read again from the start, the
+        upload journal skips the users already sent. A legacy json file is read whole.
+    """
+    def _new_respondents(self, id, answers_path):
+
+        path = Path(answers_path)
+        if path.suffix == ".json":
+            return list(iter_answers(path))
+
+        offset = self._offsets.get(id, 0)
+        if os.path.getsize(path) < offset:
+            offset = 0
+
+        respondents = []
+        with open(path, "rb") as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                offset += len(line)
+                if line.strip():
+                    answer = json.loads(line)
+                    respondents.append((answer.pop("user_id"), answer))
+        self._offsets[id] = offset
+        return respondents
+
+    """
+        The respondents of a survey that may be uploaded. Its logic graph is compiled once and
+        every respondent is checked once, as it is read. A survey fails on a graph error or on
+        the first respondent who answered a hidden question: it is reported and recorded in
+        failed once, and none of its later respondents go up.
+    """
+    def _checked(self, id, survey_path, respondents):
+
+        if not self.check_logic_enabled:
+            return respondents
+        if id in self._logic_failed:
+            return []
+
+        report = self._reports.get(id)
+        if report is None:
+            with open(survey_path, encoding="utf-8") as f:
+                report = self._reports[id] = LogicReport(id, SurveyLogicGraph(json.load(f)))
+
+        with self.metrics.phase("check_logic"):
+            for user_id, answer in respondents:
+                values = {a["question_id"]: a["value"] for a in answer["answers"]}
+                report.add(user_id, *report.graph.check_respondent(values))
+
+        if not report.ok:
+            print(report)
+            self._logic_failed.add(id)
+            self.failed.append(("logic", id))
+            return []
+        return respondents
+
+    # Create surveys and upload answers as their files show up, until the generator is done
+    def _seed(self):
+
+        self._ready.wait()
+        if self._ready_error:
+            return
+
+        injester = self.injester
+        start = None
+        done = False
+
+        try:
+            injester._open_journal()
+            # survey id -> Formbricks id of the surveys created so far, by the interrupted run too when resuming
+            created = injester._load_formbricks_ids()
+
+            while not done:
+                events = [self._events.get()]
+                while True:
+                    try:
+                        events.append(self._events.get_nowait())
+                    except queue.Empty:
+                        break
+
+                busy = time.perf_counter()
+                if start is None:
+                    start = self._now()
+
+                # surveys first, the answers in the same batch may belong to them
+                surveys = {id for kind, id in events if kind == "survey"}
+                # a streamed generation sends an event per user, a survey is uploaded once per batch
+                answers = list(dict.fromkeys(id for kind, id in events if kind == "answers"))
+                done = any(kind is None for kind, _ in events)
+
+                if surveys:
+                    # answers are read straight from their files below, not compiled
+                    injester.compile(surveys, answers=False)
+                    created.update(injester._generate_formbricks_survey_json_and_upload(surveys))
+
+                for id in answers:
+                    if id not in created:
+                        if id not in self._skipped:
+                            print(f"Survey {id} was never created, skipping its answers")
+                            self._skipped.add(id)
+                        continue
+                    row = injester.manifest.survey(id)
+                    respondents = self._checked(id, row["path"], self._new_respondents(id, row["answers_path"]))
+                    if respondents:
+                        injester._upload_survey_answers(
+                            id, created[id], row["answers_path"],
+                            respondents=((user_id, response_data(answer)) for user_id, answer in respondents)
+                        )
+
+                self.seed_busy += time.perf_counter() - busy
+        except Exception as e:
+            traceback.print_exc()
+            self.seed_error = e
+        finally:
+            injester.journal.close()
+            if start is not None:
+                self._stage("seed", start)
+
+    def _report(self):
+
+        wall = self._now()
+        print("Stage          start      end   seconds")
+        for name, (start, end) in sorted(self.stages.items(), key=lambda stage: stage[1][0]):
+            print(f"{name:<12} {start:7.1f}s {end:7.1f}s {end - start:8.1f}s")
+
+        # what the same work takes when every stage waits for the previous one
+        sequential = sum(
+            end - start for name, (start, end) in self.stages.items() if name != "seed"
+        ) + self.seed_busy
+        print(f"Seeding was busy {self.seed_busy:.1f}s of its stage, the rest it waited on generation")
+        print(
+            f"Wall clock {wall:.1f}s, the stages one after the other take {sequential:.1f}s: "
+            f"overlapping saved {sequential - wall:.1f}s"
+        )
+        print(f"Upload summary: {self.injester.upload_summary}")
+
+    # Returns the failed generation jobs and the surveys whose answers failed the logic check
+    def run(self, n=5):
+
+        self._t0 = time.perf_counter()
+        self.generator.on_saved = self._on_saved
+
+        bring_up = threading.Thread(target=self._bring_up, daemon=True)
+        seeder = threading.Thread(target=self._seed, daemon=True)
+        bring_up.start()
+        seeder.start()
+
+        start = self._now()
+        try:
+            self.failed.extend(self.generator.generate(n=n) or [])
+        finally:
+            self._stage("generate", start)
+            self._events.put((None, None))
+
+        bring_up.join()
+        seeder.join()
+
+        if self._ready_error:
+            print(f"Formbricks did not come up, nothing was seeded: {self._ready_error}")
+            self.failed.append(("ready", str(self._ready_error)))
+            return self.failed
+
+        if self.seed_error:
+            print(f"Seeding stopped on {type(self.seed_error).__name__}: {self.seed_error}")
+            print(f"Upload summary until then: {self.injester.upload_summary}")
+            self.failed.append(("seed", str(self.seed_error)))
+            return self.failed
+
+        self._report()
+        if self._logic_failed:
+            print(
+                f"Survey logic check failed for {', '.join(sorted(self._logic_failed))}, "
+                "their responses were not uploaded (use --no-logic-check to upload anyway)"
+            )
+        return self.failed
+
+    # The run did not get everything up: Formbricks never came up or the seeder failed
+    @property
+    def aborted(self):
+        return self._ready_error is not None or self.seed_error is not None
+
+    # The seed step went through: not aborted, and no survey held back by the logic check
+    @property
+    def seeded(self):
+        return not self.aborted and not self._logic_failed
@@ -0,0 +1,165 @@
+import json
+import time
+import uuid
+
+from tqdm import tqdm
+
+from src.response_uploader import ResponseSink, UploadSummary
+
+
+# psycopg is optional, only this sink and the bench postgres scenarios need it
+def _psycopg():
+
+    try:
+        import psycopg
+    except ImportError:
+        raise RuntimeError('The postgres sink needs psycopg, install it with: pip install "psycopg[binary]"')
+    return psycopg
+
+
+# Columns of the Formbricks "Response" table written by the sink, the others keep their defaults
+COLUMNS = ("id", "created_at", "updated_at", "finished", "surveyId", "data", "meta", "ttc", "variables", "language")
+
+
+"""
+    Empty stand-in of the Formbricks "Response" table in schema, for the bench and the tests:
+    the columns the sink writes, no foreign keys. conn must be in autocommit. Returns the
+    table name to give PostgresSink.
+"""
+def create_standin_table(conn, schema):
+
+    table = f'{schema}."Response"'
+    conn.execute(f"CREATE SCHEMA IF NOT EXISTS {schema}")
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {table} (
+            "id" text PRIMARY KEY,
+            "created_at" timestamp(3) NOT NULL DEFAULT now(),
+            "updated_at" timestamp(3) NOT NULL,
+            "finished" boolean NOT NULL DEFAULT false,
+            "surveyId" text NOT NULL,
+            "data" jsonb NOT NULL DEFAULT '{{}}',
+            "meta" jsonb NOT NULL DEFAULT '{{}}',
+            "ttc" jsonb NOT NULL DEFAULT '{{}}',
+            "variables" jsonb NOT NULL DEFAULT '{{}}',
+            "language" text
+        )
+    """)
+    conn.execute(f"TRUNCATE {table}")
+    return table
+
+
+class PostgresSink(ResponseSink):
+
+    """
+        Bulk sink writing responses straight into the Formbricks "Response" table with COPY,
+        batch_size rows per transaction over a single connection. The surveys still have to
+        be created through the API first, the rows reference them by surveyId.
+        Rows written this way skip the API side effects (webhooks, integrations, displays).
+        Needs the optional psycopg package (pip install "psycopg[binary]").
+    """
+    name = "postgres"
+
+    def __init__(self, database_url, batch_size=5000, table='"Response"', metrics=None):
+        self.database_url = database_url
+        self.batch_size = max(1, batch_size)
+        self.table = table
+        # Optional src.metrics.Metrics, every COPY batch is recorded as one request
+        self.metrics = metrics
+        self._conn = None
+
+    def _connect(self):
+
+        if self._conn is None or self._conn.closed:
+            self._conn = _psycopg().connect(self.database_url)
+        return self._conn
+
+    def close(self):
+
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    # One COPY row for a payload built by DataInjester._build_formbricks_response_payload
+    def _row(self, payload):
+
+        return (
+            # same shape as the cuid ids Formbricks generates: "c" + 24 lowercase alphanumerics
+            "c" + uuid.uuid4().hex[:24],
+            payload["createdAt"],
+            payload["updatedAt"],
+            payload["finished"],
+            payload["surveyId"],
+            json.dumps(payload["data"]),
+            "{}",
+            "{}",
+            "{}",
+            payload.get("language"),
+        )
+
+    # COPY one batch in its own transaction, returns (ok, error key, bytes sent)
+    def _copy(self, rows):
+
+        psycopg = _psycopg()
+
+        conn = None
+        sent = 0
+        try:
+            # inside the try: a database that is down fails the batch like any other error
+            conn = self._connect()
+            with conn.transaction(), conn.cursor() as cur:
+                columns = ", ".join(f'"{column}"' for column in COLUMNS)
+                with cur.copy(f"COPY {self.table} ({columns}) FROM STDIN") as copy:
+                    for row in rows:
+                        copy.write_row(row)
+                        sent += len(row[5])
+        except psycopg.Error as e:
+            # a broken connection is opened again for the next batch
+            if conn is None or conn.closed or conn.broken:
+                self._conn = None
+            return False, e.sqlstate or type(e).__name__, sent
+
+        return True, None, sent
+
+    def upload(self, items, desc="Uploading", on_success=None, on_send=None, on_result=None):
+
+        summary = UploadSummary()
+        start = time.perf_counter()
+        batch = []
+
+        def flush():
+            rows = []
+            for key, payload in batch:
+                if on_send:
+                    on_send(key, payload)
+                rows.append(self._row(payload))
+
+            copy_start = time.perf_counter()
+            ok, error, sent = self._copy(rows)
+            elapsed = time.perf_counter() - copy_start
+            summary.latencies.append(elapsed)
+            if self.metrics:
+                self.metrics.observe("postgres:copy", elapsed, sent, error=not ok)
+
+            for key, _ in batch:
+                if ok:
+                    summary.succeeded += 1
+                    if on_success:
+                        on_success(key)
+                else:
+                    summary.failed += 1
+                    summary.errors[error] = summary.errors.get(error, 0) + 1
+                if on_result:
+                    on_result(ok)
+            bar.update(len(batch))
+            batch.clear()
+
+        with tqdm(desc=desc, unit="resp") as bar:
+            for item in items:
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    flush()
+            if batch:
+                flush()
+
+        summary.elapsed = time.perf_counter() - start
+        return summary
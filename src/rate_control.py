@@ -0,0 +1,137 @@
+import asyncio
+import time
+
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+
+# Status codes that mean the server wants fewer requests
+OVERLOAD_STATUS = (429, 503)
+
+
+# Seconds to wait from a Retry-After header (delta seconds or an HTTP date), None when absent or invalid
+def parse_retry_after(value):
+
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+class AdaptiveLimiter():
+
+    """
+        AIMD concurrency limit for the requests of one asyncio loop.
+        The limit starts at `initial` and doubles every round trip (slow start) until the first
+        sign of overload, then grows by about `increase` per round trip. A 429/503, a connection
+        error or a latency spike (latency_factor times the baseline latency) cuts it by `decrease`,
+        at most once per round trip. Retry-After pauses every new request until it expires.
+        fixed keeps the limit at `maximum`, only Retry-After still applies.
+    """
+    def __init__(self, maximum, initial=4, minimum=1, increase=1.0, decrease=0.7, latency_factor=3.0, fixed=False):
+        self.maximum = max(1, maximum)
+        self.minimum = max(1, min(minimum, self.maximum))
+        self.fixed = fixed
+        self.limit = float(self.maximum if fixed else max(self.minimum, min(initial, self.maximum)))
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_factor = latency_factor
+
+        self.in_flight = 0
+        self.peak = self.limit
+        self.decreases = 0
+        # slowly rising minimum of the latencies seen, what a healthy request takes
+        self.baseline = None
+        self.paused_until = 0.0
+
+        self._slow_start = not fixed
+        self._last_decrease = 0.0
+        self._cond = None
+
+    """
+        Get ready for a new event loop: the condition belongs to the loop it was made in, and
+        slots of requests cancelled with the old loop never come back. The limit, the latency
+        baseline and a Retry-After pause are kept.
+    """
+    def reset(self):
+        self._cond = None
+        self.in_flight = 0
+
+    def _condition(self):
+
+        # created lazily, it has to belong to the running loop
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        return self._cond
+
+    async def acquire(self):
+
+        cond = self._condition()
+        async with cond:
+            while True:
+                delay = self.paused_until - time.monotonic()
+                if delay > 0:
+                    try:
+                        await asyncio.wait_for(cond.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                if self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return
+                await cond.wait()
+
+    def _is_spike(self, latency):
+
+        if self.baseline is None or latency < self.baseline:
+            self.baseline = latency
+            return False
+
+        spike = latency > self.baseline * self.latency_factor and latency - self.baseline > 0.05
+        if not spike:
+            # follow the server when it gets slower for good, without jumping on every spike
+            self.baseline += (latency - self.baseline) * 0.01
+        return spike
+
+    """
+        Give a slot back with the outcome of the request: its latency (None when it never
+        completed), whether the server signalled overload, and its Retry-After in seconds.
+    """
+    async def release(self, latency, overloaded=False, retry_after=None):
+
+        now = time.monotonic()
+        self.in_flight -= 1
+
+        if retry_after:
+            self.paused_until = max(self.paused_until, now + retry_after)
+            overloaded = True
+
+        if latency is not None and self._is_spike(latency):
+            overloaded = True
+
+        if not self.fixed:
+            if overloaded:
+                # one cut per round trip, the requests that were already in flight say the same thing
+                if now - self._last_decrease >= max(self.baseline or 0.0, 0.05):
+                    self.limit = max(self.minimum, self.limit * self.decrease)
+                    self._last_decrease = now
+                    self._slow_start = False
+                    self.decreases += 1
+            elif self._slow_start:
+                self.limit = min(self.maximum, self.limit + 1)
+            else:
+                self.limit = min(self.maximum, self.limit + self.increase / self.limit)
+            self.peak = max(self.peak, self.limit)
+
+        cond = self._condition()
+        async with cond:
+            cond.notify_all()
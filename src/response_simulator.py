@@ -0,0 +1,270 @@
+import itertools
+import json
+import random
+import re
+import time
+
+from pathlib import Path
+
+from faker import Faker
+from tqdm import tqdm
+
+from src.manifest import Manifest
+from src.payload_compiler import file_hash
+from src.survey_logic import SurveyLogicGraph
+
+
+class ResponseSimulator():
+
+    """
+        Offline, logic aware response generator, no LLM involved.
+        Every closed question gets a finite pool of possible values (rating range, choices,
+        choice subsets). For each pool entry, the next question is precomputed from the
+        survey logic. Simulating a batch then means sampling value indices per question and
+        following those tables.
+        Open text answers are made per respondent from 3 to 5 fragments of a pool of
+        text_pool_size Faker fragments, so they almost never repeat. text_repeat_rate of them
+        are one of a few common short answers instead, the repeats real answers have.
+        The name and text pools only depend on seed. Everything drawn for a survey comes from
+        its own RNG, seeded with seed and its id, so a survey gets the same answers whether it
+        is simulated alone or with others.
+    """
+    def __init__(self, seed=None, batch_size=10000, text_pool_size=2000, name_pool_size=5000, manifest=None,
+                 text_repeat_rate=0.05, rescan=False):
+        self.seed = seed
+        self.batch_size = max(1, batch_size)
+        self.text_pool_size = text_pool_size
+        self.text_repeat_rate = text_repeat_rate
+        self.name_pool_size = name_pool_size
+
+        # only builds the pools, see _survey_rng for the answers
+        self.rng = random.Random(seed)
+        self.faker = Faker()
+        if seed is not None:
+            self.faker.seed_instance(seed)
+
+        self._people = None
+        self._fragments = None
+        self._capitalized = None
+        self._common = None
+        self.manifest = manifest or Manifest()
+        # Walk surveys/ and answers/ before reading the manifest, see Manifest.sync
+        self.rescan = rescan
+
+    """
+        Build the name pool, (json encoded name, email local part, email domain), and the text
+        fragment pools once, always in the same order so they only depend on the seed.
+    """
+    def _build_pools(self):
+
+        if self._people is not None:
+            return
+
+        rng = self.rng
+        domains = [self.faker.free_email_domain() for _ in range(20)]
+        self._people = []
+        for _ in range(self.name_pool_size):
+            name = self.faker.name()
+            local = re.sub(r"[^a-z]+", ".", name.lower()).strip(".")
+            self._people.append((json.dumps(name), local, rng.choice(domains)))
+
+        fragments = [
+            self.faker.sentence(nb_words=rng.randint(2, 5)).rstrip(".").lower() for _ in range(self.text_pool_size)
+        ]
+        self._fragments = [json.dumps(fragment)[1:-1] for fragment in fragments]
+        self._capitalized = [json.dumps(fragment[:1].upper() + fragment[1:])[1:-1] for fragment in fragments]
+        self._common = [json.dumps(self.faker.sentence(nb_words=rng.randint(1, 3))) for _ in range(20)]
+
+    # RNG of a survey's answers, unseeded runs stay random
+    def _survey_rng(self, id):
+
+        if self.seed is None:
+            return random.Random()
+        return random.Random(f"{self.seed}:{id}")
+
+    """
+        Json encoded open text answers (quotes included) of size respondents. The fragments are
+        json encoded once, an answer is only their concatenation.
+    """
+    def _texts(self, size, rng):
+
+        fragments, capitalized = self._fragments, self._capitalized
+        counts = rng.choices((3, 4, 5), k=size)
+        picks = rng.choices(range(len(fragments)), k=sum(counts))
+        repeats = rng.choices(self._common, k=size)
+        rate = self.text_repeat_rate
+
+        texts = []
+        start = 0
+        for count, repeat in zip(counts, repeats):
+            if rng.random() < rate:
+                texts.append(repeat)
+                continue
+            first, *rest = picks[start:start + count]
+            start += count
+            texts.append(f'"{capitalized[first]} {" ".join([fragments[k] for k in rest])}."')
+        return texts
+
+    def _is_text(self, question):
+        return question["question_type"].replace("_", " ").lower() in ("opentext", "text")
+
+    # Possible values of a closed question, as (value, json fragment of the answer)
+    def _value_pool(self, question, rng):
+
+        qtype = question["question_type"].replace("_", " ").lower()
+        config = question.get("config", {})
+
+        if qtype == "rating":
+            rating = config.get("rating", {})
+            values = list(range(int(rating.get("min_value", 1)), int(rating.get("max_value", 5)) + 1))
+        else:
+            choice = config.get("choice", {})
+            # the schema template spells the key with a trailing space
+            choices = choice.get("choices", choice.get("choices ", [])) or ["A", "B", "C"]
+            if "multiple" in qtype:
+                values = self._subsets(choices, rng)
+            else:
+                values = list(choices)
+
+        qid = question["question_id"]
+        return [
+            (value, json.dumps({"question_id": qid, "value": value}))
+            for value in values
+        ]
+
+    # Non empty subsets of the choices, every one of them when there are few choices
+    def _subsets(self, choices, rng):
+
+        if len(choices) <= 6:
+            return [
+                list(subset)
+                for size in range(1, len(choices) + 1)
+                for subset in itertools.combinations(choices, size)
+            ]
+
+        subsets = set()
+        while len(subsets) < 256:
+            size = rng.randint(1, len(choices))
+            subsets.add(tuple(sorted(rng.sample(range(len(choices)), size))))
+        return [[choices[i] for i in subset] for subset in sorted(subsets)]
+
+    """
+        Compile a survey into [(pool, next_index, prefix)] per question. For a closed question
+        next_index[k] is the question shown after answering pool[k] (len(questions) ends the
+        survey). An open text question has no pool: next_index(text) gives the question shown
+        after its json encoded text and prefix is the json fragment of the answer up to its value.
+    """
+    def _compile(self, survey, rng):
+
+        graph = SurveyLogicGraph(survey)
+        if graph.dangling:
+            raise ValueError(f"Survey logic is broken: {'; '.join(graph.errors)}")
+
+        compiled = []
+        for i, question in enumerate(survey["survey"]["questions"]):
+            if self._is_text(question):
+                prefix = json.dumps({"question_id": question["question_id"]})[:-1] + ', "value": '
+                if graph.rules[i]:
+                    next_index = lambda text, i=i: graph.next_index(i, json.loads(text))
+                else:
+                    next_index = lambda text, i=i: i + 1
+                compiled.append((None, next_index, prefix))
+                continue
+            pool = self._value_pool(question, rng)
+            next_index = [graph.next_index(i, value) for value, _ in pool]
+            compiled.append(([fragment for _, fragment in pool], next_index, None))
+
+        return compiled
+
+    # Simulate one batch of respondents, yields their jsonl lines
+    def _simulate_batch(self, compiled, start, size, width, rng):
+
+        people = self._people
+        end = len(compiled)
+
+        # batched sampling: one column of value indices per question
+        # open text questions get a column of json encoded answers instead
+        columns = [
+            rng.choices(range(len(pool)), k=size) if pool is not None else self._texts(size, rng)
+            for pool, _, _ in compiled
+        ]
+        persons = rng.choices(people, k=size)
+
+        for row in range(size):
+            fragments = []
+            q = 0
+            steps = 0
+            # steps bounds the walk in case the logic loops back
+            while q < end and steps < end:
+                pool, next_index, prefix = compiled[q]
+                if pool is None:
+                    text = columns[q][row]
+                    fragments.append(f"{prefix}{text}}}")
+                    q = next_index(text)
+                else:
+                    k = columns[q][row]
+                    fragments.append(pool[k])
+                    q = next_index[k]
+                steps += 1
+
+            number = start + row + 1
+            name, local, domain = persons[row]
+            yield (
+                f'{{"user_id": "user_{number:0{width}d}", "name": {name}, '
+                f'"email": "{local}{number}@{domain}", "answers": [{", ".join(fragments)}]}}\n'
+            )
+
+    def _load_survey(self, id):
+
+        with open(f"surveys/survey_{id}.json") as f:
+            return json.load(f)
+
+    # Write n simulated respondents of a survey to answers/answers_{id}.jsonl
+    def simulate_survey(self, id, n):
+
+        self._build_pools()
+        rng = self._survey_rng(id)
+        compiled = self._compile(self._load_survey(id), rng)
+        width = max(3, len(str(n)))
+
+        answer_path = Path("answers")
+        answer_path.mkdir(exist_ok=True)
+
+        path = answer_path / f"answers_{id}.jsonl"
+        with open(path, "w", encoding="utf-8") as f, \
+                tqdm(total=n, desc=f"Simulating answers for {id}", unit="resp") as bar:
+            for start in range(0, n, self.batch_size):
+                size = min(self.batch_size, n - start)
+                f.writelines(self._simulate_batch(compiled, start, size, width, rng))
+                bar.update(size)
+
+        # do not leave a stale legacy file around for the same survey
+        legacy = answer_path / f"answers_{id}.json"
+        if legacy.exists():
+            legacy.unlink()
+
+        if self.manifest.survey(id) is None:
+            self.manifest.record_survey(id, f"surveys/survey_{id}.json", file_hash(f"surveys/survey_{id}.json"))
+        self.manifest.record_answers(id, path, n, file_hash(path))
+
+    # Simulate n respondents for every generated survey of the manifest, or only for the given ids, False for an unknown id
+    def simulate(self, n, ids=None):
+
+        self.manifest.sync(self.rescan)
+        known = [row["id"] for row in self.manifest.surveys()]
+        unknown = [id for id in ids or () if id not in known]
+        if unknown:
+            print(f"No generated survey {', '.join(unknown)}, generated surveys: {', '.join(known) or 'none'}")
+            return False
+        if not ids:
+            ids = known
+
+        start = time.perf_counter()
+        for id in ids:
+            self.simulate_survey(id, n)
+        elapsed = time.perf_counter() - start
+
+        total = n * len(ids)
+        rate = total / elapsed if elapsed else 0.0
+        print(f"Simulated {total} responses in {elapsed:.2f}s ({rate * 60:,.0f} responses/min)")
+        return True
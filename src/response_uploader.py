@@ -0,0 +1,223 @@
+import asyncio
+import json
+import random
+import time
+
+from abc import ABC, abstractmethod
+
+import httpx
+from tqdm import tqdm
+
+from src.rate_control import AdaptiveLimiter, OVERLOAD_STATUS, parse_retry_after
+
+
+class UploadSummary():
+
+    # unit names what was uploaded in the rate, "responses" or "surveys"
+    def __init__(self, unit="responses"):
+        self.unit = unit
+        self.succeeded = 0
+        self.failed = 0
+        self.retries = 0
+        # status code (or exception name) -> count, for the failed requests only
+        self.errors = {}
+        self.elapsed = 0.0
+        # seconds taken by every request, retries included
+        self.latencies = []
+        # concurrency limit the adaptive controller ended with, and the highest it reached
+        self.concurrency = None
+        self.peak_concurrency = None
+
+    @property
+    def total(self):
+        return self.succeeded + self.failed
+
+    @property
+    def rate(self):
+        return self.total / self.elapsed if self.elapsed else 0.0
+
+    # Fold another summary into this one, used to report totals over several surveys
+    def merge(self, other):
+        self.succeeded += other.succeeded
+        self.failed += other.failed
+        self.retries += other.retries
+        self.elapsed += other.elapsed
+        self.latencies.extend(other.latencies)
+        if other.concurrency is not None:
+            self.concurrency = other.concurrency
+            self.peak_concurrency = max(self.peak_concurrency or 0, other.peak_concurrency)
+        for key, count in other.errors.items():
+            self.errors[key] = self.errors.get(key, 0) + count
+
+    def __str__(self):
+        text = (
+            f"{self.succeeded} succeeded, {self.failed} failed, {self.retries} retries "
+            f"in {self.elapsed:.2f}s ({self.rate:.1f} {self.unit}/sec)"
+        )
+        if self.concurrency is not None:
+            text += f", concurrency {self.concurrency} (peak {self.peak_concurrency})"
+        if self.errors:
+            text += f", errors: {self.errors}"
+        return text
+
+
+class ResponseSink(ABC):
+
+    """
+        Where DataInjester sends the response payloads of a survey.
+        upload(items, desc, on_success, on_send, on_result) consumes (key, payload) pairs lazily
+        and returns an UploadSummary. on_send(key, payload) is called before a payload is
+        written, on_success(key) once it is stored and on_result(ok) once it is done either way.
+    """
+    name = None
+
+    @abstractmethod
+    def upload(self, items, desc="Uploading", on_success=None, on_send=None, on_result=None):
+        pass
+
+    # Release connections kept between uploads
+    def close(self):
+        pass
+
+
+class ResponseUploader(ResponseSink):
+
+    """
+        The Formbricks management API sink.
+        POST json payloads to a single endpoint over a keep-alive connection pool.
+        The number of requests in flight is set by an AdaptiveLimiter, up to `concurrency`
+        (always `concurrency` when adaptive is off). 429, 5xx and connection errors are
+        retried with exponential backoff, or after Retry-After when the server sends one,
+        other errors fail straight away. Any other exception while sending a payload or
+        reading its response fails that payload only, under the exception name.
+        The limiter is kept between uploads.
+    """
+    def __init__(self, url, headers, concurrency=16, retries=3, backoff=0.5, timeout=30, metrics=None, endpoint="responses",
+                 adaptive=True):
+        self.url = url
+        self.headers = {**headers, "Content-Type": "application/json"}
+        self.concurrency = max(1, concurrency)
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        # Optional src.metrics.Metrics, every attempt is recorded under endpoint
+        self.metrics = metrics
+        self.endpoint = endpoint
+        self.limiter = AdaptiveLimiter(self.concurrency, fixed=not adaptive)
+
+    name = "api"
+
+    def _delay(self, attempt):
+        # full jitter so retries from different workers do not line up
+        return random.uniform(0, self.backoff * (2 ** attempt))
+
+    # Post a single payload, returns (ok, error key, response)
+    async def _post(self, client, payload, summary):
+
+        body = json.dumps(payload).encode("utf-8")
+        error = None
+        retry_after = None
+
+        for attempt in range(self.retries + 1):
+            if attempt:
+                summary.retries += 1
+                await asyncio.sleep(max(retry_after or 0.0, self._delay(attempt - 1)))
+
+            await self.limiter.acquire()
+            start = time.perf_counter()
+            res = None
+            try:
+                res = await client.post(self.url, content=body)
+            except httpx.TransportError as e:
+                error = type(e).__name__
+            finally:
+                elapsed = time.perf_counter() - start
+                summary.latencies.append(elapsed)
+                if self.metrics:
+                    self.metrics.observe(self.endpoint, elapsed, len(body), error=res is None or res.status_code >= 300)
+
+                retry_after = parse_retry_after(res.headers.get("Retry-After")) if res is not None else None
+                await self.limiter.release(
+                    elapsed if res is not None else None,
+                    overloaded=res is None or res.status_code in OVERLOAD_STATUS,
+                    retry_after=retry_after
+                )
+
+            if res is None:
+                continue
+
+            if res.status_code < 300:
+                return True, None, res
+
+            error = res.status_code
+            if res.status_code < 500 and res.status_code != 429:
+                break
+
+        return False, error, None
+
+    async def _worker(self, client, items, summary, bar, on_success, on_send, on_result, on_response):
+
+        for key, payload in items:
+            if on_send:
+                on_send(key, payload)
+            try:
+                ok, error, res = await self._post(client, payload, summary)
+                if ok and on_response:
+                    on_response(key, res.json())
+            except Exception as e:
+                # a bad response body must not take the other workers down with it
+                ok, error = False, type(e).__name__
+            if ok:
+                summary.succeeded += 1
+                if on_success:
+                    on_success(key)
+            else:
+                summary.failed += 1
+                summary.errors[error] = summary.errors.get(error, 0) + 1
+            if on_result:
+                on_result(ok)
+            bar.update(1)
+
+            # set_postfix redraws the bar, twice a second is enough
+            if time.monotonic() - self._postfix_at >= 0.5:
+                self._postfix_at = time.monotonic()
+                bar.set_postfix(concurrency=int(self.limiter.limit), in_flight=self.limiter.in_flight)
+
+    async def _upload(self, items, desc, on_success, on_send, on_result, on_response):
+
+        # "formbricks:surveys" uploads surveys
+        unit = self.endpoint.rsplit(":", 1)[-1]
+        summary = UploadSummary(unit)
+        # every worker pulls from the same iterator, so payloads are consumed lazily
+        items = iter(items)
+        # the limit carries over from the previous upload, not its loop
+        self.limiter.reset()
+        self._postfix_at = 0.0
+
+        limits = httpx.Limits(
+            max_connections=self.concurrency,
+            max_keepalive_connections=self.concurrency
+        )
+        start = time.perf_counter()
+
+        async with httpx.AsyncClient(headers=self.headers, limits=limits, timeout=self.timeout) as client:
+            with tqdm(desc=desc, unit=unit) as bar:
+                await asyncio.gather(*[
+                    self._worker(client, items, summary, bar, on_success, on_send, on_result, on_response)
+                    for _ in range(self.concurrency)
+                ])
+
+        summary.elapsed = time.perf_counter() - start
+        summary.concurrency = int(self.limiter.limit)
+        summary.peak_concurrency = int(self.limiter.peak)
+        return summary
+
+    """
+        Upload (key, payload) pairs. on_send(key, payload) is called right before a
+        payload is first posted and on_success(key) once the server accepted it.
+        on_result(ok) is called once per payload when it is done, accepted or not, and
+        on_response(key, body) with the parsed body of every accepted payload.
+    """
+    def upload(self, items, desc="Uploading", on_success=None, on_send=None, on_result=None, on_response=None):
+
+        return asyncio.run(self._upload(items, desc, on_success, on_send, on_result, on_response))
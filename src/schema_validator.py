@@ -0,0 +1,199 @@
+import json
+import os
+
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+
+from jsonschema.validators import validator_for
+
+
+SCHEMA_FILES = {
+    "survey": "schemas/question_validation_schema.json",
+    "answers": "schemas/answer_validation_schema.json",
+}
+
+# Errors kept per file, a broken generation run would otherwise flood the report
+MAX_ERRORS = 20
+
+# jsonl files are split in chunks of about this size so one big file still uses every worker
+CHUNK_BYTES = 4 * 1024 * 1024
+
+
+"""
+    Compiled validator for a kind of document, built once per process.
+    "answers_line" validates a single jsonl respondent against the answers schema's
+    respondent_line definition.
+"""
+@lru_cache(maxsize=None)
+def get_validator(kind):
+
+    schema_kind = "answers" if kind == "answers_line" else kind
+    with open(SCHEMA_FILES[schema_kind]) as f:
+        schema = json.load(f)
+
+    if kind == "answers_line":
+        schema = {"$schema": schema["$schema"], "$defs": schema["$defs"], "$ref": "#/$defs/respondent_line"}
+
+    cls = validator_for(schema)
+    cls.check_schema(schema)
+    return cls(schema)
+
+
+def _format_error(error):
+
+    location = "/".join(str(part) for part in error.absolute_path) or "<root>"
+    return f"{location}: {error.message}"
+
+
+# Validate a parsed document, returns a list of error messages
+def validate_document(kind, document):
+
+    validator = get_validator(kind)
+    # is_valid is the cheap path, errors are only collected for invalid documents
+    if validator.is_valid(document):
+        return []
+    return [_format_error(error) for error in validator.iter_errors(document)]
+
+
+"""
+    Validate the lines of a jsonl file between two byte offsets, or a whole json file.
+    Runs inside a worker process, returns (path, documents checked, lines read,
+    error count, first [(line in chunk, message)]).
+"""
+def validate_chunk(path, start=0, end=None):
+
+    path = Path(path)
+    kind = "survey" if path.parent.name == "surveys" else "answers"
+    errors = []
+    count = 0
+    checked = 0
+    lines = 0
+
+    def add(line, message):
+        nonlocal count
+        count += 1
+        if len(errors) < MAX_ERRORS:
+            errors.append((line, message))
+
+    if path.suffix != ".jsonl":
+        try:
+            with open(path, encoding="utf-8") as f:
+                document = json.load(f)
+        except ValueError as e:
+            add(None, f"invalid JSON: {e}")
+            return str(path), 1, 0, count, errors
+
+        for message in validate_document(kind, document):
+            add(None, message)
+        return str(path), 1, 0, count, errors
+
+    with open(path, "rb") as f:
+        f.seek(start)
+        for raw in f:
+            lines += 1
+            if raw.strip():
+                checked += 1
+                try:
+                    document = json.loads(raw)
+                except ValueError as e:
+                    add(lines, f"invalid JSON: {e}")
+                else:
+                    for message in validate_document("answers_line", document):
+                        add(lines, message)
+
+            if end is not None and f.tell() >= end:
+                break
+
+    return str(path), checked, lines, count, errors
+
+
+# Split a jsonl file in (start, end) byte ranges that begin on a line boundary
+def _chunks(path):
+
+    size = os.path.getsize(path)
+    if size <= CHUNK_BYTES:
+        return [(0, None)]
+
+    bounds = [0]
+    with open(path, "rb") as f:
+        for offset in range(CHUNK_BYTES, size, CHUNK_BYTES):
+            if offset <= bounds[-1]:
+                continue
+            f.seek(offset)
+            f.readline()
+            if f.tell() >= size:
+                break
+            bounds.append(f.tell())
+
+    return [(start, end) for start, end in zip(bounds, bounds[1:] + [None])]
+
+
+class SchemaValidator():
+
+    """
+        Validate every file in surveys/ and answers/ against the validation schemas,
+        spread over a process pool. Each worker compiles a schema's validator once.
+    """
+    def __init__(self, workers=None):
+        self.workers = workers or os.cpu_count() or 1
+
+    def _files(self):
+
+        files = sorted(Path("surveys").glob("*.json"))
+        files += sorted(Path("answers").glob("*.json"))
+        files += sorted(Path("answers").glob("*.jsonl"))
+        return [str(path) for path in files]
+
+    # Returns {path: (documents checked, error count, first errors)}
+    def validate(self):
+
+        tasks = []
+        for path in self._files():
+            if path.endswith(".jsonl"):
+                tasks.extend((path, start, end) for start, end in _chunks(path))
+            else:
+                tasks.append((path, 0, None))
+
+        if not tasks:
+            return {}
+
+        if self.workers == 1 or len(tasks) == 1:
+            results = [validate_chunk(*task) for task in tasks]
+        else:
+            with ProcessPoolExecutor(max_workers=min(self.workers, len(tasks))) as pool:
+                results = list(pool.map(validate_chunk, *zip(*tasks)))
+
+        # chunks come back in order, shift their line numbers to the line in the file
+        merged = {}
+        line_offset = {}
+        for path, checked, lines, count, errors in results:
+            offset = line_offset.get(path, 0)
+            line_offset[path] = offset + lines
+
+            total_checked, total_count, messages = merged.get(path, (0, 0, []))
+            for line, message in errors:
+                if len(messages) < MAX_ERRORS:
+                    messages.append(message if line is None else f"line {line + offset}: {message}")
+            merged[path] = (total_checked + checked, total_count + count, messages)
+
+        return merged
+
+    # Print a per file report, returns True when every file is valid
+    def report(self, results):
+
+        invalid = 0
+        for path, (checked, count, errors) in results.items():
+            if not count:
+                print(f"✅ {path} ({checked} checked)")
+                continue
+
+            invalid += 1
+            print(f"❌ {path}: {count} error(s) in {checked} checked")
+            for error in errors:
+                print(f"    {error}")
+            if count > len(errors):
+                print(f"    ... {count - len(errors)} more")
+
+        print(f"{len(results)} file(s) validated, {invalid} invalid")
+        return invalid == 0
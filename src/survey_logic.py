@@ -0,0 +1,246 @@
+from src.payload_compiler import OPERATOR_MAP, VALUELESS_OPERATORS, check_survey_structure
+
+
+OPERATORS = {
+    "<": lambda answer, value: float(answer) < float(value),
+    "<=": lambda answer, value: float(answer) <= float(value),
+    ">": lambda answer, value: float(answer) > float(value),
+    ">=": lambda answer, value: float(answer) >= float(value),
+    "==": lambda answer, value: str(answer) == str(value),
+    "!=": lambda answer, value: str(answer) != str(value),
+    "submitted": lambda answer, value: answer not in (None, "", []),
+    "selected": lambda answer, value: value in answer if isinstance(answer, list) else answer == value,
+}
+
+
+def condition_holds(operator, answer, value):
+
+    try:
+        return OPERATORS[operator](answer, value)
+    except (TypeError, ValueError, KeyError):
+        # e.g. a numeric comparison against a text answer, or an unknown operator
+        return False
+
+
+# Every answer a question can get, None when they cannot be listed (open text, multiple choice)
+def answer_domain(question):
+
+    qtype = question["question_type"].replace("_", " ").lower()
+    config = question.get("config", {})
+    try:
+        if qtype == "rating":
+            rating = config.get("rating", {})
+            return list(range(int(rating.get("min_value", 1)), int(rating.get("max_value", 5)) + 1))
+        if qtype == "single choice":
+            choice = config.get("choice", {})
+            # the schema template spells the key with a trailing space
+            return list(choice.get("choices", choice.get("choices ", []))) or None
+    except (AttributeError, TypeError, ValueError):
+        pass
+    return None
+
+
+class SurveyLogicGraph():
+
+    """
+        A generated survey compiled once into a graph of blocks, one per question.
+        After a question, the first condition that holds jumps to its go_to, otherwise
+        the next question in order is shown (the same rule Formbricks applies to blocks).
+        Compiling collects dangling go_to targets, conditions the Formbricks payload cannot
+        express, cycles and unreachable questions instead of failing on the first one.
+        A required question only falls through to the next one when some answer matches
+        none of its rules: its rating range or choices are tried against them, and a
+        "submitted" rule always holds. Otherwise falling through is assumed possible.
+        A malformed survey gives an empty graph, with the reason in malformed.
+    """
+    def __init__(self, survey):
+
+        self.malformed = None
+        try:
+            check_survey_structure(survey)
+            questions = survey["survey"]["questions"]
+        except ValueError as e:
+            self.malformed = str(e)
+            questions = []
+
+        self.question_ids = [q["question_id"] for q in questions]
+        self.index = {qid: i for i, qid in enumerate(self.question_ids)}
+        self.end = len(questions)
+        self.required = {
+            q["question_id"]
+            for q in questions
+            if str(q.get("logic", {}).get("required", False)).lower() == "true"
+        }
+
+        self.dangling = []
+        # conditions survey_to_blocks would refuse: unknown operator or missing value
+        self.invalid = []
+        # per question: [(operator, value, target index)], dangling and invalid rules are dropped
+        self.rules = []
+        for i, question in enumerate(questions):
+            rules = []
+            for rule in question.get("logic", {}).get("conditions", []):
+                rule_if = rule["if"]
+                operator = rule_if.get("operator")
+                if operator not in OPERATOR_MAP:
+                    self.invalid.append(f"{question['question_id']} uses operator {operator!r}, Formbricks has no equivalent")
+                    continue
+                if operator not in VALUELESS_OPERATORS and "value" not in rule_if:
+                    self.invalid.append(f"{question['question_id']} uses operator {operator} without a value")
+                    continue
+                target = rule_if.get("go_to")
+                if target not in self.index:
+                    self.dangling.append((question["question_id"], target))
+                    continue
+                rules.append((rule_if["operator"], rule_if.get("value"), self.index[target]))
+            self.rules.append(rules)
+
+        # successors[i]: every block that can follow block i, end included
+        self.successors = [self._successors(i, question) for i, question in enumerate(questions)]
+
+        self.cycles = self._find_cycles()
+        self.reachable = self._reachable()
+        self.unreachable = [qid for i, qid in enumerate(self.question_ids) if i not in self.reachable]
+
+    @property
+    def errors(self):
+
+        errors = [f"malformed survey: {self.malformed}"] if self.malformed else []
+        errors += [f"{qid} jumps to unknown question {target}" for qid, target in self.dangling]
+        errors += self.invalid
+        errors += [f"logic cycle {' -> '.join(cycle)}" for cycle in self.cycles]
+        return errors
+
+    def _successors(self, i, question):
+
+        rules = self.rules[i]
+        if question["question_id"] in self.required:
+            domain = answer_domain(question)
+            if domain is not None:
+                return sorted({self.next_index(i, value) for value in domain})
+            operators = [operator for operator, _, _ in rules]
+            if "submitted" in operators:
+                # the rules after the first "submitted" one are never reached
+                return sorted({target for _, _, target in rules[:operators.index("submitted") + 1]})
+        return sorted({target for _, _, target in rules} | {i + 1})
+
+    # Iterative DFS, any back edge closes a cycle
+    def _find_cycles(self):
+
+        cycles = []
+        state = [0] * self.end   # 0 new, 1 on stack, 2 done
+
+        for root in range(self.end):
+            if state[root]:
+                continue
+            stack = [(root, iter(self.successors[root]))]
+            path = [root]
+            state[root] = 1
+            while stack:
+                node, children = stack[-1]
+                child = next(children, None)
+                if child is None:
+                    state[node] = 2
+                    stack.pop()
+                    path.pop()
+                    continue
+                if child >= self.end:
+                    continue
+                if state[child] == 1:
+                    cycle = path[path.index(child):] + [child]
+                    cycles.append([self.question_ids[i] for i in cycle])
+                elif state[child] == 0:
+                    state[child] = 1
+                    stack.append((child, iter(self.successors[child])))
+                    path.append(child)
+
+        return cycles
+
+    def _reachable(self):
+
+        seen = set()
+        todo = [0] if self.end else []
+        while todo:
+            node = todo.pop()
+            if node in seen or node >= self.end:
+                continue
+            seen.add(node)
+            todo.extend(self.successors[node])
+        return seen
+
+    # Block shown after block i when it was answered with value (None when skipped)
+    def next_index(self, i, value):
+
+        if value is not None:
+            for operator, expected, target in self.rules[i]:
+                if condition_holds(operator, value, expected):
+                    return target
+        return i + 1
+
+    # Question ids a respondent with these {question_id: value} answers is shown, in order
+    def visible_path(self, answers):
+
+        path = []
+        i = 0
+        # a cyclic survey would loop forever, a block is never shown twice
+        seen = set()
+        while i < self.end and i not in seen:
+            seen.add(i)
+            qid = self.question_ids[i]
+            path.append(qid)
+            i = self.next_index(i, answers.get(qid))
+        return path
+
+    """
+        Check one respondent against the graph, returns (violations, missing required).
+        A violation is an answer to a question that is unknown or hidden by the earlier answers.
+    """
+    def check_respondent(self, answers):
+
+        visible = self.visible_path(answers)
+        shown = set(visible)
+
+        violations = [qid for qid in answers if qid not in shown]
+        missing = [qid for qid in visible if qid in self.required and qid not in answers]
+        return violations, missing
+
+
+class LogicReport():
+
+    def __init__(self, id, graph):
+        self.id = id
+        self.graph = graph
+        self.respondents = 0
+        self.violating = 0
+        self.missing_required = 0
+        # a few (user_id, hidden questions answered) samples for the report
+        self.samples = []
+
+    def add(self, user_id, violations, missing):
+
+        self.respondents += 1
+        if missing:
+            self.missing_required += 1
+        if violations:
+            self.violating += 1
+            if len(self.samples) < 5:
+                self.samples.append((user_id, violations))
+
+    @property
+    def ok(self):
+        return not self.graph.errors and not self.violating
+
+    def __str__(self):
+
+        lines = [f"Survey {self.id}: {'OK' if self.ok else 'FAILED'}"]
+        for error in self.graph.errors:
+            lines.append(f"  - {error}")
+        if self.graph.unreachable:
+            lines.append(f"  - unreachable questions: {', '.join(self.graph.unreachable)}")
+        lines.append(
+            f"  - {self.respondents} respondents, {self.violating} answered hidden questions, "
+            f"{self.missing_required} skipped a required question"
+        )
+        for user_id, violations in self.samples:
+            lines.append(f"    {user_id} answered hidden {', '.join(violations)}")
+        return "\n".join(lines)
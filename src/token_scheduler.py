@@ -0,0 +1,176 @@
+import threading
+import time
+
+
+class TokenBucket():
+
+    """
+        Budget refilled continuously at rate_per_minute, holding at most capacity (one
+        minute's worth by default, like the API quotas). The level goes negative when a
+        request cost more than it reserved, the next requests then wait for the debt.
+    """
+    def __init__(self, rate_per_minute, capacity=None, clock=time.monotonic):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = rate_per_minute if capacity is None else capacity
+        self.level = self.capacity
+        self._clock = clock
+        self._last = clock()
+
+    def _refill(self):
+
+        now = self._clock()
+        self.level = min(self.capacity, self.level + (now - self._last) * self.rate)
+        self._last = now
+
+    # Seconds until amount is available, 0 when it already is
+    def wait_time(self, amount):
+
+        self._refill()
+        # more than the bucket can hold goes through once the bucket is full
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    # Take amount from the bucket, a negative amount gives it back
+    def take(self, amount):
+
+        self._refill()
+        self.level = min(self.capacity, self.level - amount)
+
+
+class Reservation():
+
+    def __init__(self, kind, prompt_tokens, completion_tokens, tokens):
+        self.kind = kind
+        # raw estimates, before correction
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        # corrected estimate taken from the tokens per minute budget
+        self.tokens = tokens
+        # first time the request could not be released, for the time spent waiting on quota
+        self.blocked_since = None
+
+
+class TokenScheduler():
+
+    """
+        Releases LLM requests against a tokens per minute and a requests per minute budget,
+        either can be None (unlimited). Every request is reserved with an estimate of its
+        prompt and completion tokens. Once it comes back the reported usage replaces the
+        estimate in the budget, and corrects the estimates of the next requests of the same
+        kind: per kind, the usage over the raw estimate is smoothed into a ratio applied to
+        the next raw estimates.
+        The budgets are headroom below the quotas: the API measures them at its end, after
+        the network and its own queueing, and a request it turns away costs a Retry-After.
+        Thread safe, DataGenerator reserves from its dispatch loop and settles from the
+        worker threads.
+    """
+    def __init__(self, tpm=None, rpm=None, smoothing=0.3, headroom=0.05):
+        self.tpm = tpm
+        self.rpm = rpm
+        self.tokens = TokenBucket(tpm * (1 - headroom)) if tpm else None
+        self.requests = TokenBucket(rpm * (1 - headroom)) if rpm else None
+        self.smoothing = smoothing
+
+        # kind -> [prompt ratio, completion ratio, requests observed]
+        self.ratios = {}
+
+        self.granted = 0
+        self.refunded = 0
+        # seconds requests spent at the head of the queue waiting for quota
+        self.waited = 0.0
+        # tokens reported by the requests settled with a usage, and how far their reservations were off
+        self.used_tokens = 0
+        self.estimate_error = 0
+
+        self._lock = threading.Lock()
+
+    def _corrected(self, kind, prompt_tokens, completion_tokens):
+
+        prompt_ratio, completion_ratio, _ = self.ratios.get(kind, (1.0, 1.0, 0))
+        return max(1, round(prompt_tokens * prompt_ratio + completion_tokens * completion_ratio))
+
+    # Reservation for a request of a kind, from raw token estimates corrected by the usage seen so far
+    def estimate(self, kind, prompt_tokens, completion_tokens):
+
+        with self._lock:
+            tokens = self._corrected(kind, prompt_tokens, completion_tokens)
+        return Reservation(kind, prompt_tokens, completion_tokens, tokens)
+
+    """
+        Take a reservation from the budgets, or return the seconds to wait before asking
+        again. The estimate is corrected again first, the usage of the requests that came
+        back while it was queued counts.
+    """
+    def reserve(self, reservation):
+
+        with self._lock:
+            reservation.tokens = self._corrected(reservation.kind, reservation.prompt_tokens, reservation.completion_tokens)
+            wait = 0.0
+            if self.tokens is not None:
+                wait = max(wait, self.tokens.wait_time(reservation.tokens))
+            if self.requests is not None:
+                wait = max(wait, self.requests.wait_time(1))
+
+            now = time.monotonic()
+            if wait > 0:
+                if reservation.blocked_since is None:
+                    reservation.blocked_since = now
+                return wait
+
+            if reservation.blocked_since is not None:
+                self.waited += now - reservation.blocked_since
+            if self.tokens is not None:
+                self.tokens.take(reservation.tokens)
+            if self.requests is not None:
+                self.requests.take(1)
+            self.granted += 1
+            return 0.0
+
+    """
+        Settle a reservation once its request is over. usage is the usage reported by the
+        API (object or dict), None when the request failed: what was reserved stays spent.
+        sent=False gives the whole reservation back, no request went out (cache hit).
+    """
+    def settle(self, reservation, usage=None, sent=True):
+
+        with self._lock:
+            if not sent:
+                if self.tokens is not None:
+                    self.tokens.take(-reservation.tokens)
+                if self.requests is not None:
+                    self.requests.take(-1)
+                self.refunded += 1
+                return
+            if usage is None:
+                return
+
+            get = usage.get if isinstance(usage, dict) else lambda key: getattr(usage, key, 0)
+            prompt = get("prompt_tokens") or 0
+            completion = get("completion_tokens") or 0
+            if self.tokens is not None:
+                self.tokens.take(prompt + completion - reservation.tokens)
+
+            self.used_tokens += prompt + completion
+            self.estimate_error += abs(prompt + completion - reservation.tokens)
+
+            prompt_ratio, completion_ratio, seen = self.ratios.get(reservation.kind, (1.0, 1.0, 0))
+            # the first usage of a kind replaces the guess, later ones are smoothed in
+            weight = 1.0 if seen == 0 else self.smoothing
+            if reservation.prompt_tokens:
+                prompt_ratio += weight * (prompt / reservation.prompt_tokens - prompt_ratio)
+            if reservation.completion_tokens:
+                completion_ratio += weight * (completion / reservation.completion_tokens - completion_ratio)
+            self.ratios[reservation.kind] = (prompt_ratio, completion_ratio, seen + 1)
+
+    def __str__(self):
+
+        limits = ", ".join(
+            f"{value:,} {name}" for name, value in (("TPM", self.tpm), ("RPM", self.rpm)) if value
+        ) or "no quota"
+        error = self.estimate_error / self.used_tokens if self.used_tokens else 0.0
+        return (
+            f"{self.granted} request(s) released under {limits}, {self.refunded} given back (cache), "
+            f"{self.waited:.1f}s waiting for quota, estimates off by {error:.0%} of the {self.used_tokens:,} tokens used"
+        )
@@ -0,0 +1,292 @@
+import json
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+import zlib
+
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from tqdm import tqdm
+
+
+STRATEGIES = ("replicate", "partition")
+
+# Seconds between two progress messages of a worker
+PROGRESS_INTERVAL = 0.25
+
+
+"""
+    Read a seeding topology file:
+    {
+        "strategy": "replicate" | "partition",
+        "targets": [{"name", "host", "environment_id", "api_key" or "api_key_env"}, ...]
+    }
+    api_key_env names an environment variable holding the key, so keys can stay out of the file.
+"""
+def load_topology(path):
+
+    with open(path) as f:
+        topology = json.load(f)
+
+    strategy = topology.get("strategy", "replicate")
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Unknown strategy {strategy!r}, expected one of {', '.join(STRATEGIES)}")
+
+    targets = topology.get("targets", [])
+    if not targets:
+        raise ValueError(f"{path} lists no targets")
+
+    names = set()
+    for i, target in enumerate(targets):
+        target.setdefault("name", f"target{i}")
+        if target["name"] in names:
+            raise ValueError(f"Target name {target['name']!r} is used twice")
+        names.add(target["name"])
+
+        if "api_key_env" in target:
+            target["api_key"] = os.getenv(target["api_key_env"])
+        for key in ("host", "environment_id", "api_key"):
+            if not target.get(key):
+                raise ValueError(f"Target {target['name']!r} has no {key}")
+
+    return strategy, targets
+
+
+# Survey ids a target seeds: all of them, or a stable hash share of them
+def shard_surveys(ids, strategy, index, count):
+
+    if strategy == "replicate":
+        return sorted(ids)
+    return sorted(id for id in ids if zlib.crc32(id.encode("utf-8")) % count == index)
+
+
+"""
+    Worker process: seed one target with its own DataInjester, connection pool and journal.
+    Output goes to formbricks/{name}/seed.log, progress is sent to the parent in small batches.
+    The result carries the worker's metrics and, with profile, the path of its pstats dump
+    (formbricks/{name}/seed.prof) for the parent to merge.
+"""
+def _seed_target(target, surveys, options, progress, profile=False):
+
+    log_path = Path("formbricks") / target["name"] / "seed.log"
+    log_path.parent.mkdir(parents=True, exist_ok=True)
+    sys.stdout = open(log_path, "a", buffering=1)
+    sys.stderr = sys.stdout
+
+    from src.data_injester import DataInjester
+    from src.metrics import Profiler
+
+    pending = {True: 0, False: 0}
+    last = time.monotonic()
+
+    def flush():
+        nonlocal last
+        if pending[True] or pending[False]:
+            progress.put((target["name"], pending[True], pending[False]))
+            pending[True] = pending[False] = 0
+        last = time.monotonic()
+
+    def on_result(ok):
+        pending[ok] += 1
+        if time.monotonic() - last >= PROGRESS_INTERVAL:
+            flush()
+
+    injester = DataInjester(target=target, surveys=surveys, on_result=on_result, check_logic=False, **options)
+    profiler = Profiler() if profile else None
+    profile_path = log_path.with_name("seed.prof")
+    try:
+        if not (profiler.run(injester.seed) if profiler else injester.seed()):
+            raise RuntimeError(f"nothing was uploaded, see {log_path}")
+    finally:
+        flush()
+        if profiler:
+            profiler.dump(profile_path)
+
+    summary = injester.upload_summary
+    return {
+        "name": target["name"],
+        "host": target["host"],
+        "surveys": len(surveys),
+        "surveys_uploaded": injester.manifest.upload_counts(target["name"])["created"],
+        "succeeded": summary.succeeded,
+        "failed": summary.failed,
+        "retries": summary.retries,
+        "errors": {str(key): count for key, count in summary.errors.items()},
+        "elapsed": summary.elapsed,
+        "rate": summary.rate,
+        "metrics": injester.metrics.to_dict(),
+        "profile": str(profile_path) if profiler else None,
+    }
+
+
+class TopologySeeder():
+
+    """
+        Seed the same corpus into several Formbricks environments, one worker process per
+        target. "replicate" sends every survey to every target, "partition" splits the
+        surveys between targets by a hash of their id.
+    """
+    def __init__(self, path, concurrency=16, retries=3, resume=False, check_logic=True, validate=False, dedup=None,
+                 adaptive=True, compiler=None, dedup_threshold=None, rescan=False, profiler=None):
+        self.path = path
+        self.strategy, self.targets = load_topology(path)
+        self.options = {"concurrency": concurrency, "retries": retries, "resume": resume, "adaptive": adaptive}
+        self.check_logic_enabled = check_logic
+        self.validate = validate
+        # Walk surveys/ and answers/ once in the parent, the workers then trust the manifest
+        self.rescan = rescan
+        # "flag" or "drop" near-duplicate open text answers once for every target, see src/dedup.py
+        self.dedup = dedup
+        self.dedup_threshold = dedup_threshold
+        # src.payload_compiler.PayloadCompiler building the payloads every worker then reads
+        self.compiler = compiler
+
+        # The workers' metrics and profiles are merged into these once they are done
+        from src.metrics import Metrics
+        self.metrics = Metrics()
+        self.profiler = profiler
+
+    # The checks run once here instead of once per target
+    def _checks(self):
+
+        from src.data_injester import DataInjester
+        from src.manifest import Manifest
+        from src.schema_validator import SchemaValidator
+
+        Manifest().sync(self.rescan)
+
+        if self.validate:
+            validator = SchemaValidator()
+            with self.metrics.phase("validate"):
+                results = validator.validate()
+            if not validator.report(results):
+                print("Schema validation failed, nothing was uploaded")
+                return False
+
+        if self.dedup:
+            from src.dedup import Deduplicator
+
+            manifest = Manifest()
+            with self.metrics.phase("dedup"):
+                Deduplicator(
+                    threshold=self.dedup_threshold, drop=self.dedup == "drop", manifest=manifest
+                ).run(manifest.surveys())
+
+        if self.check_logic_enabled:
+            with self.metrics.phase("check_logic"):
+                reports = DataInjester().check_logic()
+            failed = [report for report in reports if not report.ok]
+            for report in failed:
+                print(report)
+            if failed:
+                print("Survey logic check failed, nothing was uploaded (use --no-logic-check to upload anyway)")
+                return False
+
+        return True
+
+    # Read progress messages from the workers into one bar per target
+    def _show_progress(self, progress, totals, done):
+
+        bars = {
+            target["name"]: tqdm(total=totals[target["name"]], desc=target["name"], unit="resp", position=i)
+            for i, target in enumerate(self.targets)
+        }
+        failed = {name: 0 for name in bars}
+
+        while not done.is_set() or not progress.empty():
+            try:
+                name, ok, ko = progress.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            failed[name] += ko
+            bars[name].update(ok + ko)
+            if failed[name]:
+                bars[name].set_postfix(failed=failed[name])
+
+        for bar in bars.values():
+            bar.close()
+
+    # Respondents of these surveys, from the answer counts in the manifest
+    def _count_responses(self, rows, surveys):
+
+        surveys = set(surveys)
+        return sum(row["answers_count"] for row in rows if row["id"] in surveys)
+
+    def _report(self, results, elapsed):
+
+        print(f"Seeded {len(results)} target(s) ({self.strategy}) in {elapsed:.2f}s")
+        for result in results:
+            print(
+                f"  {result['name']:<16} {result['host']:<28} {result['surveys_uploaded']}/{result['surveys']} surveys, "
+                f"{result['succeeded']} succeeded, {result['failed']} failed, {result['retries']} retries, "
+                f"{result['rate']:.1f} responses/sec"
+                + (f", errors: {result['errors']}" if result["errors"] else "")
+            )
+
+        succeeded = sum(result["succeeded"] for result in results)
+        failed = sum(result["failed"] for result in results)
+        print(f"Total: {succeeded} succeeded, {failed} failed, {succeeded / elapsed if elapsed else 0.0:.1f} responses/sec overall")
+        print("Per target logs are in formbricks/<target>/seed.log")
+
+    def seed(self):
+
+        if not self._checks():
+            return []
+
+        # compiled once here, the workers only find up to date payloads
+        from src.data_injester import DataInjester
+        injester = DataInjester(metrics=self.metrics, compiler=self.compiler)
+        injester.compile()
+
+        rows = injester._survey_rows()
+        ids = [row["id"] for row in rows]
+        shards = [
+            shard_surveys(ids, self.strategy, i, len(self.targets))
+            for i in range(len(self.targets))
+        ]
+        totals = {
+            target["name"]: self._count_responses(rows, surveys)
+            for target, surveys in zip(self.targets, shards)
+        }
+
+        # tqdm reads its environment when imported, the workers import it after spawning
+        os.environ["TQDM_DISABLE"] = "1"
+
+        context = multiprocessing.get_context("spawn")
+        results = []
+        start = time.perf_counter()
+
+        with context.Manager() as manager:
+            progress = manager.Queue()
+            done = threading.Event()
+            viewer = threading.Thread(target=self._show_progress, args=(progress, totals, done), daemon=True)
+            viewer.start()
+
+            try:
+                with self.metrics.phase("seed_targets"), \
+                        ProcessPoolExecutor(max_workers=len(self.targets), mp_context=context) as pool:
+                    futures = [
+                        pool.submit(_seed_target, target, surveys, self.options, progress, self.profiler is not None)
+                        for target, surveys in zip(self.targets, shards)
+                    ]
+                    for target, future in zip(self.targets, futures):
+                        try:
+                            result = future.result()
+                        except Exception as e:
+                            print(f"Seeding {target['name']} failed: {e}")
+                            continue
+                        self.metrics.merge(result.pop("metrics"))
+                        profile = result.pop("profile")
+                        if profile:
+                            self.profiler.add_dump(profile)
+                        results.append(result)
+            finally:
+                done.set()
+                viewer.join()
+
+        self._report(results, time.perf_counter() - start)
+        return results
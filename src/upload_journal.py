@@ -0,0 +1,121 @@
+import hashlib
+import json
+import os
+import time
+
+from pathlib import Path
+
+
+class UploadJournal():
+
+    """
+        Append-only record of the responses sent to and accepted by the server.
+        A "sent" line is written before a response is posted and an "ok" line once
+        the server accepted it. A response with a "sent" but no "ok" line was in
+        flight when the process died, it is in doubt and has to be checked against
+        the server before being sent again.
+        Lines are flushed as soon as they are written and fsynced at most every
+        `sync_interval` seconds, so a killed process loses nothing it wrote.
+    """
+    def __init__(self, path=Path("formbricks") / "upload_journal.jsonl", sync_interval=1.0):
+        self.path = Path(path)
+        self.sync_interval = sync_interval
+        self._entries = set()
+        # (survey, user_id) -> fingerprint of the payload data
+        self._in_doubt = {}
+        self._file = None
+        self._last_sync = 0.0
+
+    @staticmethod
+    def fingerprint(data):
+        raw = json.dumps(data, sort_keys=True)
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    # Build the in-memory index from the journal on disk
+    def load(self):
+
+        self._entries = set()
+        self._in_doubt = {}
+        if not self.path.exists():
+            return self
+
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # a torn last line from a crash mid-write
+                    continue
+
+                key = (entry["survey"], entry["user_id"])
+                if entry.get("state", "ok") == "sent":
+                    self._in_doubt[key] = entry["fingerprint"]
+                else:
+                    self._entries.add(key)
+                    self._in_doubt.pop(key, None)
+
+        return self
+
+    # Forget everything, used when a fresh (non resumed) seed starts
+    def reset(self):
+
+        self.close()
+        self._entries = set()
+        self._in_doubt = {}
+        self.path.unlink(missing_ok=True)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    # {survey: {user_id: fingerprint}} of the responses that may or may not have reached the server
+    def in_doubt(self):
+
+        grouped = {}
+        for (survey, user_id), fingerprint in self._in_doubt.items():
+            grouped.setdefault(survey, {})[user_id] = fingerprint
+        return grouped
+
+    def _write(self, entry):
+
+        if self._file is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._file = open(self.path, "a", encoding="utf-8")
+
+        self._file.write(json.dumps(entry) + "\n")
+        self._file.flush()
+
+        now = time.monotonic()
+        if now - self._last_sync >= self.sync_interval:
+            os.fsync(self._file.fileno())
+            self._last_sync = now
+
+    def record_sent(self, survey, user_id, data):
+
+        self._write({
+            "survey": survey,
+            "user_id": user_id,
+            "state": "sent",
+            "fingerprint": self.fingerprint(data)
+        })
+
+    def record(self, survey, user_id):
+
+        if (survey, user_id) in self._entries:
+            return
+
+        self._write({"survey": survey, "user_id": user_id, "state": "ok"})
+        self._entries.add((survey, user_id))
+        self._in_doubt.pop((survey, user_id), None)
+
+    def close(self):
+
+        if self._file is None:
+            return
+
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self._file = None
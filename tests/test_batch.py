@@ -0,0 +1,68 @@
+import json
+
+import pytest
+
+from src.bench import _prepare_workdir
+from src.fake_servers import FakeOpenAI
+
+
+SURVEYS = 3
+# 7 users in shards of 3: offsets 0, 3 and 6
+RESPONSES = 7
+BATCH_SIZE = 3
+
+
+def _custom_ids(path):
+
+    with open(path) as f:
+        return {json.loads(line)["custom_id"] for line in f if line.strip()}
+
+
+@pytest.fixture
+def generator(tmp_path, monkeypatch):
+
+    _prepare_workdir(tmp_path, SURVEYS)
+    monkeypatch.chdir(tmp_path)
+
+    from src.data_generator import DataGenerator
+    return DataGenerator(batch_size=BATCH_SIZE)
+
+
+# prepare -> run the batch -> ingest, returns the custom_ids of the request file and the failed ones
+def _round(generator, tmp_path, name, fail=()):
+
+    requests, results = tmp_path / f"{name}_requests.jsonl", tmp_path / f"{name}_results.jsonl"
+    generator.prepare_batch(requests, n=RESPONSES)
+    FakeOpenAI().run_batch(requests, results, fail=fail)
+    return _custom_ids(requests), set(generator.ingest_batch(results))
+
+
+def test_batch_round_trip_requeues_only_failed_requests(generator, tmp_path):
+
+    # surveys: b1 fails
+    sent, failed = _round(generator, tmp_path, "surveys", fail={"survey:b1"})
+    assert sent == {"survey:b0", "survey:b1", "survey:b2"}
+    assert failed == {"survey:b1"}
+    assert sorted(path.name for path in (tmp_path / "surveys").iterdir()) == ["survey_b0.json", "survey_b2.json"]
+
+    # answers of b0 and b2 and b1 again: the middle shard of b0 fails
+    shards = lambda id: {f"answers:{id}:{offset}:{min(BATCH_SIZE, RESPONSES - offset)}:{RESPONSES}" for offset in (0, 3, 6)}
+    sent, failed = _round(generator, tmp_path, "answers", fail={"answers:b0:3:3:7"})
+    assert sent == {"survey:b1"} | shards("b0") | shards("b2")
+    assert failed == {"answers:b0:3:3:7"}
+    assert not (tmp_path / "answers" / "answers_b0.jsonl").exists()
+
+    # only the failed shard and the answers of the survey that just came back are asked for
+    sent, failed = _round(generator, tmp_path, "retry")
+    assert sent == {"answers:b0:3:3:7"} | shards("b1")
+    assert not failed
+
+    for id in ("b0", "b1", "b2"):
+        with open(tmp_path / "answers" / f"answers_{id}.jsonl") as f:
+            users = [json.loads(line)["user_id"] for line in f]
+        assert users == [f"user_{i:03d}" for i in range(1, RESPONSES + 1)]
+    assert not any((tmp_path / "formbricks" / "batch").iterdir())
+
+    # nothing left to do
+    assert generator.prepare_batch(tmp_path / "done.jsonl", n=RESPONSES) == 0
+    assert generator.manifest.readiness()["responses"] == SURVEYS * RESPONSES
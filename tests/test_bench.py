@@ -0,0 +1,106 @@
+import json
+import socket
+import time
+
+import pytest
+import requests
+
+from src.bench import Benchmark
+from src.fake_servers import FakeFormbricks
+
+
+# Small enough for a test run, the fakes answer fast so the scenarios are bound by the client
+SURVEYS = 3
+RESPONSES = 300
+
+
+def _results(document, phase):
+
+    results = [result for result in document["results"] if result["phase"] == phase]
+    assert results, f"no {phase} results"
+    return results
+
+
+def test_generate_phase_against_fake_openai(tmp_path):
+
+    bench = Benchmark(surveys=(SURVEYS,), concurrency=(4,), llm_latency=0.01, api_latency=0.0)
+    document = bench.run(out=tmp_path / "bench.json", phases=("generate",))
+
+    for result in _results(document, "generate"):
+        assert result["errors"] == 0
+        # one survey request and one answers request per survey
+        assert result["requests"] >= 2 * SURVEYS
+        assert result["throughput"] > 1.0
+        assert result["latency_ms"]["p50"] is not None
+
+    with open(tmp_path / "bench.json") as f:
+        assert json.load(f)["results"] == document["results"]
+
+
+def test_seed_phase_scales_with_concurrency(tmp_path):
+
+    bench = Benchmark(responses=(RESPONSES,), concurrency=(1, 8), api_latency=0.01)
+    document = bench.run(out=tmp_path / "bench.json", phases=("seed",))
+
+    results = {result["sink"]: result for result in _results(document, "seed") if result["concurrency"] == 8}
+    serial = next(result for result in _results(document, "seed") if result["concurrency"] == 1)
+
+    for result in _results(document, "seed"):
+        assert result["errors"] == 0
+        assert result["requests"] == RESPONSES
+        assert result["throughput_unit"] == "responses/sec"
+
+    # 10 ms per request caps one connection near 100 responses/sec, eight in flight must do far better
+    assert serial["throughput"] < 150
+    assert results["api"]["throughput"] > 2 * serial["throughput"]
+    assert results["adaptive"]["throughput"] > 2 * serial["throughput"]
+
+
+def test_seed_phase_retries_injected_errors(tmp_path):
+
+    bench = Benchmark(responses=(RESPONSES,), concurrency=(8,), api_latency=0.0, error_rate=0.1)
+    document = bench.run(out=tmp_path / "bench.json", phases=("seed",))
+
+    for result in _results(document, "seed"):
+        assert result["requests"] == RESPONSES
+        # a response fails only when all four tries hit a 10% error, 1 in 10,000
+        assert result["errors"] <= 2
+        assert result["throughput"] > 0
+
+
+def test_fake_formbricks_stores_every_response():
+
+    with FakeFormbricks() as formbricks:
+        with requests.Session() as session:
+            for i in range(20):
+                res = session.post(
+                    f"{formbricks.url}/api/v1/management/responses", json={"surveyId": "s", "data": {"q1": i}}
+                )
+                assert res.ok
+        assert formbricks.response_count == 20
+        assert formbricks.malformed == 0
+
+
+@pytest.mark.parametrize("body", [b'{"surveyId": "s", "da', b"not json"])
+def test_fake_formbricks_rejects_cut_and_invalid_bodies(body):
+
+    with FakeFormbricks() as formbricks:
+        host, port = formbricks._server.server_address
+        # a client killed mid request: the headers announce more than the body it got out
+        length = len(body) + 40 if body.startswith(b"{") else len(body)
+        with socket.create_connection((host, port)) as sock:
+            sock.sendall(
+                b"POST /api/v1/management/responses HTTP/1.1\r\n"
+                + f"Host: {host}\r\nContent-Type: application/json\r\nContent-Length: {length}\r\n\r\n".encode()
+                + body
+            )
+            sock.shutdown(socket.SHUT_WR)
+            sock.recv(1024)
+
+        deadline = time.monotonic() + 5
+        while formbricks.malformed == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        assert formbricks.malformed == 1
+        assert formbricks.response_count == 0
+        assert formbricks.requests == 0
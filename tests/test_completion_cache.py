@@ -0,0 +1,46 @@
+import os
+import time
+
+from src.completion_cache import CompletionCache
+
+
+DAY = 24 * 3600
+
+
+def _put(cache, key, written, used=None):
+
+    cache.put(key, f"completion {key}")
+    path = cache._entry_path(key)
+    os.utime(path, (used or written, written))
+    return path
+
+
+def test_a_hit_does_not_make_an_entry_younger(tmp_path):
+
+    cache = CompletionCache(tmp_path, max_age=30 * DAY)
+    now = time.time()
+    path = _put(cache, "aa01", now - 29 * DAY)
+
+    assert cache.get("aa01") == "completion aa01"
+    assert path.stat().st_mtime == now - 29 * DAY
+    assert path.stat().st_atime >= now
+
+    # hits do not keep it: 2 days later it is over max_age for both get() and evict()
+    os.utime(path, (now, now - 31 * DAY))
+    assert cache.evict() == 1
+    path = _put(cache, "aa01", now - 31 * DAY, used=now)
+    assert cache.get("aa01") is None
+    assert not path.exists()
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_evict_drops_the_least_recently_used_first(tmp_path):
+
+    cache = CompletionCache(tmp_path, max_age=30 * DAY)
+    now = time.time()
+    # written oldest first, used newest first
+    paths = [_put(cache, f"bb{i:02d}", now - (10 - i) * DAY, used=now - i * 3600) for i in range(4)]
+    cache.max_bytes = sum(path.stat().st_size for path in paths[:2])
+
+    assert cache.evict() == 2
+    assert [path.exists() for path in paths] == [True, True, False, False]
@@ -0,0 +1,96 @@
+import json
+
+import pytest
+
+from src.bench import _prepare_workdir
+from src.json_stream import ObjectStream
+
+
+DOCUMENT = {
+    "user_1": {"name": "Ann", "answers": [{"question_id": "q1", "value": 4}]},
+    "user_2": {"name": "Bob \"the {builder}\"", "answers": [{"question_id": "q2", "value": "a, b} and [c"}]},
+    "user_3": {"name": "C\\", "answers": []},
+}
+
+
+def _feed(parser, chunks):
+
+    members = []
+    for chunk in chunks:
+        members.extend(parser.feed(chunk))
+    return members
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 1000])
+def test_members_whatever_the_chunks(size):
+
+    text = json.dumps(DOCUMENT, indent=2)
+    parser = ObjectStream()
+    members = _feed(parser, [text[i:i + size] for i in range(0, len(text), size)])
+    parser.close()
+
+    assert members == list(DOCUMENT.items())
+    assert parser.count == 3
+
+
+def test_a_member_is_returned_as_soon_as_it_ends():
+
+    parser = ObjectStream()
+    assert parser.feed('{"a": {"b": "}"') == []
+    assert parser.feed('}, "c"') == [("a", {"b": "}"})]
+    assert parser.feed(': "\\\\"') == []
+    assert parser.feed('}') == [("c", "\\")]
+    assert parser.done
+
+
+def test_truncated_trailing_object():
+
+    text = json.dumps(DOCUMENT)
+    parser = ObjectStream()
+    # cut in the middle of user_3, inside its name
+    members = parser.feed(text[:text.index('"C\\\\"') + 2])
+
+    assert members == list(DOCUMENT.items())[:2]
+    with pytest.raises(ValueError, match="after 2 member"):
+        parser.close()
+
+
+@pytest.mark.parametrize("text", ['[{"a": 1}]', '{"a": 1} {"b": 2}', '{"a": 1, "b" 2}'])
+def test_not_one_object(text):
+
+    with pytest.raises(ValueError):
+        ObjectStream().feed(text)
+
+
+def test_streamed_shard_rejects_members_that_are_not_respondents(tmp_path, monkeypatch):
+
+    from src.data_generator import DataGenerator
+
+    _prepare_workdir(tmp_path, 1)
+    monkeypatch.chdir(tmp_path)
+    generator = DataGenerator(stream=True)
+
+    replies = [
+        [("user_1", DOCUMENT["user_1"]), ("user_2", "not a user"), ("user_3", {"name": "No answers"}),
+         ("user_4", {"answers": "q1"}), ("user_5", DOCUMENT["user_3"])],
+        [("user_1", DOCUMENT["user_2"]), ("user_2", DOCUMENT["user_1"])],
+    ]
+
+    def stream_members(client, prompt, variant=None, endpoint="openai"):
+        yield from replies.pop(0)
+
+    monkeypatch.setattr(generator, "_stream_members", stream_members)
+
+    progress = {"received": 0}
+    with pytest.raises(ValueError, match="expected 4 users, got 2, 3 member"):
+        generator._stream_answer_shard(None, {}, "s0", 0, 4, 4, progress)
+    assert progress == {"received": 2}
+
+    # the retry only asks for the rest of the shard, after the users already written
+    assert generator._stream_answer_shard(None, {}, "s0", 2, 2, 4, {"received": 0}) == 2
+    assert generator._close_answers("s0") == 4
+
+    with open(tmp_path / "answers" / "answers_s0.jsonl") as f:
+        users = [json.loads(line) for line in f]
+    assert [user["user_id"] for user in users] == ["user_001", "user_002", "user_003", "user_004"]
+    assert all(isinstance(user["answers"], list) for user in users)
@@ -0,0 +1,69 @@
+import json
+
+import pytest
+
+from src.bench import _prepare_workdir
+from src.fake_servers import FAKE_SURVEY, FakeFormbricks
+from src.load_test import LoadProfile, LoadTest
+
+
+RATE = 50
+DURATION = 2.0
+WINDOW = 0.5
+
+
+# One survey with simulated answers, the stub accepts responses for any survey id
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+
+    from src.response_simulator import ResponseSimulator
+
+    _prepare_workdir(tmp_path, 1)
+    (tmp_path / "surveys").mkdir()
+    with open(tmp_path / "surveys" / "survey_l0.json", "w") as f:
+        json.dump(FAKE_SURVEY, f)
+    monkeypatch.chdir(tmp_path)
+    ResponseSimulator(seed=0).simulate_survey("l0", 50)
+    return tmp_path
+
+
+def _load_test(stub, max_in_flight):
+
+    from src.data_injester import DataInjester
+
+    injester = DataInjester(target={"host": stub.url, "environment_id": "stub", "api_key": "stub"})
+    profile = LoadProfile(pattern="constant", rate=RATE, duration=DURATION)
+    obj = LoadTest(injester, profile, window=WINDOW, max_in_flight=max_in_flight, timeout=5)
+    return obj.run(out=None, survey_ids={"l0": "l0"})
+
+
+def test_constant_rate_is_achieved_against_the_stub(workdir):
+
+    with FakeFormbricks(latency=0.005) as stub:
+        results = _load_test(stub, max_in_flight=64)
+
+    windows = results["windows"]
+    assert len(windows) == DURATION / WINDOW
+    for window in windows:
+        assert window["offered_rps"] == pytest.approx(RATE, abs=4)
+        assert window["achieved_rps"] == pytest.approx(window["offered_rps"], rel=0.1)
+        assert window["failed"] == window["dropped"] == 0
+
+    total = results["total"]
+    # one arrival every 1 / RATE seconds, the one at DURATION itself is not part of the run
+    assert total["succeeded"] == stub.response_count == RATE * DURATION - 1
+    assert total["achieved_rps"] == pytest.approx(RATE, rel=0.05)
+
+
+def test_arrivals_over_max_in_flight_are_dropped(workdir):
+
+    # each request takes 5 arrival gaps, a single slot can only take about one arrival in five
+    with FakeFormbricks(latency=5 / RATE, jitter=0.0) as stub:
+        results = _load_test(stub, max_in_flight=1)
+
+    total = results["total"]
+    assert total["dropped"] > 0
+    assert total["succeeded"] == stub.response_count
+    assert total["succeeded"] + total["failed"] + total["dropped"] == RATE * DURATION - 1
+    assert total["achieved_rps"] < RATE / 3
+    assert sum(window["dropped"] for window in results["windows"]) == total["dropped"]
@@ -0,0 +1,30 @@
+from src.metrics import Metrics
+
+
+def _run(observations, tokens):
+
+    metrics = Metrics()
+    for endpoint, seconds, error in observations:
+        with metrics.phase("upload"):
+            metrics.observe(endpoint, seconds, bytes_sent=100, error=error)
+    metrics.add_usage({"prompt_tokens": tokens, "completion_tokens": 2 * tokens})
+    return metrics
+
+
+def test_merged_workers_add_up_to_a_single_run():
+
+    first = [("formbricks:responses", 0.003, False), ("formbricks:responses", 0.2, True)]
+    second = [("formbricks:responses", 0.04, False), ("formbricks:surveys", 45.0, False)]
+
+    parent = Metrics()
+    parent.merge(_run(first, 10).to_dict())
+    parent.merge(_run(second, 5).to_dict())
+    merged, single = parent.to_dict(), _run(first + second, 15).to_dict()
+
+    assert merged["endpoints"] == single["endpoints"]
+    assert merged["tokens"] == single["tokens"] == {"prompt": 15, "completion": 30}
+    assert merged["phases"]["upload"]["count"] == 4
+
+    # the exposition only differs by the phase timings
+    without_phases = lambda metrics: [line for line in metrics.to_prometheus().splitlines() if "phase_seconds{" not in line]
+    assert without_phases(parent) == without_phases(_run(first + second, 15))
@@ -0,0 +1,116 @@
+import copy
+import json
+import os
+
+import pytest
+
+from src.fake_servers import FAKE_SURVEY
+from src.payload_compiler import PayloadCompiler, deterministic_ids, file_hash, survey_to_blocks
+
+
+def _write(path, document):
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(document, f)
+    return path
+
+
+def _malformed(change):
+
+    survey = copy.deepcopy(FAKE_SURVEY)
+    change(survey["survey"])
+    return survey
+
+
+MALFORMED = {
+    "null logic": _malformed(lambda survey: survey["questions"][0].update(logic=None)),
+    "question not an object": _malformed(lambda survey: survey["questions"].append("q4")),
+    "questions not a list": _malformed(lambda survey: survey.update(questions={"q1": {}})),
+    "condition without if": _malformed(lambda survey: survey["questions"][0]["logic"]["conditions"].append({"go_to": "q3"})),
+    "config not an object": _malformed(lambda survey: survey["questions"][0].update(config=[5])),
+    "unknown operator": _malformed(lambda survey: survey["questions"][0]["logic"]["conditions"][0]["if"].update(operator="~")),
+    "dangling go_to": _malformed(lambda survey: survey["questions"][0]["logic"]["conditions"][0]["if"].update(go_to="q9")),
+    "not a survey": [FAKE_SURVEY],
+}
+
+
+def test_ids_are_derived_from_the_content():
+
+    first = list(zip(range(5), deterministic_ids("abc")))
+    assert first == list(zip(range(5), deterministic_ids("abc")))
+    assert [id for _, id in first] != [id for _, id in zip(range(5), deterministic_ids("abd"))]
+    assert all(len(id) == 24 for _, id in first)
+
+
+def test_compiled_survey_is_the_same_in_every_build(tmp_path):
+
+    source = _write(tmp_path / "surveys" / "survey_s1.json", FAKE_SURVEY)
+    payloads = []
+    for name in ("a", "b"):
+        compiler = PayloadCompiler(path=tmp_path / name, workers=1)
+        compiler.build([("survey", source)])
+        payloads.append(compiler.survey(source))
+
+    assert payloads[0] == payloads[1]
+    ids = deterministic_ids(file_hash(source))
+    assert payloads[0] == survey_to_blocks(FAKE_SURVEY, lambda: next(ids))
+    # the jumps of q1 point at the blocks of q2 and q3
+    blocks = {block["elements"][0]["id"]: block["id"] for block in payloads[0]["blocks"]}
+    targets = [logic["actions"][0]["target"] for logic in payloads[0]["blocks"][0]["logic"]]
+    assert targets == [blocks["q2"], blocks["q3"]]
+
+
+def test_unchanged_sources_are_reused(tmp_path):
+
+    survey = _write(tmp_path / "surveys" / "survey_s1.json", FAKE_SURVEY)
+    answers = tmp_path / "answers" / "answers_s1.jsonl"
+    answers.parent.mkdir()
+    answers.write_text(json.dumps({"user_id": "user_001", "answers": [{"question_id": "q1", "value": 4}]}) + "\n")
+    sources = [("survey", survey), ("responses", answers)]
+
+    assert PayloadCompiler(path=tmp_path / "compiled", workers=1).build(sources) == (2, 0)
+    # a new compiler only has the index on disk to go by
+    compiler = PayloadCompiler(path=tmp_path / "compiled", workers=1)
+    assert compiler.build(sources) == (0, 2)
+    assert list(compiler.responses(answers)) == [("user_001", {"q1": 4})]
+
+    # touched without a change: the hash decides, nothing is compiled
+    stat = os.stat(survey)
+    os.utime(survey, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert compiler.build(sources) == (0, 2)
+
+    # a changed file is compiled again and the payload it replaces goes
+    _write(survey, _malformed(lambda survey: survey.update(name="Renamed")))
+    assert compiler.build(sources) == (1, 1)
+    assert compiler.survey(survey)["name"] == "Renamed"
+    assert len(list((tmp_path / "compiled").glob("survey_*.json"))) == 1
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_malformed_surveys_fail_alone(tmp_path, workers):
+
+    good = _write(tmp_path / "surveys" / "survey_good.json", FAKE_SURVEY)
+    bad = {
+        name: _write(tmp_path / "surveys" / f"survey_bad{i}.json", survey)
+        for i, (name, survey) in enumerate(MALFORMED.items())
+    }
+
+    compiler = PayloadCompiler(path=tmp_path / "compiled", workers=workers)
+    compiled, reused = compiler.build([("survey", good)] + [("survey", path) for path in bad.values()])
+
+    assert (compiled, reused) == (1, 0)
+    assert compiler.survey(good)["name"] == FAKE_SURVEY["survey"]["name"]
+    assert set(compiler.failures) == {str(path) for path in bad.values()}
+    # every one of them is caught by the checks, with a message saying what is wrong
+    assert all(error.startswith("ValueError: ") for error in compiler.failures.values())
+    assert "logic is not an object" in compiler.failures[str(bad["null logic"])]
+    assert "unknown question q9" in compiler.failures[str(bad["dangling go_to"])]
+    for path in bad.values():
+        with pytest.raises(KeyError):
+            compiler.survey(path)
+
+    # failed sources are not in the index, the next build tries them again
+    compiler = PayloadCompiler(path=tmp_path / "compiled", workers=workers)
+    assert compiler.build([("survey", good), ("survey", bad["null logic"])]) == (0, 1)
+    assert list(compiler.failures) == [str(bad["null logic"])]
@@ -0,0 +1,97 @@
+import os
+import uuid
+
+from datetime import datetime, timezone
+
+import pytest
+
+from src.postgres_sink import PostgresSink, create_standin_table
+
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+
+needs_database = pytest.mark.skipif(not DATABASE_URL, reason="DATABASE_URL is not set")
+
+
+def _payload(i, survey_id="survey"):
+
+    now = datetime.now(timezone.utc).isoformat()
+    return {
+        "createdAt": now,
+        "updatedAt": now,
+        "finished": True,
+        "language": "en",
+        "surveyId": survey_id,
+        "data": {"q1": i, "q2": f"answer \"{i}\" with a \\ and a\ttab"},
+    }
+
+
+# A stand-in table in a schema of its own, dropped with everything in it afterwards
+@pytest.fixture
+def table():
+
+    psycopg = pytest.importorskip("psycopg")
+    schema = f"formbricks_test_{uuid.uuid4().hex[:12]}"
+    with psycopg.connect(DATABASE_URL, autocommit=True) as conn:
+        table = create_standin_table(conn, schema)
+    try:
+        yield psycopg, table
+    finally:
+        with psycopg.connect(DATABASE_URL, autocommit=True) as conn:
+            conn.execute(f"DROP SCHEMA {schema} CASCADE")
+
+
+@needs_database
+def test_copy_stores_every_response(table):
+
+    psycopg, table = table
+    sink = PostgresSink(DATABASE_URL, batch_size=40, table=table)
+    stored = []
+    try:
+        summary = sink.upload(((i, _payload(i)) for i in range(100)), on_success=stored.append)
+    finally:
+        sink.close()
+
+    assert (summary.succeeded, summary.failed) == (100, 0)
+    assert stored == list(range(100))
+    # 40 + 40 + 20
+    assert len(summary.latencies) == 3
+
+    with psycopg.connect(DATABASE_URL) as conn:
+        rows = conn.execute(f'SELECT "id", "surveyId", "data", "finished" FROM {table} ORDER BY ("data"->>\'q1\')::int').fetchall()
+    assert [data for _, _, data, _ in rows] == [_payload(i)["data"] for i in range(100)]
+    assert all(survey_id == "survey" and finished for _, survey_id, _, finished in rows)
+    assert all(len(id) == 25 and id.startswith("c") for id, _, _, _ in rows)
+
+
+@needs_database
+def test_failed_batch_is_counted_and_the_next_ones_go_through(table):
+
+    psycopg, table = table
+    sink = PostgresSink(DATABASE_URL, batch_size=10, table=table)
+    results = []
+    try:
+        # the NOT NULL "surveyId" fails the whole second batch, and only it
+        summary = sink.upload(
+            ((i, _payload(i, None if i == 15 else "survey")) for i in range(30)), on_result=results.append
+        )
+    finally:
+        sink.close()
+
+    assert (summary.succeeded, summary.failed) == (20, 10)
+    assert summary.errors == {"23502": 10}
+    assert results == [True] * 10 + [False] * 10 + [True] * 10
+
+    with psycopg.connect(DATABASE_URL) as conn:
+        assert conn.execute(f"SELECT count(*) FROM {table}").fetchone()[0] == 20
+
+
+def test_unreachable_database_fails_every_batch():
+
+    pytest.importorskip("psycopg")
+    # nothing listens on port 1, the connection is refused straight away
+    sink = PostgresSink("postgresql://localhost:1/formbricks?connect_timeout=5", batch_size=4)
+    summary = sink.upload((i, _payload(i)) for i in range(10))
+
+    assert (summary.succeeded, summary.failed) == (0, 10)
+    assert list(summary.errors) == ["OperationalError"]
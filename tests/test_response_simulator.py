@@ -0,0 +1,40 @@
+import json
+
+from src.fake_servers import FAKE_SURVEY
+
+
+SURVEYS = ("s0", "s1", "s2")
+
+
+def _simulate(workdir, monkeypatch, ids=None, seed=7):
+
+    from src.response_simulator import ResponseSimulator
+
+    (workdir / "surveys").mkdir(parents=True, exist_ok=True)
+    for id in SURVEYS:
+        with open(workdir / "surveys" / f"survey_{id}.json", "w") as f:
+            json.dump(FAKE_SURVEY, f)
+    monkeypatch.chdir(workdir)
+    return ResponseSimulator(seed=seed, name_pool_size=200, batch_size=64).simulate(300, ids=ids)
+
+
+def _answers(workdir, id):
+    return (workdir / "answers" / f"answers_{id}.jsonl").read_text()
+
+
+def test_a_survey_gets_the_same_answers_alone_or_with_others(tmp_path, monkeypatch):
+
+    assert _simulate(tmp_path / "all", monkeypatch)
+    assert _simulate(tmp_path / "one", monkeypatch, ids=["s2"])
+
+    assert _answers(tmp_path / "one", "s2") == _answers(tmp_path / "all", "s2")
+    # same survey, different id, different answers
+    assert _answers(tmp_path / "all", "s1") != _answers(tmp_path / "all", "s2")
+    assert len(_answers(tmp_path / "one", "s2").splitlines()) == 300
+
+
+def test_unknown_survey(tmp_path, monkeypatch, capsys):
+
+    assert _simulate(tmp_path, monkeypatch, ids=["s1", "s9"]) is False
+    assert "No generated survey s9" in capsys.readouterr().out
+    assert not (tmp_path / "answers").exists()
@@ -0,0 +1,21 @@
+import pytest
+
+from src.bench import STARTUP_BUDGET_MS, STARTUP_COMMANDS, _import_time
+
+
+# Import time varies from run to run, the best of a few runs is what the code costs
+RUNS = 3
+
+
+@pytest.mark.parametrize("args", STARTUP_COMMANDS, ids=" ".join)
+def test_startup_stays_within_budget(args):
+
+    timings = []
+    for _ in range(RUNS):
+        import_ms, heavy = _import_time(args)
+        assert not heavy, f"main.py {' '.join(args)} imports {', '.join(heavy)}, they belong in the command handlers"
+        timings.append(import_ms)
+
+    assert min(timings) <= STARTUP_BUDGET_MS, (
+        f"main.py {' '.join(args)} spends {min(timings):.1f} ms importing, the budget is {STARTUP_BUDGET_MS} ms"
+    )
@@ -0,0 +1,163 @@
+from src.survey_logic import LogicReport, SurveyLogicGraph, condition_holds
+
+
+def _question(qid, qtype="rating", required=True, conditions=(), **config):
+
+    return {
+        "question_id": qid,
+        "question_type": qtype,
+        "question_text": f"Question {qid}",
+        "config": config or {"rating": {"min_value": 1, "max_value": 5}},
+        "logic": {"required": required, "conditions": [{"if": {"id": qid, **rule}} for rule in conditions]},
+    }
+
+
+def _survey(*questions):
+    return {"survey": {"name": "Fixture", "questions": list(questions)}}
+
+
+def _report(graph, respondents):
+
+    report = LogicReport("fixture", graph)
+    for user_id, answers in respondents.items():
+        report.add(user_id, *graph.check_respondent(answers))
+    return report
+
+
+# q1 <= 3 goes to q2 (what to improve), > 3 skips to q3 (what was liked)
+BRANCHING = _survey(
+    _question("q1", conditions=[
+        {"operator": "<=", "value": 3, "go_to": "q2"},
+        {"operator": ">", "value": 3, "go_to": "q3"},
+    ]),
+    _question("q2", "openText", required=False, conditions=[{"operator": "submitted", "go_to": "q4"}], text={}),
+    _question("q3", "openText", required=False, text={}),
+    _question("q4", "openText", required=False, text={}),
+)
+
+
+def test_conditions():
+
+    assert condition_holds("<=", 3, 3) and not condition_holds("<", 3, 3)
+    assert condition_holds("==", 4, "4")
+    assert condition_holds("selected", ["A", "B"], "B") and condition_holds("selected", "A", "A")
+    assert condition_holds("submitted", "text", None) and not condition_holds("submitted", "", None)
+    # a numeric comparison against a text answer does not hold, it does not raise
+    assert not condition_holds(">", "great", 3)
+
+
+def test_valid_survey_paths():
+
+    graph = SurveyLogicGraph(BRANCHING)
+    assert graph.errors == [] and graph.unreachable == []
+
+    assert graph.visible_path({"q1": 2, "q2": "faster"}) == ["q1", "q2", "q4"]
+    assert graph.visible_path({"q1": 2}) == ["q1", "q2", "q3", "q4"]
+    assert graph.visible_path({"q1": 5}) == ["q1", "q3", "q4"]
+
+    report = _report(graph, {
+        "user_1": {"q1": 5, "q3": "speed", "q4": "none"},
+        "user_2": {"q1": 1, "q2": "price", "q4": "none"},
+    })
+    assert report.ok and report.violating == 0 and report.missing_required == 0
+
+
+def test_hidden_and_missing_answers():
+
+    graph = SurveyLogicGraph(BRANCHING)
+    # q1 = 5 hides q2, q1 is required
+    assert graph.check_respondent({"q1": 5, "q2": "price"}) == (["q2"], [])
+    assert graph.check_respondent({"q3": "speed"}) == ([], ["q1"])
+    assert graph.check_respondent({"q1": 5, "q9": "?"}) == (["q9"], [])
+
+    report = _report(graph, {"user_1": {"q1": 5, "q2": "price"}, "user_2": {"q1": 4}, "user_3": {}})
+    assert not report.ok
+    assert (report.respondents, report.violating, report.missing_required) == (3, 1, 1)
+    assert report.samples == [("user_1", ["q2"])]
+    assert "user_1 answered hidden q2" in str(report)
+
+
+def test_dangling_go_to():
+
+    graph = SurveyLogicGraph(_survey(
+        _question("q1", conditions=[{"operator": ">", "value": 3, "go_to": "q7"}]),
+        _question("q2"),
+    ))
+    assert graph.dangling == [("q1", "q7")]
+    assert graph.errors == ["q1 jumps to unknown question q7"]
+    # the dangling rule is dropped, every answer falls through to q2
+    assert graph.visible_path({"q1": 5}) == ["q1", "q2"]
+
+    report = _report(graph, {"user_1": {"q1": 5, "q2": 1}})
+    assert report.violating == 0 and not report.ok
+    assert "q1 jumps to unknown question q7" in str(report)
+
+
+def test_invalid_conditions():
+
+    graph = SurveyLogicGraph(_survey(
+        _question("q1", conditions=[{"operator": "~", "value": 3, "go_to": "q2"}, {"operator": ">", "go_to": "q2"}]),
+        _question("q2"),
+    ))
+    assert graph.errors == ["q1 uses operator '~', Formbricks has no equivalent", "q1 uses operator > without a value"]
+    assert graph.rules == [[], []]
+
+
+def test_unreachable_questions():
+
+    # every rating jumps over q2: the rules cover the whole 1-5 range
+    graph = SurveyLogicGraph(_survey(
+        _question("q1", conditions=[
+            {"operator": "<=", "value": 3, "go_to": "q3"},
+            {"operator": ">", "value": 3, "go_to": "q3"},
+        ]),
+        _question("q2"),
+        _question("q3"),
+    ))
+    assert graph.unreachable == ["q2"]
+    # unreachable is reported, it is not an error
+    assert graph.errors == []
+    assert "unreachable questions: q2" in str(_report(graph, {}))
+
+    # a "submitted" jump on a required text question always holds
+    graph = SurveyLogicGraph(_survey(
+        _question("q1", "openText", conditions=[{"operator": "submitted", "go_to": "q3"}], text={}),
+        _question("q2"),
+        _question("q3"),
+    ))
+    assert graph.unreachable == ["q2"]
+
+    # a rating the rules miss, or an optional question left blank, falls through
+    for required, conditions in ((True, [{"operator": ">", "value": 1, "go_to": "q3"}]),
+                                 (False, [{"operator": ">=", "value": 1, "go_to": "q3"}])):
+        graph = SurveyLogicGraph(_survey(_question("q1", required=required, conditions=conditions), _question("q2"), _question("q3")))
+        assert graph.unreachable == []
+
+
+def test_cycles():
+
+    # q3 jumps back to q2 when rated low
+    graph = SurveyLogicGraph(_survey(
+        _question("q1"),
+        _question("q2"),
+        _question("q3", conditions=[{"operator": "<", "value": 3, "go_to": "q2"}]),
+    ))
+    assert graph.cycles == [["q2", "q3", "q2"]]
+    assert graph.errors == ["logic cycle q2 -> q3 -> q2"]
+    # a respondent stuck in the loop still gets a finite path
+    assert graph.visible_path({"q1": 1, "q2": 1, "q3": 1}) == ["q1", "q2", "q3"]
+
+    # a self loop
+    graph = SurveyLogicGraph(_survey(_question("q1", conditions=[{"operator": "==", "value": 1, "go_to": "q1"}])))
+    assert graph.cycles == [["q1", "q1"]]
+
+
+def test_malformed_survey_is_an_error():
+
+    survey = _survey(_question("q1"))
+    survey["survey"]["questions"][0]["logic"] = None
+    graph = SurveyLogicGraph(survey)
+
+    assert graph.errors == ["malformed survey: q1: logic is not an object"]
+    report = _report(graph, {"user_1": {"q1": 3}})
+    assert not report.ok
@@ -0,0 +1,56 @@
+import pytest
+
+from src.bench import _prepare_workdir
+from src.fake_servers import FakeOpenAI
+from src.token_scheduler import TokenScheduler
+
+
+# 4 surveys and 5 users each make 8 requests of about 6,200 tokens, a little over a minute's
+# worth of these quotas: the scheduler has to hold requests back for a few seconds
+SURVEYS = 4
+TPM = 6000
+RPM = 8
+
+
+# Most the fake's quota lets through between two admitted requests: the full bucket, plus what refilled in between
+def _over_budget(admitted, per_minute, cost):
+
+    over = []
+    for i, (start, _) in enumerate(admitted):
+        used = 0
+        for end, tokens in admitted[i:]:
+            used += cost(tokens)
+            if used > per_minute * (1 + (end - start) / 60.0):
+                over.append((start, end, used))
+    return over
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+
+    _prepare_workdir(tmp_path, SURVEYS)
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def test_generate_stays_under_the_quota_of_fake_openai(workdir, monkeypatch):
+
+    from src.data_generator import DataGenerator
+
+    with FakeOpenAI(tpm=TPM, rpm=RPM) as openai:
+        monkeypatch.setenv("OPEN_AI_KEY", "test")
+        monkeypatch.setenv("OPEN_AI_BASE_URL", f"{openai.url}/v1")
+
+        scheduler = TokenScheduler(tpm=TPM, rpm=RPM)
+        generator = DataGenerator(concurrency=4, scheduler=scheduler)
+        assert not generator.generate(n=5)
+
+    assert openai.rate_limited == 0
+    assert len(openai.admitted) == 2 * SURVEYS
+    # the run did need more than the quota, or nothing here was tested
+    assert openai.tokens_served > TPM * 0.95
+    assert scheduler.waited > 0
+
+    assert not _over_budget(openai.admitted, TPM, lambda tokens: tokens)
+    assert not _over_budget(openai.admitted, RPM, lambda tokens: 1)
+    assert len(list(workdir.glob("answers/answers_*.jsonl"))) == SURVEYS